@@ -0,0 +1,175 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.ai.production_counter import BeerCounterEngine, reference_fingerprint
+
+# --- CONFIGURACIÓN ---
+DEFAULT_REFS = os.path.join("src", "ai", "referencias")   # Misma calibración que usa la API
+DEFAULT_COORDS = os.path.join(DEFAULT_REFS, "coords_dual.txt")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".ts", ".h264")
+RESULTS_FILE = "results.jsonl"     # Un resultado por vídeo (sin la lista de eventos)
+EVENTS_FILE = "events.jsonl"       # Una tirada por línea, con el vídeo de origen
+MANIFEST_FILE = "manifest.jsonl"   # Vídeos terminados: permite reanudar sin repetirlos
+CHECKPOINT_DIR = "checkpoints"     # Puntos de control de los vídeos en curso
+TRACE_DIR = "traces"               # Trazas de scores (recálculo con otras reglas: score_trace)
+
+# --- PROCESADO POR LOTES SIN PASAR POR LA API ---
+# Cada vídeo se analiza entero en un proceso del pool (análisis secuencial dentro del
+# proceso: el paralelismo está entre vídeos). Al terminar cada uno se añaden sus líneas
+# a los JSONL y al manifiesto; los vídeos en curso guardan puntos de control, así que
+# cortar la ejecución no pierde nada: la siguiente sigue cada vídeo donde se quedó.
+
+def find_videos(inputs):
+    """Directorios (recursivo), globs o ficheros sueltos -> lista ordenada de vídeos"""
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                found.update(os.path.join(root, f) for f in files if f.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(item):
+            found.add(item)
+        else:
+            found.update(p for p in glob.glob(item, recursive=True) if os.path.isfile(p))
+    return sorted(os.path.abspath(p) for p in found)
+
+def manifest_key(path, fingerprint):
+    """Un vídeo está hecho si no ha cambiado (ruta, tamaño, mtime) ni la calibración"""
+    st = os.stat(path)
+    return f"{path}|{st.st_size}|{int(st.st_mtime)}|{fingerprint}"
+
+def load_manifest(out_dir):
+    done = set()
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["key"])
+                except (ValueError, KeyError):
+                    continue # Línea cortada por una interrupción
+    return done
+
+def _digest(video_path):
+    return hashlib.sha256(video_path.encode()).hexdigest()[:16]
+
+def checkpoint_path(out_dir, video_path):
+    return os.path.join(out_dir, CHECKPOINT_DIR, f"{_digest(video_path)}.json")
+
+def trace_path(out_dir, video_path):
+    return os.path.join(out_dir, TRACE_DIR, _digest(video_path))
+
+def _analyze(video_path, coords_file, refs_folder, verbose, checkpoint, trace):
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    start = time.perf_counter()
+    engine = BeerCounterEngine(coords_file, refs_folder)
+    results = engine.process_video(video_path, workers=1, checkpoint_path=checkpoint, trace_path=trace)
+    return results, time.perf_counter() - start
+
+def run_batch(inputs, out_dir, coords_file=DEFAULT_COORDS, refs_folder=DEFAULT_REFS, workers=0, verbose=False):
+    os.makedirs(os.path.join(out_dir, CHECKPOINT_DIR), exist_ok=True)
+    fingerprint = reference_fingerprint(coords_file, refs_folder)
+    done = load_manifest(out_dir)
+
+    videos = find_videos(inputs)
+    pending = []
+    for path in videos:
+        key = manifest_key(path, fingerprint)
+        if key not in done:
+            pending.append((path, key))
+    skipped = len(videos) - len(pending)
+    print(f"📂 LOTE: {len(pending)} vídeos pendientes, {skipped} ya procesados")
+
+    stats = {"videos": 0, "failed": 0, "skipped": skipped, "video_seconds": 0.0,
+             "frames": 0, "beers": 0, "events": 0, "cpu_seconds": 0.0}
+    if not pending:
+        return stats
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    ctx = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+
+    with open(os.path.join(out_dir, RESULTS_FILE), "a") as results_out, \
+         open(os.path.join(out_dir, EVENTS_FILE), "a") as events_out, \
+         open(os.path.join(out_dir, MANIFEST_FILE), "a") as manifest_out, \
+         ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = {
+            pool.submit(_analyze, path, coords_file, refs_folder, verbose,
+                        checkpoint_path(out_dir, path), trace_path(out_dir, path)): (path, key)
+            for path, key in pending
+        }
+
+        for n, future in enumerate(as_completed(futures), 1):
+            path, key = futures[future]
+            try:
+                results, seconds = future.result()
+            except Exception as e:
+                results, seconds = {"error": str(e)}, 0.0
+
+            record = {"video": path, "fingerprint": fingerprint, "analysis_seconds": round(seconds, 2)}
+            if "error" in results:
+                # Los fallidos no entran en el manifiesto: se reintentan en la próxima ejecución
+                stats["failed"] += 1
+                record["error"] = results["error"]
+                results_out.write(json.dumps(record) + "\n")
+                results_out.flush()
+                print(f"❌ [{n}/{len(pending)}] {os.path.basename(path)}: {results['error']}")
+                continue
+
+            events = results.get("events", [])
+            record.update({k: v for k, v in results.items() if k != "events"})
+            results_out.write(json.dumps(record) + "\n")
+            for evt in events:
+                events_out.write(json.dumps({"video": path, **evt}) + "\n")
+            results_out.flush()
+            events_out.flush()
+            # El manifiesto se escribe el último: si se corta antes, el vídeo se repite entero
+            manifest_out.write(json.dumps({"key": key, "video": path, "total": results["total"]}) + "\n")
+            manifest_out.flush()
+
+            stats["videos"] += 1
+            stats["video_seconds"] += results.get("video_duration", 0.0)
+            stats["frames"] += results.get("profile", {}).get("frames_total", 0)
+            stats["beers"] += results["total"]
+            stats["events"] += len(events)
+            stats["cpu_seconds"] += seconds
+            print(f"✅ [{n}/{len(pending)}] {os.path.basename(path)}: {results['total']} cervezas "
+                  f"({results.get('video_duration', 0.0):.0f}s de vídeo en {seconds:.1f}s)")
+
+    stats["wall_seconds"] = time.perf_counter() - start
+    stats["workers"] = workers
+    return stats
+
+def print_summary(stats):
+    wall = stats.get("wall_seconds", 0.0)
+    print("-" * 60)
+    print(f"📊 LOTE: {stats['videos']} vídeos analizados, {stats['failed']} fallidos, {stats['skipped']} omitidos")
+    if not wall:
+        return
+    print(f"   {stats['video_seconds'] / 3600:.2f} h de vídeo en {wall:.1f}s con {stats['workers']} procesos "
+          f"-> {stats['video_seconds'] / wall:.1f}x tiempo real")
+    print(f"   {stats['frames'] / wall:.0f} frames/s | {stats['beers']} cervezas en {stats['events']} tiradas")
+
+def main():
+    parser = argparse.ArgumentParser(description="Análisis por lotes de grabaciones (sin pasar por la API)")
+    parser.add_argument("inputs", nargs="+", help="Directorios, globs (entre comillas) o ficheros de vídeo")
+    parser.add_argument("--out", required=True, help=f"Carpeta de salida ({RESULTS_FILE}, {EVENTS_FILE}, {MANIFEST_FILE})")
+    parser.add_argument("--coords", default=DEFAULT_COORDS, help="Fichero de coordenadas de los grifos")
+    parser.add_argument("--refs", default=DEFAULT_REFS, help="Carpeta de referencias")
+    parser.add_argument("--workers", type=int, default=0, help="Procesos en paralelo (0 = todos los núcleos)")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar la salida del motor")
+    args = parser.parse_args()
+
+    stats = run_batch(args.inputs, args.out, args.coords, args.refs, args.workers, args.verbose)
+    print_summary(stats)
+    sys.exit(1 if stats["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import cv2
+import numpy as np
+import os
+import sys
+import time
+import json
+import argparse
+import resource
+import multiprocessing
+import traceback
+
+from src.ai.production_counter import BeerCounterEngine, beers_for_duration, tap_names, MIN_POUR_SECONDS
+
+# --- CONFIGURACIÓN ---
+BENCH_DIR = "bench_data"          # Vídeos sintéticos generados (se reutilizan entre ejecuciones)
+STATE_LEVELS = {"closed": 40, "beer": 140, "foam": 225}  # Gris medio del patrón de cada estado
+PATTERN_NOISE = 25                # Textura de los patrones
+FRAME_NOISE = 6                   # Ruido por frame sobre todo el vídeo
+NOISE_FRAMES = 8                  # Capas de ruido precalculadas (generar 1080p frame a frame es lento)
+FOAM_SECONDS = 0.6                # Espuma tras cada tirada, antes de cerrar
+DRIP_PROBABILITY = 0.15           # Goteos (< MIN_POUR_SECONDS): no deben contar
+
+# Escenarios: (ancho, alto, fps, segundos, grifos)
+PROFILES = {
+    "quick": [(640, 360, 25, 60, 2), (1280, 720, 25, 120, 2)],
+    "full": [(640, 360, 25, 60, 2), (1280, 720, 25, 300, 2), (1920, 1080, 25, 300, 2), (1280, 720, 25, 600, 6)],
+}
+STAGES = ["decode", "analysis_sequential", "analysis_parallel", "repair_transcode", "repair_analyze_fused"]
+
+# --- GENERADOR DE VÍDEOS SINTÉTICOS ---
+
+def make_schedule(num_frames, fps, num_taps, rng):
+    """Tiradas aleatorias por grifo (en frames), todas cerradas antes del final del vídeo"""
+    foam = int(FOAM_SECONDS * fps)
+    pours = []
+    for name in tap_names(num_taps):
+        frame = int(rng.uniform(1, 10) * fps)
+        while True:
+            if rng.random() < DRIP_PROBABILITY:
+                seconds = rng.uniform(0.3, MIN_POUR_SECONDS * 0.8)
+            else:
+                seconds = rng.uniform(MIN_POUR_SECONDS + 1, 40)
+            end = frame + int(seconds * fps)
+            if end + foam + fps >= num_frames: break
+            pours.append({"tap": name, "start_frame": frame, "end_frame": end})
+            frame = end + foam + int(rng.uniform(3, 30) * fps)
+    return pours
+
+def _tap_rois(width, height, num_taps):
+    rois = []
+    for i in range(num_taps):
+        x = int(width * 0.1 + i * (width * 0.8 / num_taps))
+        y = int(height * 0.4)
+        rois.append((x, y, max(8, int(width * 0.04)), max(8, int(height * 0.1))))
+    return rois
+
+def make_synthetic_video(out_dir, width, height, fps, seconds, num_taps=2, seed=0):
+    """
+    Escribe en `out_dir` un vídeo con patrones conocidos de cerrado/cerveza/espuma en
+    las ROIs de los grifos, su `coords_dual.txt`, las referencias y `truth.json` con
+    las tiradas reales. Si ya existe con los mismos parámetros, se reutiliza.
+    """
+    params = {"width": width, "height": height, "fps": fps, "seconds": seconds, "taps": num_taps, "seed": seed}
+    truth_path = os.path.join(out_dir, "truth.json")
+    if os.path.exists(truth_path):
+        with open(truth_path) as f:
+            truth = json.load(f)
+        if truth["params"] == params:
+            return truth
+
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    num_frames = int(seconds * fps)
+    names = tap_names(num_taps)
+    rois = _tap_rois(width, height, num_taps)
+    pours = make_schedule(num_frames, fps, num_taps, rng)
+
+    patterns = {}
+    for name, (x, y, w, h) in zip(names, rois):
+        for state, level in STATE_LEVELS.items():
+            gray = np.clip(level + rng.normal(0, PATTERN_NOISE, (h, w)), 0, 255).astype(np.uint8)
+            patterns[(name, state)] = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+            # Referencia como la guarda generate_refs: gris + blur
+            cv2.imwrite(os.path.join(out_dir, f"{name}_{state}.jpg"), cv2.GaussianBlur(gray, (5, 5), 0))
+
+    with open(os.path.join(out_dir, "coords_dual.txt"), "w") as f:
+        f.write("|".join(",".join(map(str, roi)) for roi in rois) + f"|{width},{height}")
+
+    # Estado de cada grifo en cada frame
+    timeline = np.zeros((num_taps, num_frames), dtype=np.uint8) # 0 cerrado, 1 cerveza, 2 espuma
+    foam = int(FOAM_SECONDS * fps)
+    for pour in pours:
+        t = names.index(pour["tap"])
+        timeline[t, pour["start_frame"]:pour["end_frame"]] = 1
+        timeline[t, pour["end_frame"]:pour["end_frame"] + foam] = 2
+
+    background = np.clip(rng.normal(100, 30, (height, width, 3)), 0, 255).astype(np.uint8)
+    noise = [rng.integers(0, FRAME_NOISE, background.shape, dtype=np.uint8) for _ in range(NOISE_FRAMES)]
+    states = list(STATE_LEVELS)
+
+    print(f"🎞️ Generando {width}x{height} @ {fps}fps, {seconds}s, {num_taps} grifos -> {out_dir}")
+    writer = cv2.VideoWriter(os.path.join(out_dir, "v.mp4"), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for frame_idx in range(num_frames):
+        frame = background + noise[frame_idx % NOISE_FRAMES]
+        for t, (name, (x, y, w, h)) in enumerate(zip(names, rois)):
+            frame[y:y+h, x:x+w] = patterns[(name, states[timeline[t, frame_idx]])]
+        writer.write(frame)
+    writer.release()
+
+    events = []
+    for pour in pours:
+        start, end = pour["start_frame"] / fps, pour["end_frame"] / fps
+        beers = beers_for_duration(end - start)
+        if beers:
+            events.append({"tap": pour["tap"], "start": round(start, 2), "end": round(end, 2),
+                           "duration": round(end - start, 2), "beers": beers})
+
+    truth = {
+        "params": params,
+        "frames": num_frames,
+        "taps": {name: sum(e["beers"] for e in events if e["tap"] == name) for name in names},
+        "events": events,
+        "drips": len(pours) - len(events),
+    }
+    with open(truth_path, "w") as f:
+        json.dump(truth, f, indent=1)
+    return truth
+
+# --- PRECISIÓN CONTRA LA VERDAD ---
+
+def score_accuracy(truth, results):
+    """Error de conteo por grifo y error de tiempos de las tiradas emparejadas por solape"""
+    taps = {}
+    for name, expected in truth["taps"].items():
+        detected = results["taps"].get(name, {}).get("count", 0)
+        taps[name] = {"expected": expected, "detected": detected}
+
+    start_errors, end_errors = [], []
+    missed = spurious = 0
+    for name in truth["taps"]:
+        real = [e for e in truth["events"] if e["tap"] == name]
+        found = [e for e in results["events"] if e["tap"] == name]
+        used = set()
+        for r in real:
+            best, best_overlap = None, 0.0
+            for i, d in enumerate(found):
+                overlap = min(r["end"], d["end"]) - max(r["start"], d["start"])
+                if i not in used and overlap > best_overlap:
+                    best, best_overlap = i, overlap
+            if best is None:
+                missed += 1
+                continue
+            used.add(best)
+            start_errors.append(abs(found[best]["start"] - r["start"]))
+            end_errors.append(abs(found[best]["end"] - r["end"]))
+        spurious += len(found) - len(used)
+
+    def stats(values):
+        return {"mean": round(float(np.mean(values)), 3), "max": round(float(np.max(values)), 3)} if values else None
+
+    return {
+        "expected_total": sum(t["expected"] for t in taps.values()),
+        "detected_total": sum(t["detected"] for t in taps.values()),
+        "count_error": sum(abs(t["expected"] - t["detected"]) for t in taps.values()),
+        "taps": taps,
+        "missed_pours": missed,
+        "spurious_pours": spurious,
+        "start_error_s": stats(start_errors),
+        "end_error_s": stats(end_errors),
+    }
+
+# --- ETAPAS DEL PIPELINE ---
+
+def _engine(scenario_dir):
+    return BeerCounterEngine(os.path.join(scenario_dir, "coords_dual.txt"), scenario_dir)
+
+def _stage_decode(scenario_dir):
+    cap = cv2.VideoCapture(os.path.join(scenario_dir, "v.mp4"))
+    while cap.read()[0]:
+        pass
+    cap.release()
+    return None
+
+def _stage_analysis_sequential(scenario_dir):
+    return _engine(scenario_dir).process_video(os.path.join(scenario_dir, "v.mp4"), workers=1)
+
+def _stage_analysis_parallel(scenario_dir):
+    return _engine(scenario_dir).process_video(os.path.join(scenario_dir, "v.mp4"), workers=0)
+
+def _stage_repair_transcode(scenario_dir):
+    from src.backend.video_fixer import fix_video_for_web
+    fixed = os.path.join(scenario_dir, fix_video_for_web(os.path.join(scenario_dir, "v.mp4")))
+    os.remove(fixed)
+    return None
+
+def _stage_repair_analyze_fused(scenario_dir):
+    from src.backend.video_fixer import WebVideoWriter
+    video_path = os.path.join(scenario_dir, "v.mp4")
+    writer = WebVideoWriter(video_path)
+    try:
+        return _engine(scenario_dir).process_video(video_path, workers=1, frame_sink=writer.write)
+    finally:
+        writer.close(keep=False)
+
+STAGE_FUNCTIONS = {
+    "decode": _stage_decode,
+    "analysis_sequential": _stage_analysis_sequential,
+    "analysis_parallel": _stage_analysis_parallel,
+    "repair_transcode": _stage_repair_transcode,
+    "repair_analyze_fused": _stage_repair_analyze_fused,
+}
+
+def _peak_rss_mb():
+    # ru_maxrss en KB (Linux). Incluye los procesos hijos (modo paralelo).
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+def _stage_child(stage, scenario_dir, conn, verbose):
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        base_rss = _peak_rss_mb()
+        start = time.perf_counter()
+        results = STAGE_FUNCTIONS[stage](scenario_dir)
+        wall = time.perf_counter() - start
+        conn.send({"wall": wall, "peak_rss_mb": _peak_rss_mb(), "base_rss_mb": base_rss, "results": results})
+    except Exception:
+        conn.send({"error": traceback.format_exc()})
+
+def run_stage(stage, scenario_dir, frames, verbose=False):
+    """
+    Ejecuta una etapa en un proceso limpio ('spawn'): así el pico de memoria es solo
+    el de esa etapa. Devuelve wall time, frames/s, pico de RSS y resultados.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_child, args=(stage, scenario_dir, child_conn, verbose))
+    proc.start()
+    out = parent_conn.recv()
+    proc.join()
+    if "error" in out:
+        raise RuntimeError(f"Etapa {stage} fallida:\n{out['error']}")
+
+    return {
+        "wall_seconds": round(out["wall"], 3),
+        "fps": round(frames / out["wall"], 1) if out["wall"] > 0 else None,
+        "peak_rss_mb": round(out["peak_rss_mb"], 1),
+        "stage_rss_mb": round(out["peak_rss_mb"] - out["base_rss_mb"], 1),
+        "results": out["results"],
+    }
+
+# --- INFORME ---
+
+def _counts(results):
+    return {name: info["count"] for name, info in results["taps"].items()}
+
+def compare_to_baseline(report, baseline):
+    """Cambios de conteo o de tiradas respecto a un informe anterior (misma escena y etapa)"""
+    changes = []
+    for name, scenario in report["scenarios"].items():
+        old_scenario = baseline.get("scenarios", {}).get(name)
+        if old_scenario is None: continue
+        for stage, data in scenario["stages"].items():
+            old = old_scenario["stages"].get(stage)
+            if not old or not data.get("results") or not old.get("results"): continue
+            if _counts(data["results"]) != _counts(old["results"]):
+                changes.append(f"{name}/{stage}: conteo {_counts(old['results'])} -> {_counts(data['results'])}")
+            elif data["results"]["events"] != old["results"]["events"]:
+                changes.append(f"{name}/{stage}: mismas cervezas pero tiradas distintas")
+    return changes
+
+def run_benchmark(profile="quick", stages=STAGES, bench_dir=BENCH_DIR, verbose=False):
+    report = {"profile": profile, "cpu_count": os.cpu_count(), "scenarios": {}, "inconsistent": []}
+
+    for width, height, fps, seconds, num_taps in PROFILES[profile]:
+        name = f"{width}x{height}_{seconds}s_{num_taps}taps"
+        scenario_dir = os.path.join(bench_dir, name)
+        truth = make_synthetic_video(scenario_dir, width, height, fps, seconds, num_taps)
+        scenario = {"frames": truth["frames"], "expected_total": sum(truth["taps"].values()), "stages": {}}
+
+        for stage in stages:
+            data = run_stage(stage, scenario_dir, truth["frames"], verbose)
+            if data["results"] is not None:
+                data["accuracy"] = score_accuracy(truth, data["results"])
+            scenario["stages"][stage] = data
+
+            line = f"   {stage:<22} {data['wall_seconds']:>8.2f}s {data['fps']:>9} fps {data['peak_rss_mb']:>8.1f} MB"
+            if "accuracy" in data:
+                acc = data["accuracy"]
+                start_err = acc["start_error_s"]["max"] if acc["start_error_s"] else "-"
+                line += f" | {acc['detected_total']}/{acc['expected_total']} cervezas, error inicio máx {start_err}s"
+            print(line)
+
+        # Todas las etapas de análisis deben dar exactamente lo mismo (salvo el perfil de tiempos)
+        analyzed = [
+            {k: v for k, v in d["results"].items() if k != "profile"}
+            for d in scenario["stages"].values() if d["results"] is not None
+        ]
+        if len({json.dumps(r, sort_keys=True) for r in analyzed}) > 1:
+            report["inconsistent"].append(name)
+            print(f"❌ {name}: las etapas de análisis no coinciden entre sí")
+
+        report["scenarios"][name] = scenario
+        print(f"📊 {name}: {truth['frames']} frames, {scenario['expected_total']} cervezas reales")
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark y precisión del contador sobre vídeos sintéticos")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Etapas separadas por comas ({','.join(STAGES)})")
+    parser.add_argument("--bench-dir", default=BENCH_DIR, help="Carpeta de los vídeos sintéticos")
+    parser.add_argument("--out", help="Guardar el informe JSON en este fichero")
+    parser.add_argument("--baseline", help="Informe JSON anterior: falla si cambia algún conteo")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar la salida del motor")
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Etapas desconocidas: {', '.join(sorted(unknown))}")
+
+    report = run_benchmark(args.profile, stages, args.bench_dir, args.verbose)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"💾 Informe guardado en {args.out}")
+
+    failed = bool(report["inconsistent"])
+    if args.baseline:
+        with open(args.baseline) as f:
+            changes = compare_to_baseline(report, json.load(f))
+        for change in changes:
+            print(f"❌ {change}")
+        failed = failed or bool(changes)
+        if not changes:
+            print("✅ Sin cambios de conteo respecto a la referencia")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import sys
+import argparse
+import cv2
+import numpy as np
+
+from src.ai.production_counter import BeerCounterEngine, STATES, BANK_SUFFIX, BLUR_KERNEL
+from src.ai.frame_cache import FrameCache
+
+# --- CONFIGURACIÓN ---
+CALIBRATION_SAMPLES = 600     # Frames muestreados (repartidos por todo el vídeo)
+PROTOTYPES_PER_STATE = 4      # Máximo de prototipos nuevos por grifo y estado
+MIN_CLUSTER_SAMPLES = 10      # Muestras mínimas por prototipo (menos = ruido, no un estado)
+KMEANS_ATTEMPTS = 3
+
+# --- CALIBRACIÓN SIN INTERFAZ ---
+# Parte de una calibración que ya funciona (coords + plantillas de generate_refs.py)
+# y la amplía con la variación real de una grabación (p. ej. una noche entera con
+# cambios de luz): se muestrean recortes de cada ROI, se etiquetan por correlación
+# normalizada con las plantillas (insensible a ganancia y brillo, así que un recorte
+# oscurecido sigue cayendo en su estado) y los de cada estado se agrupan (k-means) en
+# unos pocos prototipos. Con --pca se guarda además una base PCA por grifo para
+# comparar en ese subespacio.
+
+def _normalized(rows):
+    rows = rows - rows.mean(axis=1, keepdims=True)
+    return rows / (np.linalg.norm(rows, axis=1, keepdims=True) + 1e-6)
+
+def label_crops(tap, crops):
+    """Estado de cada recorte: el del prototipo del grifo con mayor correlación normalizada"""
+    refs = _normalized(tap.bank.reshape(len(tap.bank), -1).astype(np.float64))
+    samples = _normalized(crops.reshape(len(crops), -1).astype(np.float64))
+    return tap.labels[np.argmax(samples @ refs.T, axis=1)]
+
+def sample_crops(engine, video_path, samples=CALIBRATION_SAMPLES, frame_cache=False):
+    """
+    Recortes preprocesados (gris + blur, como en el análisis) de cada ROI en
+    `samples` frames equiespaciados, con su estado (label_crops).
+    Con `frame_cache` los recortes salen de la caché de frames (frame_cache.py): la
+    primera vez decodifica el vídeo entero, y las siguientes (otro --per-state,
+    --pca o --samples) no tocan el vídeo.
+    Devuelve {grifo: (recortes (n, h, w) uint8, etiquetas (n,))}.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"No se pudo abrir el video: {video_path}")
+
+    vid_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    vid_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    window = engine._build_taps(vid_w, vid_h)
+    x0, y0, x1, y1 = window
+    valid = [
+        tap.bank is not None and tap.roi[0] >= 0 and tap.roi[1] >= 0
+        and tap.roi[0] + tap.roi[2] <= x1 - x0 and tap.roi[1] + tap.roi[3] <= y1 - y0
+        for tap in engine.taps
+    ]
+
+    cache = None
+    if frame_cache:
+        cap.release()
+        # ROIs en coordenadas del frame (las de los grifos son relativas a la ventana)
+        cache = FrameCache.open(video_path, [(x + x0, y + y0, w, h) for x, y, w, h in (tap.roi for tap in engine.taps)])
+        total_frames = cache.n_frames
+
+    crops = {tap.name: [] for tap in engine.taps}
+    for idx in np.linspace(0, max(total_frames - 1, 0), num=samples, dtype=np.int64):
+        if cache is not None:
+            for i, tap in enumerate(engine.taps):
+                if valid[i]:
+                    crops[tap.name].append(cache.roi_blurred(int(idx), i, BLUR_KERNEL))
+            continue
+
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+        ret, frame = cap.read()
+        if not ret: continue
+
+        gray = engine._preprocess(frame, window)
+        for tap, ok in zip(engine.taps, valid):
+            if ok:
+                x, y, w, h = tap.roi
+                crops[tap.name].append(gray[y:y+h, x:x+w].copy())
+    if cache is None:
+        cap.release()
+
+    sampled = {}
+    for tap in engine.taps:
+        if crops[tap.name]:
+            stack = np.stack(crops[tap.name])
+            sampled[tap.name] = (stack, label_crops(tap, stack))
+    return sampled
+
+def cluster_prototypes(crops, labels, per_state=PROTOTYPES_PER_STATE):
+    """Centros de k-means por estado -> (prototipos (p, h, w) uint8, etiquetas (p,))"""
+    h, w = crops.shape[1:]
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 50, 0.5)
+    prototypes, proto_labels = [], []
+    for code in range(len(STATES)):
+        samples = crops[labels == code].reshape(-1, h * w).astype(np.float32)
+        k = min(per_state, len(samples) // MIN_CLUSTER_SAMPLES)
+        if k < 1: continue
+        _, _, centers = cv2.kmeans(samples, k, None, criteria, KMEANS_ATTEMPTS, cv2.KMEANS_PP_CENTERS)
+        prototypes.append(np.clip(np.rint(centers), 0, 255).astype(np.uint8).reshape(k, h, w))
+        proto_labels += [code] * k
+
+    if not prototypes:
+        return np.empty((0, h, w), dtype=np.uint8), np.empty(0, dtype=np.int64)
+    return np.concatenate(prototypes), np.array(proto_labels, dtype=np.int64)
+
+def pca_components(crops, n_components):
+    """Base ortonormal (n_components, h*w) de la variación de los recortes"""
+    samples = crops.reshape(len(crops), -1).astype(np.float64)
+    n_components = min(n_components, len(samples) - 1, samples.shape[1])
+    if n_components < 1:
+        return np.empty((0, samples.shape[1]))
+    _, eigenvectors = cv2.PCACompute(samples, mean=None, maxComponents=n_components)
+    return eigenvectors
+
+def calibrate(video_path, coords_file, refs_folder, samples=CALIBRATION_SAMPLES,
+              per_state=PROTOTYPES_PER_STATE, n_components=0, out_folder=None, frame_cache=False):
+    """Genera `<grifo>_bank.npz` en `out_folder` (por defecto, la carpeta de referencias)"""
+    out_folder = out_folder or refs_folder
+    os.makedirs(out_folder, exist_ok=True)
+    engine = BeerCounterEngine(coords_file, refs_folder)
+    sampled = sample_crops(engine, video_path, samples, frame_cache)
+
+    summary = {}
+    for name, (crops, labels) in sampled.items():
+        prototypes, proto_labels = cluster_prototypes(crops, labels, per_state)
+        components = pca_components(crops, n_components) if n_components else np.empty((0, crops[0].size))
+        path = os.path.join(out_folder, f"{name}{BANK_SUFFIX}")
+        np.savez_compressed(path, prototypes=prototypes, labels=proto_labels, components=components)
+
+        per_state_counts = {state: int((proto_labels == code).sum()) for code, state in enumerate(STATES)}
+        seen = {state: int((labels == code).sum()) for code, state in enumerate(STATES)}
+        summary[name] = {"samples": seen, "prototypes": per_state_counts, "pca": len(components)}
+        print(f"✅ Grifo {name}: {len(crops)} muestras {seen} -> prototipos {per_state_counts}"
+              + (f", PCA {len(components)} componentes" if len(components) else ""))
+        print(f"💾 Banco guardado en {path}")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibración sin interfaz: banco de prototipos por grifo y estado")
+    parser.add_argument("video", help="Grabación con la variación a cubrir (p. ej. una noche entera)")
+    parser.add_argument("--coords", default=os.path.join("src", "ai", "referencias", "coords_dual.txt"))
+    parser.add_argument("--refs", default=os.path.join("src", "ai", "referencias"), help="Plantillas de partida")
+    parser.add_argument("--out", help="Carpeta donde guardar los bancos (por defecto, --refs)")
+    parser.add_argument("--samples", type=int, default=CALIBRATION_SAMPLES)
+    parser.add_argument("--per-state", type=int, default=PROTOTYPES_PER_STATE, help="Prototipos máximos por estado")
+    parser.add_argument("--pca", type=int, default=0, help="Componentes PCA (0 = comparar píxel a píxel)")
+    parser.add_argument("--frame-cache", action="store_true",
+                        help="Muestrear desde la caché de frames (se crea la primera vez): repetir con otros parámetros no vuelve a decodificar")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.video):
+        print(f"❌ Error: No se encuentra el video en: {args.video}")
+        sys.exit(1)
+    calibrate(args.video, args.coords, args.refs, args.samples, args.per_state, args.pca, args.out, args.frame_cache)
+
+if __name__ == "__main__":
+    main()
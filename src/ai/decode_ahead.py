@@ -0,0 +1,101 @@
+import time
+import queue
+import threading
+import cv2
+import numpy as np
+
+# --- CONFIGURACIÓN ---
+DECODE_AHEAD_SLOTS = 8   # Huecos del anillo: frames decodificados por adelantado (0 = sin hilo)
+DECODE_AHEAD_MIN_CPUS = 2  # Con un solo núcleo los dos hilos no se solapan: solo añadirían cambios de contexto
+
+class DecodeAheadReader:
+    """
+    Lectura secuencial con decodificación por adelantado en un hilo:
+    - El hilo decodificador llena un anillo de `slots` frames PREASIGNADOS
+      (`cap.read` decodifica directamente en el buffer del hueco) y, con `window`,
+      hace también gris + blur de la ventana en los buffers propios del hueco.
+    - El consumidor recorre los frames en orden; cada hueco se devuelve al anillo
+      cuando pide el siguiente. Sin huecos libres el decodificador espera
+      (backpressure): la memoria es fija y no se reserva nada por frame.
+    OpenCV suelta el GIL al decodificar, así que la decodificación de un frame se
+    solapa con la clasificación del anterior: el ritmo tiende a max(decodificar,
+    clasificar) en vez de a su suma.
+    """
+    def __init__(self, cap, engine, window=None, start=0, end=None, slots=DECODE_AHEAD_SLOTS):
+        self.cap = cap
+        self.engine = engine
+        self.window = window
+        self.start = start
+        self.end = end
+
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frames = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(slots)]
+        self.grays = [None] * slots
+        if window is not None:
+            x0, y0, x1, y1 = window
+            self.grays = [
+                (np.empty((y1 - y0, x1 - x0), dtype=np.uint8), np.empty((y1 - y0, x1 - x0), dtype=np.uint8))
+                for _ in range(slots)
+            ]
+
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._filled = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self.error = None
+
+    def _decode_loop(self):
+        profiler = self.engine.profiler
+        idx = self.start
+        try:
+            while not self._stop.is_set() and (self.end is None or idx < self.end):
+                slot = self._free.get() # Espera a que el consumidor suelte un hueco
+                if slot is None: break
+
+                t0 = time.perf_counter()
+                ret, frame = self.cap.read(self.frames[slot])
+                profiler.add("decode", time.perf_counter() - t0)
+                if not ret: break
+                if frame is not self.frames[slot]:
+                    self.frames[slot] = frame # El vídeo cambió de tamaño: OpenCV reservó otro buffer
+
+                gray = None
+                if self.window is not None:
+                    gray = self.engine._preprocess(frame, self.window, out=self.grays[slot])
+                self._filled.put((slot, gray))
+                idx += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self._filled.put(None)
+
+    def __iter__(self):
+        """(índice, frame, ventana preprocesada o None). Solo válidos hasta pedir el siguiente."""
+        profiler = self.engine.profiler
+        self._thread.start()
+        idx = self.start
+        try:
+            while True:
+                t0 = time.perf_counter()
+                item = self._filled.get()
+                profiler.add("wait", time.perf_counter() - t0)
+                if item is None: break
+
+                slot, gray = item
+                yield idx, self.frames[slot], gray
+                self._free.put(slot)
+                idx += 1
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """Para el hilo decodificador (también si el consumidor sale antes del final)"""
+        self._stop.set()
+        self._free.put(None)
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,271 @@
+import os
+import re
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import argparse
+import cv2
+import numpy as np
+
+# --- CONFIGURACIÓN ---
+FRAME_CACHE_DIRNAME = ".frame_cache"   # Carpeta oculta junto al vídeo
+PREVIEW_WIDTH = 640                    # Ancho máximo de las miniaturas (se amplían al mostrarlas)
+PREVIEW_MAX_BYTES = 2 * 1024 ** 3      # Si no caben todas, se guarda una de cada N frames
+ROI_MAX_BYTES = 2 * 1024 ** 3          # Ídem para los recortes de las ROIs (normalmente caben todos)
+ROI_PADDING = 4                        # Contexto alrededor de cada ROI (>= BLUR_MARGIN del motor)
+
+# --- CACHÉ DE FRAMES PARA CALIBRAR ---
+# Calibrar sobre un clip largo obliga a moverse por él hacia delante y hacia atrás, y
+# cada salto con cap.set(CAP_PROP_POS_FRAMES) o con grab() en bucle vuelve a pasar por el
+# decodificador. La caché decodifica el vídeo UNA vez y guarda en disco (np.memmap, .npy)
+# las miniaturas de los frames y los recortes en gris, a resolución completa, de cada ROI.
+# Después cualquier frame se lee al instante, y la misma caché sirve a generate_refs.py
+# (interfaz), a la exportación sin interfaz (main) y a calibrate_bank.py.
+
+def _cache_key(video_path, rois, preview_width):
+    st = os.stat(video_path)
+    key = f"{os.path.abspath(video_path)}|{st.st_size}|{st.st_mtime_ns}|{rois}|{preview_width}|{ROI_PADDING}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def cache_path(video_path, rois, preview_width=PREVIEW_WIDTH):
+    folder = os.path.join(os.path.dirname(os.path.abspath(video_path)), FRAME_CACHE_DIRNAME)
+    return os.path.join(folder, f"{os.path.basename(video_path)}_{_cache_key(video_path, rois, preview_width)}")
+
+def _stride(n_frames, frame_bytes, max_bytes):
+    """1 si caben todos los frames en `max_bytes`; si no, uno de cada N"""
+    return max(1, -(-n_frames * frame_bytes // max_bytes))
+
+def _count_frames(video_path):
+    """Nº real de frames (vídeos sin índice: CAP_PROP_FRAME_COUNT no es fiable)"""
+    cap = cv2.VideoCapture(video_path)
+    n = 0
+    while cap.grab():
+        n += 1
+    cap.release()
+    return n
+
+class FrameCache:
+    """
+    Caché abierta (solo lectura, memoria mapeada: no se carga entera en RAM).
+    - preview(idx): miniatura BGR del frame (la más cercana anterior si hay stride)
+    - roi_gray(idx, i): recorte en gris de la ROI `i`, a resolución completa (con
+      stride, el del frame cacheado anterior: `cached_frame(idx)`)
+    - exact_roi_gray(idx, i): ídem del frame `idx` exacto (lo decodifica si no está en
+      la caché). Es el que se exporta como plantilla
+    - roi_blurred(idx, i, kernel): ídem con el blur del análisis (mismo resultado que
+      el preprocesado del motor, gracias al contexto ROI_PADDING)
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.path = path
+        self.video = meta["video"]
+        self.fps = meta["fps"]
+        self.n_frames = meta["n_frames"]
+        self.width, self.height = meta["size"]
+        self.rois = [tuple(roi) for roi in meta["rois"]]
+        self.boxes = [tuple(box) for box in meta["boxes"]]
+        self.preview_stride = meta["preview_stride"]
+        self.roi_stride = meta["roi_stride"]
+        self.previews = np.load(os.path.join(path, "preview.npy"), mmap_mode="r")
+        self.crops = [np.load(os.path.join(path, f"roi_{i}.npy"), mmap_mode="r") for i in range(len(self.rois))]
+
+    @classmethod
+    def open(cls, video_path, rois, preview_width=PREVIEW_WIDTH):
+        """Caché del vídeo para estas ROIs: la ya guardada o, si no hay, una nueva (decodifica el vídeo)"""
+        rois = [tuple(int(v) for v in roi) for roi in rois]
+        path = cache_path(video_path, rois, preview_width)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            build(video_path, rois, path, preview_width)
+        return cls(path)
+
+    def preview(self, idx):
+        return self.previews[min(idx, self.n_frames - 1) // self.preview_stride]
+
+    def _crop(self, idx, i):
+        return self.crops[i][min(idx, self.n_frames - 1) // self.roi_stride]
+
+    def roi_gray(self, idx, i):
+        x, y, w, h = self.rois[i]
+        bx, by = self.boxes[i][:2]
+        return self._crop(idx, i)[y - by:y - by + h, x - bx:x - bx + w]
+
+    def roi_blurred(self, idx, i, kernel):
+        x, y, w, h = self.rois[i]
+        bx, by = self.boxes[i][:2]
+        return cv2.GaussianBlur(self._crop(idx, i), kernel, 0)[y - by:y - by + h, x - bx:x - bx + w]
+
+    def cached_frame(self, idx):
+        """Frame que representa de verdad el recorte de `idx` (con stride, el anterior guardado)"""
+        return min(idx, self.n_frames - 1) // self.roi_stride * self.roi_stride
+
+    def exact_roi_gray(self, idx, i):
+        if self.cached_frame(idx) == idx:
+            return self.roi_gray(idx, i)
+        frame = _read_frame(self.video, idx)
+        if frame is None:
+            raise IOError(f"No se pudo leer el frame {idx} de {self.video}")
+        x, y, w, h = self.rois[i]
+        x0, y0, x1, y1 = max(0, x), max(0, y), min(self.width, x + w), min(self.height, y + h)
+        if x1 <= x0 or y1 <= y0:
+            return np.empty((0, 0), dtype=np.uint8)
+        return cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+
+def _read_frame(video_path, idx):
+    """Frame `idx` del vídeo. Sin índice (CAP_PROP_FRAME_COUNT no fiable) se avanza con grab()"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        else:
+            for _ in range(idx):
+                if not cap.grab(): return None
+        ret, frame = cap.read()
+        return frame if ret else None
+    finally:
+        cap.release()
+
+def build(video_path, rois, path, preview_width=PREVIEW_WIDTH):
+    """Decodifica el vídeo una vez y escribe la caché en `path` (atómico: carpeta temporal + rename)"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"No se pudo abrir el video: {video_path}")
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if n_frames <= 0:
+        n_frames = _count_frames(video_path)
+
+    preview_w = min(preview_width, width)
+    preview_h = max(1, round(height * preview_w / width))
+    # Recortes con contexto: ROI + ROI_PADDING por cada lado, sin salir del frame.
+    # Una ROI vacía (selección cancelada) o fuera del vídeo queda con recorte vacío
+    boxes = []
+    for x, y, w, h in rois:
+        x0, y0 = max(0, x - ROI_PADDING), max(0, y - ROI_PADDING)
+        x1, y1 = min(width, x + w + ROI_PADDING), min(height, y + h + ROI_PADDING)
+        boxes.append((x0, y0, x1, y1) if w > 0 and h > 0 and x1 > x0 and y1 > y0 else (0, 0, 0, 0))
+
+    preview_stride = _stride(n_frames, preview_w * preview_h * 3, PREVIEW_MAX_BYTES)
+    roi_stride = _stride(n_frames, sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes), ROI_MAX_BYTES)
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    previews = np.lib.format.open_memmap(
+        os.path.join(tmp_path, "preview.npy"), mode="w+", dtype=np.uint8,
+        shape=(-(-n_frames // preview_stride), preview_h, preview_w, 3))
+    crops = [
+        np.lib.format.open_memmap(
+            os.path.join(tmp_path, f"roi_{i}.npy"), mode="w+", dtype=np.uint8,
+            shape=(-(-n_frames // roi_stride), y1 - y0, x1 - x0))
+        for i, (x0, y0, x1, y1) in enumerate(boxes)
+    ]
+
+    print(f"🎞️ Cacheando {os.path.basename(video_path)}: {n_frames} frames "
+          f"(miniaturas {preview_w}x{preview_h} cada {preview_stride}, ROIs cada {roi_stride})")
+    frames = 0
+    for idx in range(n_frames):
+        need_preview = idx % preview_stride == 0
+        need_roi = idx % roi_stride == 0
+        if not (need_preview or need_roi):
+            if not cap.grab(): break # Solo avanza: no hace falta la imagen
+            frames += 1
+            continue
+        ret, frame = cap.read()
+        if not ret: break
+        frames += 1
+        if need_preview:
+            previews[idx // preview_stride] = cv2.resize(frame, (preview_w, preview_h), interpolation=cv2.INTER_AREA)
+        if need_roi:
+            for crop, (x0, y0, x1, y1) in zip(crops, boxes):
+                if x1 > x0:
+                    crop[idx // roi_stride] = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        if idx % 500 == 0:
+            sys.stdout.write(f"\r   {100 * idx / n_frames:5.1f}%")
+            sys.stdout.flush()
+    cap.release()
+    sys.stdout.write("\r   100.0%\n")
+
+    for array in [previews] + crops:
+        array.flush()
+    del previews, crops
+    meta = {
+        "video": os.path.abspath(video_path), "fps": fps, "n_frames": frames, "size": [width, height],
+        "rois": [list(roi) for roi in rois], "boxes": [list(box) for box in boxes],
+        "preview_stride": preview_stride, "roi_stride": roi_stride,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    # Solo la caché vigente de este vídeo: las de ROIs o versiones anteriores se borran
+    for old in glob.glob(os.path.join(glob.escape(os.path.dirname(path)), f"{glob.escape(os.path.basename(video_path))}_*")):
+        if old != tmp_path:
+            shutil.rmtree(old, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f"💾 Caché de frames en {path}")
+    return path
+
+def save_ref(gray_crop, out_dir, prefix, state_name, kernel=(5, 5)):
+    """Guarda el recorte de una ROI como plantilla `<grifo>_<estado>.jpg` (gris + blur)"""
+    if gray_crop.size == 0: return
+    os.makedirs(out_dir, exist_ok=True)
+    filename = f"{prefix}_{state_name}.jpg"
+    cv2.imwrite(os.path.join(out_dir, filename), cv2.GaussianBlur(np.ascontiguousarray(gray_crop), kernel, 0))
+    print(f"✅ Guardado: {filename}")
+
+def parse_position(text, fps):
+    """Frame a partir de `1234` (frame), `75.5s` (segundos) o `1:15.5` (minutos:segundos)"""
+    if re.fullmatch(r"\d+", text):
+        return int(text)
+    if text.endswith("s"):
+        return int(round(float(text[:-1]) * fps))
+    minutes, seconds = text.split(":")
+    return int(round((int(minutes) * 60 + float(seconds)) * fps))
+
+def main():
+    from src.ai.production_counter import load_coords, tap_names, STATES
+
+    parser = argparse.ArgumentParser(description="Exportación de plantillas sin interfaz desde la caché de frames")
+    parser.add_argument("video", help="Vídeo de calibración (se decodifica una vez y se cachea)")
+    parser.add_argument("--export", nargs="+", default=[], metavar="GRIFO:ESTADO:POSICIÓN",
+                        help="Plantillas a exportar; posición en frames, segundos o min:seg (p. ej. A:beer:1:15.5 B:foam:4520 A:closed:12s)")
+    parser.add_argument("--coords", default=os.path.join("src", "ai", "referencias", "coords_dual.txt"))
+    parser.add_argument("--out", default=os.path.join("src", "ai", "referencias"), help="Carpeta de las plantillas")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.video):
+        print(f"❌ Error: No se encuentra el video en: {args.video}")
+        sys.exit(1)
+
+    # ROIs escaladas al vídeo, como en el análisis
+    rois, ref_dims = load_coords(args.coords)
+    cap = cv2.VideoCapture(args.video)
+    vid_w, vid_h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    sx, sy = (vid_w / ref_dims[0], vid_h / ref_dims[1]) if ref_dims else (1.0, 1.0)
+    rois = [(int(x * sx), int(y * sy), int(w * sx), int(h * sy)) for x, y, w, h in rois]
+    names = tap_names(len(rois))
+
+    cache = FrameCache.open(args.video, rois)
+    for spec in args.export:
+        try:
+            tap, state, position = spec.split(":", 2)
+            if tap not in names or state not in STATES:
+                raise ValueError(spec)
+            idx = parse_position(position, cache.fps)
+        except ValueError:
+            print(f"❌ Plantilla inválida: {spec} (grifos {names}, estados {STATES})")
+            sys.exit(1)
+        if not 0 <= idx < cache.n_frames:
+            print(f"❌ {spec}: el vídeo tiene {cache.n_frames} frames")
+            sys.exit(1)
+        if cache.cached_frame(idx) != idx:
+            print(f"🎯 {spec}: frame {idx} fuera de la caché (ROIs cada {cache.roi_stride}), decodificando...")
+        save_ref(cache.exact_roi_gray(idx, names.index(tap)), args.out, tap, state)
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,22 @@ import os
 import sys
 import tkinter as tk 
 
+try:
+    from src.ai.frame_cache import FrameCache, save_ref
+except ImportError: # Lanzado como script desde src/ai
+    from frame_cache import FrameCache, save_ref
+
 # --- CONFIGURACIÓN ---
 # Ajusta la ruta si tu video está en otro lado
 VIDEO_PATH = os.path.join('uploads', 'cerveza_config.mp4') 
 OUTPUT_DIR = 'referencias'
 
+# Número de grifos a calibrar (por defecto 2). Uso: python generate_refs.py [num_grifos]
+NUM_TAPS = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+TAP_NAMES = [chr(ord('A') + i) if i < 26 else f"T{i + 1}" for i in range(NUM_TAPS)]
+TAP_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (0, 255, 255), (255, 0, 255), (255, 255, 0)]
+JUMP_SECONDS = 10 # Salto de [ y ]
+
 # Crear carpeta si no existe
 if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
@@ -77,19 +88,21 @@ def smart_selector(window_name, frame, scale, title, desc):
     
     return (real_x, real_y, real_w, real_h)
 
-def save_ref(frame, roi, prefix, state_name):
-    """Guarda el recorte en escala de grises"""
-    x, y, w, h = roi
-    if w == 0 or h == 0: return
-    
-    crop = frame[y:y+h, x:x+w]
-    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (5, 5), 0)
-    
-    filename = f"{prefix}_{state_name}.jpg"
-    path = os.path.join(OUTPUT_DIR, filename)
-    cv2.imwrite(path, gray)
-    print(f"✅ Guardado: {filename}")
+def render_frame(cache, idx, rois, size):
+    """
+    Frame `idx` desde la caché, al tamaño de pantalla: la miniatura ampliada y, dentro
+    de cada ROI, su recorte a resolución completa (lo que se guardará al pulsar 1/2/3)
+    """
+    view_w, view_h = size
+    display = cv2.resize(cache.preview(idx), (view_w, view_h), interpolation=cv2.INTER_LINEAR)
+    sx, sy = view_w / cache.width, view_h / cache.height
+    for i, (x, y, w, h) in enumerate(rois):
+        x0, y0 = int(x * sx), int(y * sy)
+        x1, y1 = min(view_w, int((x + w) * sx)), min(view_h, int((y + h) * sy))
+        if x1 <= x0 or y1 <= y0: continue
+        crop = cv2.resize(cache.roi_gray(idx, i), (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+        display[y0:y1, x0:x1] = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+    return display
 
 def main():
     if not os.path.exists(VIDEO_PATH):
@@ -112,82 +125,84 @@ def main():
     cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
 
     # --- FASE 1: SELECCIÓN DE GRIFOS ---
-    # Solo seleccionamos la "Palanca" (o la zona principal) de cada grifo
-    roi_a = smart_selector(WINDOW_NAME, frame, scale, "GRIFO A (Izq)", "Selecciona la zona de la palanca")
-    roi_b = smart_selector(WINDOW_NAME, frame, scale, "GRIFO B (Der)", "Selecciona la zona de la palanca")
+    # Solo seleccionamos la "Palanca" (o la zona principal) de cada grifo, de izquierda a derecha
+    rois = [
+        smart_selector(WINDOW_NAME, frame, scale, f"GRIFO {name}", "Selecciona la zona de la palanca")
+        for name in TAP_NAMES
+    ]
 
     # Guardar Coordenadas (Incluimos la resolución al final para que los otros scripts funcionen bien)
     coords_file = os.path.join(OUTPUT_DIR, "coords_dual.txt")
     with open(coords_file, "w") as f:
-        # Formato: x,y,w,h (A) | x,y,w,h (B) | ResolucionOriginal
-        line_a = ",".join(map(str, roi_a))
-        line_b = ",".join(map(str, roi_b))
-        f.write(f"{line_a}|{line_b}|{orig_w},{orig_h}")
+        # Formato: x,y,w,h (A) | x,y,w,h (B) | ... | ResolucionOriginal
+        lines = [",".join(map(str, roi)) for roi in rois]
+        f.write("|".join(lines + [f"{orig_w},{orig_h}"]))
     print(f"💾 Coordenadas guardadas en {coords_file}")
 
     # --- FASE 2: CAPTURA DE REFERENCIAS ---
+    # El vídeo se decodifica UNA vez a una caché en disco: después avanzar, rebobinar o
+    # saltar a cualquier frame es leer de memoria, sin seeks del decodificador
+    cap.release()
+    view_size = (max(1, int(orig_w * scale)), max(1, int(orig_h * scale)))
+    cache = FrameCache.open(VIDEO_PATH, rois) # Misma caché que la exportación sin interfaz y calibrate_bank
+    jump = max(1, int(round(JUMP_SECONDS * cache.fps)))
+
     paused = False
     speed = 1
-    
+    active = 0 # Grifo al que se asignan las teclas 1/2/3
+    pos = 0
+
+    # Barra de posición: arrastrarla lleva a cualquier frame al instante
+    state = {"seek": None}
+    cv2.createTrackbar("Frame", WINDOW_NAME, 0, max(1, cache.n_frames - 1), lambda v: state.update(seek=v))
+
     while True:
-        if not paused:
-            # Lógica de velocidad (Adelante / Atrás)
-            if speed == 1:
-                ret, frame = cap.read()
-            elif speed > 1:
-                # Saltar frames para ir rápido
-                for _ in range(speed - 1): cap.grab()
-                ret, frame = cap.read()
-            elif speed < 0:
-                # Rebobinar
-                current = cap.get(cv2.CAP_PROP_POS_FRAMES)
-                target = max(0, current + speed - 1)
-                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
-                ret, frame = cap.read()
-            else: 
-                ret, frame = cap.read()
-
-            if not ret: 
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                continue
-        
-        display = frame.copy()
-        
-        # Dibujar Cajas
-        cv2.rectangle(display, (roi_a[0], roi_a[1]), (roi_a[0]+roi_a[2], roi_a[1]+roi_a[3]), (255, 0, 0), 2)
-        cv2.putText(display, "A", (roi_a[0], roi_a[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,0,0), 2)
-        
-        cv2.rectangle(display, (roi_b[0], roi_b[1]), (roi_b[0]+roi_b[2], roi_b[1]+roi_b[3]), (0, 255, 0), 2)
-        cv2.putText(display, "B", (roi_b[0], roi_b[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,0), 2)
+        if state["seek"] is not None:
+            pos, state["seek"] = state["seek"], None
+        elif not paused:
+            # Velocidad x N: avanza (o retrocede) N frames por refresco; al final vuelve al inicio
+            pos += speed
+            if pos >= cache.n_frames: pos = 0
+            pos = max(0, pos)
+
+        display_small = render_frame(cache, pos, rois, view_size)
         
-        # Redimensionar para mostrar en pantalla
-        display_small = cv2.resize(display, (0,0), fx=scale, fy=scale)
+        # Dibujar Cajas (la del grifo activo, más gruesa)
+        for i, (name, roi) in enumerate(zip(TAP_NAMES, rois)):
+            color = TAP_COLORS[i % len(TAP_COLORS)]
+            thickness = 3 if i == active else 1
+            x, y, w, h = (int(v * scale) for v in roi)
+            cv2.rectangle(display_small, (x, y), (x + w, y + h), color, thickness)
+            cv2.putText(display_small, name, (x, y - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
         
         # Texto de estado
         speed_txt = f"x{speed}" if speed > 0 else f"ATRAS x{abs(speed)}"
         if paused: speed_txt = "PAUSA"
+        seconds = pos / cache.fps
         
         instructions = [
             f"VELOCIDAD: {speed_txt}",
+            f"FRAME {pos}/{cache.n_frames - 1} ({int(seconds // 60):02d}:{seconds % 60:04.1f})",
+            # Con stride el recorte mostrado es de un frame anterior (se guarda el exacto)
+            f"ROI: frame {cache.cached_frame(pos)}" if cache.cached_frame(pos) != pos else "",
             "-" * 25,
             "[ESPACIO] Play / Pausa",
             "[D] Mas Rapido | [A] Atras",
+            "[,] [.] Frame a frame",
+            f"Teclas [ y ] : -/+ {JUMP_SECONDS} s",
             "",
-            "GRIFO A (Izquierda):",
+            f"GRIFO ACTIVO: {TAP_NAMES[active]}  ([TAB] cambiar)",
             " [1] Cerrado",
             " [2] Cerveza",
             " [3] Espuma",
             "",
-            "GRIFO B (Derecha):",
-            " [4] Cerrado",
-            " [5] Cerveza",
-            " [6] Espuma",
-            "",
             "[Q] Salir"
         ]
         
         draw_ui_overlay(display_small, instructions)
         cv2.imshow(WINDOW_NAME, display_small)
+        cv2.setTrackbarPos("Frame", WINDOW_NAME, pos)
+        state["seek"] = None # El callback de setTrackbarPos no es un salto del usuario
         
         # Reducir delay si vamos rápido para que se sienta fluido
         wait_time = 30 if speed <= 1 else 1
@@ -204,19 +219,22 @@ def main():
         elif key == ord('a'): # Frenar/Atrás
             if speed > -5: speed -= 1
             if speed == 0: speed = -1
+
+        # Navegación fina (también en pausa)
+        elif key == ord(','): pos = max(0, pos - 1)
+        elif key == ord('.'): pos = min(cache.n_frames - 1, pos + 1)
+        elif key == ord('['): pos = max(0, pos - jump)
+        elif key == ord(']'): pos = min(cache.n_frames - 1, pos + jump)
         
-        # --- GUARDAR REFERENCIAS ---
-        # Grifo A
-        elif key == ord('1'): save_ref(frame, roi_a, "A", "closed")
-        elif key == ord('2'): save_ref(frame, roi_a, "A", "beer")
-        elif key == ord('3'): save_ref(frame, roi_a, "A", "foam")
+        # Cambiar grifo activo
+        elif key == 9: # TAB
+            active = (active + 1) % len(TAP_NAMES)
         
-        # Grifo B
-        elif key == ord('4'): save_ref(frame, roi_b, "B", "closed")
-        elif key == ord('5'): save_ref(frame, roi_b, "B", "beer")
-        elif key == ord('6'): save_ref(frame, roi_b, "B", "foam")
+        # --- GUARDAR REFERENCIAS (grifo activo) ---
+        elif key == ord('1'): save_ref(cache.exact_roi_gray(pos, active), OUTPUT_DIR, TAP_NAMES[active], "closed")
+        elif key == ord('2'): save_ref(cache.exact_roi_gray(pos, active), OUTPUT_DIR, TAP_NAMES[active], "beer")
+        elif key == ord('3'): save_ref(cache.exact_roi_gray(pos, active), OUTPUT_DIR, TAP_NAMES[active], "foam")
 
-    cap.release()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
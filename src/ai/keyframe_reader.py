@@ -0,0 +1,115 @@
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+# PyAV es opcional: sin él el motor usa el escaneo por bisección con OpenCV
+try:
+    import av
+except ImportError:
+    av = None
+
+# --- CONFIGURACIÓN ---
+CROP_CACHE_FRAMES = 512   # Ventanas preprocesadas recientes (la bisección vuelve sobre ellas)
+
+class KeyframeVideoReader:
+    """
+    Lectura por índice absoluto de frame con PyAV, pensada para el escaneo en reposo:
+    - Un frame que es keyframe se obtiene con un seek y decodificando SOLO ese frame
+      (el decodificador descarta el resto: skip_frame=NONKEY).
+    - Cualquier otro frame se decodifica desde su keyframe (o siguiendo hacia delante
+      si el decodificador ya está en ese GOP), como en el análisis normal.
+    El índice (pts de cada frame y keyframes) sale de un recorrido de paquetes sin
+    decodificar. Mantiene la misma interfaz que VideoFrameReader (`read_codes`).
+    """
+    def __init__(self, video_path, engine, window):
+        if av is None:
+            raise ImportError("PyAV no está instalado")
+        self.engine = engine
+        self.window = window
+        self.container = av.open(video_path)
+        self.stream = self.container.streams.video[0]
+
+        pts_list, key_pts = [], set()
+        for packet in self.container.demux(self.stream):
+            if packet.size == 0: continue # Paquete de vaciado del demuxer
+            if packet.pts is None:
+                raise ValueError("stream sin marcas de tiempo")
+            pts_list.append(packet.pts)
+            if packet.is_keyframe:
+                key_pts.add(packet.pts)
+
+        self.pts = sorted(pts_list) # Índice de frame (orden de presentación) -> pts
+        self.index_of = {pts: i for i, pts in enumerate(self.pts)}
+        self.keyframes = [i for i, pts in enumerate(self.pts) if pts in key_pts]
+        if not self.keyframes or self.keyframes[0] != 0:
+            raise ValueError("el vídeo no empieza en un keyframe")
+
+        self.total_frames = len(self.pts)
+        self.pos = None # Próximo frame que saldrá del decodificador (None = sin decodificar en curso)
+        self._frames = None
+        self._cache = OrderedDict()
+        self.keyframe_reads = 0
+        self.seeks = 0
+        self.furthest = 0 # Frames cubiertos (la bisección vuelve atrás, el progreso no)
+
+    def _keyframe_for(self, idx):
+        return self.keyframes[bisect_right(self.keyframes, idx) - 1]
+
+    def _seek(self, idx, keyframes_only):
+        t0 = time.perf_counter()
+        self.stream.codec_context.skip_frame = "NONKEY" if keyframes_only else "DEFAULT"
+        self.container.seek(self.pts[idx], stream=self.stream, backward=True, any_frame=False)
+        self._frames = self.container.decode(self.stream)
+        self.engine.profiler.add("seek", time.perf_counter() - t0)
+        self.seeks += 1
+
+    def _decode_until(self, idx):
+        """Decodifica hacia delante hasta `idx`, guardando la ventana preprocesada de cada frame"""
+        profiler = self.engine.profiler
+        while True:
+            t0 = time.perf_counter()
+            frame = next(self._frames, None)
+            if frame is None:
+                profiler.add("decode", time.perf_counter() - t0)
+                self.pos = None
+                return None
+            image = frame.to_ndarray(format="bgr24")
+            profiler.add("decode", time.perf_counter() - t0)
+
+            i = self.index_of.get(frame.pts)
+            if i is None: continue
+            self._remember(i, self.engine._preprocess(image, self.window))
+            self.pos = i + 1
+            if i >= idx:
+                return self._cache.get(idx)
+
+    def _remember(self, idx, gray):
+        self._cache[idx] = gray
+        self._cache.move_to_end(idx)
+        if len(self._cache) > CROP_CACHE_FRAMES:
+            self._cache.popitem(last=False)
+
+    def read_codes(self, idx):
+        if idx >= self.total_frames: return None
+
+        gray = self._cache.get(idx)
+        if gray is None:
+            keyframe = self._keyframe_for(idx)
+            if idx == keyframe and self.pos != idx:
+                # Solo el keyframe: seek + un frame (el resto del GOP ni se decodifica)
+                self._seek(idx, keyframes_only=True)
+                gray = self._decode_until(idx)
+                self.pos = None # Tras NONKEY el decodificador no sirve para seguir hacia delante
+                self.keyframe_reads += 1
+            else:
+                if self.pos is None or not keyframe <= self.pos <= idx:
+                    self._seek(keyframe, keyframes_only=False)
+                gray = self._decode_until(idx)
+            if gray is None: return None
+
+        self.furthest = max(self.furthest, idx + 1)
+        self.engine._report_progress(self.furthest, self.total_frames)
+        return self.engine._classify_gray(gray, idx)
+
+    def close(self):
+        self.container.close()
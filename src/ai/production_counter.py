@@ -4,64 +4,273 @@ import os
 import time
 import sys
 import math
+import copy
+import json
+import shutil
+import hashlib
+import multiprocessing
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from src.ai.keyframe_reader import KeyframeVideoReader
+from src.ai.score_trace import TraceRecorder
+from src.ai.decode_ahead import DecodeAheadReader, DECODE_AHEAD_SLOTS, DECODE_AHEAD_MIN_CPUS
 
 # --- CONFIGURACIÓN ---
 IDLE_SKIP_FRAMES = 50    
 COOLDOWN_FRAMES = 30    
 SECONDS_PER_BEER = 12.0  
 THRESHOLD_ROUNDING = 0.6 
+MIN_POUR_SECONDS = 2.0   # Filtro de ruido: tiradas más cortas no cuentan (goteo o limpieza)
+
+# Escaneo en reposo (todos los grifos cerrados):
+#  - "keyframe": como "bisect", pero cada muestra en reposo es el keyframe más lejano
+#    dentro de la zancada y se decodifica SOLO ese frame (PyAV). El resto del GOP no
+#    se decodifica. Sin PyAV, o si el vídeo no se puede indexar, se usa "bisect".
+#  - "bisect": zancadas de IDLE_STRIDE_SECONDS; al ver actividad se vuelve atrás y se
+#    busca por bisección el frame exacto en que empezó (inicio y duración precisos).
+#    NO es más rápido que "skip": con la zancada por defecto (2 s = 50 frames a 25 fps)
+#    muestrea lo mismo en reposo y además vuelve atrás en cada inicio (seeks y frames
+#    extra). En el benchmark de 720p tarda ~10 % más, a cambio de un error de inicio
+#    de ~0.04 s frente a hasta ~1.8 s. La velocidad la da "keyframe".
+#  - "skip": método clásico, salta IDLE_SKIP_FRAMES frames con grab().
+IDLE_SCAN_MODE = "keyframe"
+# Una tirada más corta que la zancada podría caer entera entre dos muestras:
+# con zancada <= MIN_POUR_SECONDS nunca se pierde una tirada que cuente. Es el máximo
+# seguro, así que no se puede alargar para que "bisect" gane a "skip".
+IDLE_STRIDE_SECONDS = MIN_POUR_SECONDS
+SEEK_MIN_FRAMES = 120    # Saltos hacia delante de al menos N frames: seek en vez de grab()
+
+STATES = ['closed', 'beer', 'foam']
+CLOSED_CODE = STATES.index('closed')
+
+# Preprocesado solo sobre la zona de los grifos (unión de ROIs + margen del blur).
+# El resultado es idéntico al de procesar el frame completo.
+ROI_ONLY_PREPROCESSING = True
+BLUR_KERNEL = (5, 5)
+BLUR_MARGIN = BLUR_KERNEL[0] // 2
+
+# Compuerta de cambios por ROI: si la ROI apenas cambió desde la última vez que se
+# clasificó entera, se reutiliza su estado. Se reutiliza cuando
+#   margen > CHANGE_GATE_FACTOR · Δ
+# con Δ la diferencia absoluta con aquella ROI y margen la distancia entre el mejor
+# estado y el segundo. Con 2.0 el resultado es EXACTAMENTE el mismo (desigualdad
+# triangular); con menos hay más aciertos pero algún estado podría cambiar. 0 = sin compuerta.
+CHANGE_GATE_FACTOR = 2.0
+
+# Clasificación piramidal: las ROIs que la compuerta no resuelve se comparan primero
+# con el banco reducido PYRAMID_FACTOR veces por lado (1/16 de los píxeles con 4) y
+# solo se pasa a resolución completa si, en baja resolución, la distancia por píxel
+# entre el mejor estado y el segundo es menor que PYRAMID_MARGIN. APROXIMADO: cuanto
+# menor el margen, menos escaladas y más riesgo de que cambie algún estado (con un
+# margen muy alto siempre se escala: resultado idéntico). 1 = sin pirámide.
+PYRAMID_FACTOR = 4
+PYRAMID_MARGIN = 8.0
+PYRAMID_MIN_PROTOTYPES = 4  # Por estado: con bancos más pequeños reducir cuesta más que comparar
+
+# Banco de prototipos calibrado (calibrate_bank.py): varios recortes por estado
+# además de las plantillas `<grifo>_<estado>.jpg`. Si trae componentes PCA, la
+# comparación se hace en ese subespacio y su coste ya no depende del nº de prototipos.
+BANK_SUFFIX = "_bank.npz"
+
+# Caché de calibración por proceso (ver load_calibration)
+SCALED_CACHE_SIZE = 4    # Resoluciones de vídeo con los grifos ya escalados en memoria
+
+# Análisis paralelo por tramos de frames (1 = secuencial, 0 = todos los núcleos)
+PARALLEL_WORKERS = 0
+MIN_CHUNK_FRAMES = 1500  # Tramos más cortos no compensan arrancar un proceso
+
+PROGRESS_INTERVAL_SECONDS = 0.5  # Frecuencia máxima de avisos de progreso al callback
+
+# Puntos de control (process_video con checkpoint_path): si el análisis se corta, el
+# siguiente intento sigue desde el último. Guardan la posición del muestreo, el cooldown
+# y la máquina de estados de cada grifo (tiradas ya cerradas incluidas); en modo paralelo,
+# las trazas de los tramos terminados. Solo valen para el mismo vídeo, calibración y modo.
+CHECKPOINT_INTERVAL_SECONDS = 30.0
+
+def beers_for_duration(duration):
+    """REGLA DE NEGOCIO: cervezas que corresponden a una tirada de `duration` segundos (0 = descartada)"""
+    if duration <= MIN_POUR_SECONDS:
+        return 0
+
+    raw_beers = duration / SECONDS_PER_BEER
+    int_part = int(raw_beers)      
+    decimal_part = raw_beers - int_part 
+    
+    if decimal_part > THRESHOLD_ROUNDING:
+        final_beers = int_part + 1
+    else:
+        final_beers = int_part
+    
+    return max(final_beers, 1)
+
+def build_results(taps, fps, total_frames):
+    """
+    Resultado del análisis a partir de los grifos (name, count, total_beer_seconds,
+    timeline_events): lo usan el motor y el recálculo desde trazas (score_trace.rescore).
+    """
+    # Orden estable: a igual inicio, primero A, luego B...
+    all_events = [evt for tap in taps for evt in tap.timeline_events]
+    all_events.sort(key=lambda x: x['start'])
+
+    final_duration = 0.0
+    if fps > 0 and total_frames > 0:
+        final_duration = total_frames / fps
+
+    tap_data = {
+        tap.name: {"count": tap.count, "seconds": round(tap.total_beer_seconds, 2)}
+        for tap in taps
+    }
+    # Claves clásicas de A/B por compatibilidad con el frontend y la BD
+    empty = {"count": 0, "seconds": 0.0}
+    tap_a = tap_data.get("A", empty)
+    tap_b = tap_data.get("B", empty)
+
+    return {
+    "grifo_a": tap_a["count"],
+    "grifo_b": tap_b["count"],
+    "total": sum(tap.count for tap in taps),
+    "seconds_a": tap_a["seconds"],
+    "seconds_b": tap_b["seconds"],
+    "taps": tap_data,
+    "events": all_events,
+    "video_duration": round(final_duration, 2)
+    }
 
 class SingleTap:
-    def __init__(self, name, roi, refs_folder):
+    def __init__(self, name, roi, refs_folder, references=None):
         self.name = name
-        self.roi = roi 
+        self.roi = roi
+        self._reset()
+
+        # Cargar referencias (o reutilizar las ya decodificadas de la caché de calibración)
+        templates, self.calibrated = references or load_references(name, refs_folder)
+        self.refs = {}
+        for state in STATES:
+            ref_img = templates.get(state)
+            if ref_img is None:
+                ref_img = np.zeros((roi[3], roi[2]), dtype=np.uint8)
+            self.refs[state] = ref_img
+
+        # Banco de prototipos: plantillas + prototipos calibrados, redimensionados UNA
+        # vez al tamaño de la ROI escalada, ordenados por estado y apilados en un único
+        # array contiguo (prototipos, h, w)
+        self.states = list(self.refs.keys())
+        self._build_bank()
+
+    def _reset(self):
         self.count = 0
-        self.total_beer_seconds = 0.0 
-        
+        self.total_beer_seconds = 0.0
+
         self.current_state = 'closed'
         self.state_start_frame = 0
-        self.state_start_time = 0.0 
-        
+        self.state_start_time = 0.0
+
         self.timeline_events = []
-        
-        # Cargar referencias
-        self.refs = {}
-        for state in ['closed', 'beer', 'foam']:
-            filename = f"{name}_{state}.jpg"
-            path = os.path.join(refs_folder, filename)
-            if os.path.exists(path):
-                self.refs[state] = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
-            else:
-                self.refs[state] = np.zeros((roi[3], roi[2]), dtype=np.uint8)
 
-    def get_state(self, frame_gray):
-        """Devuelve el estado visual actual"""
+    def state_dict(self):
+        """Contadores y máquina de estados (lo que guarda un punto de control)"""
+        return {
+            "count": self.count,
+            "total_beer_seconds": self.total_beer_seconds,
+            "current_state": self.current_state,
+            "state_start_frame": self.state_start_frame,
+            "state_start_time": self.state_start_time,
+            "timeline_events": self.timeline_events,
+        }
+
+    def load_state(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+        self.timeline_events = [dict(evt) for evt in state["timeline_events"]]
+
+    def clone(self):
+        """Grifo nuevo (contadores a cero) que comparte el banco ya construido"""
+        tap = copy.copy(self)
+        tap._reset()
+        if self.bank is not None:
+            tap._diff_buffer = np.empty_like(self.bank)
+        return tap
+
+    def _build_bank(self):
         x, y, w, h = self.roi
-        
+        self.bank = self.components = self.proto_coords = self._diff_buffer = None
+        self.low_bank = self.low_shape = None
+        if w <= 0 or h <= 0:
+            return
+
+        # Una plantilla por estado siempre: así ningún estado se queda sin prototipo
+        layers = [self.refs[state] for state in self.states]
+        labels = list(range(len(self.states)))
+        if self.calibrated is not None:
+            prototypes, proto_labels, components = self.calibrated
+            layers += list(prototypes)
+            labels += proto_labels.tolist()
+        layers = [img if img.shape == (h, w) else cv2.resize(img, (w, h)) for img in layers]
+
+        order = np.argsort(labels, kind="stable")
+        self.bank = np.ascontiguousarray(np.stack(layers)[order], dtype=np.int16)
+        self.labels = np.asarray(labels)[order]
+        # Primer prototipo de cada estado: los mínimos por estado salen de un reduceat
+        self.state_offsets = np.searchsorted(self.labels, np.arange(len(self.states)))
+        self._diff_buffer = np.empty_like(self.bank)
+
+        # Banco reducido para la primera pasada de la clasificación piramidal
+        low_h, low_w = h // PYRAMID_FACTOR, w // PYRAMID_FACTOR
+        if PYRAMID_FACTOR > 1 and low_h > 0 and low_w > 0:
+            self.low_shape = (low_h, low_w)
+            low = [cv2.resize(layers[i], (low_w, low_h), interpolation=cv2.INTER_AREA) for i in order]
+            self.low_bank = np.ascontiguousarray(np.stack(low), dtype=np.int16)
+
+        if self.calibrated is not None and self.calibrated[2] is not None:
+            self.components = _fit_components(self.calibrated[2], self.calibrated[0].shape[1:], (h, w))
+            self.proto_coords = self.bank.reshape(len(self.bank), -1) @ self.components.T
+
+    @property
+    def score_norm(self):
+        """Divisor que pasa la distancia bruta a escala por píxel"""
+        _, _, w, h = self.roi
+        return math.sqrt(w * h) if self.components is not None else w * h
+
+    def score_pixels(self, pixels):
+        """
+        Distancia bruta de la ROI (vector plano uint8) al prototipo más cercano de
+        cada estado: suma de diferencias absolutas o, con PCA, distancia euclídea
+        en el subespacio. Todo el banco se compara en una sola operación.
+        """
+        if self.components is None:
+            diff = self._diff_buffer.reshape(len(self.bank), -1)
+            np.subtract(self.bank.reshape(len(self.bank), -1), pixels, out=diff)
+            np.abs(diff, out=diff)
+            dist = diff.sum(axis=1, dtype=np.int64)
+        else:
+            coords = self.components @ pixels
+            dist = np.sqrt(np.square(self.proto_coords - coords).sum(axis=1))
+        return np.minimum.reduceat(dist, self.state_offsets)
+
+    def classify(self, frame_gray):
+        """
+        Devuelve (estado, scores). `scores` es la distancia por píxel al prototipo
+        más cercano de cada estado, en el orden de `self.states` (con una plantilla
+        por estado, la diferencia media absoluta). None si la ROI no es válida.
+        """
+        x, y, w, h = self.roi
+
         # Protección por si las coordenadas se salen de la imagen al escalar
         h_img, w_img = frame_gray.shape
-        if x < 0 or y < 0 or x+w > w_img or y+h > h_img:
-            return 'closed'
+        if self.bank is None or x < 0 or y < 0 or x+w > w_img or y+h > h_img:
+            return 'closed', None
 
-        crop = frame_gray[y:y+h, x:x+w]
-        
-        if crop.shape[0] == 0 or crop.shape[1] == 0: return 'closed'
+        # La suma entera es exacta, así que el score es idéntico al np.mean(absdiff)
+        scores = self.score_pixels(frame_gray[y:y+h, x:x+w].ravel()) / self.score_norm
 
-        best_state = 'closed'
-        min_diff = float('inf')
-        
-        for state, ref_img in self.refs.items():
-            # Si el video es más pequeño/grande que la referencia, redimensionamos la referencia
-            if crop.shape != ref_img.shape:
-                try: ref_img = cv2.resize(ref_img, (crop.shape[1], crop.shape[0]))
-                except: continue
-
-            diff = cv2.absdiff(crop, ref_img)
-            score = np.mean(diff)
-            if score < min_diff:
-                min_diff = score
-                best_state = state
-        return best_state
+        # argmin devuelve el primer mínimo: mismo desempate que el bucle original
+        return self.states[int(np.argmin(scores))], scores
+
+    def get_state(self, frame_gray):
+        """Devuelve el estado visual actual"""
+        return self.classify(frame_gray)[0]
 
     def update_logic(self, detected_state, frame_idx, fps):
         is_pouring_beer = (detected_state == 'beer')
@@ -79,19 +288,8 @@ class SingleTap:
             duration = current_time_sec - self.state_start_time
             self.total_beer_seconds += duration
 
-            # REGLA DE NEGOCIO:
-            if duration > 2.0:
-                raw_beers = duration / SECONDS_PER_BEER
-                int_part = int(raw_beers)      
-                decimal_part = raw_beers - int_part 
-                
-                if decimal_part > THRESHOLD_ROUNDING:
-                    final_beers = int_part + 1
-                else:
-                    final_beers = int_part
-                
-                if final_beers < 1: final_beers = 1
-                
+            final_beers = beers_for_duration(duration)
+            if final_beers:
                 self.count += final_beers
                 
                 event = {
@@ -105,38 +303,982 @@ class SingleTap:
             
             self.current_state = detected_state 
 
+def _fit_components(components, shape, size):
+    """
+    Componentes PCA del banco al tamaño de la ROI, re-ortonormalizadas: una proyección
+    ortonormal nunca alarga distancias (la compuerta de cambios sigue siendo exacta).
+    """
+    (h0, w0), (h, w) = shape, size
+    if (h0, w0) != (h, w):
+        components = np.stack([cv2.resize(c.reshape(h0, w0), (w, h)).ravel() for c in components])
+    q, _ = np.linalg.qr(components.T.astype(np.float64))
+    return np.ascontiguousarray(q.T)
+
+def load_references(name, refs_folder):
+    """
+    Plantillas `<grifo>_<estado>.jpg` ({estado: imagen gris o None}) y banco calibrado
+    `<grifo>_bank.npz` (prototipos, etiquetas, componentes o None), o None si no hay.
+    """
+    templates = {}
+    for state in STATES:
+        path = os.path.join(refs_folder, f"{name}_{state}.jpg")
+        templates[state] = cv2.imread(path, cv2.IMREAD_GRAYSCALE) if os.path.exists(path) else None
+
+    calibrated = None
+    path = os.path.join(refs_folder, f"{name}{BANK_SUFFIX}")
+    if os.path.exists(path):
+        with np.load(path) as data:
+            components = data["components"] if "components" in data.files and data["components"].size else None
+            calibrated = (data["prototypes"], data["labels"].astype(np.intp), components)
+    return templates, calibrated
+
+def tap_names(n):
+    """Nombres de grifo por posición: A, B, C..."""
+    return [chr(ord('A') + i) if i < 26 else f"T{i + 1}" for i in range(n)]
+
+def load_coords(coords_file):
+    """
+    Lee el fichero de coordenadas: `x,y,w,h|x,y,w,h|...|W,H`.
+    Admite cualquier número de ROIs; la última parte (si tiene 2 valores) es la
+    resolución con la que se calibraron. Devuelve (rois, (ref_w, ref_h) o None).
+    """
+    with open(coords_file, 'r') as f:
+        line = f.read().strip()
+
+    rois = []
+    ref_dims = None
+    for part in line.split('|'):
+        part = part.strip()
+        if not part: continue
+        values = tuple(map(int, part.split(',')))
+        if len(values) == 4:
+            rois.append(values)
+        elif len(values) == 2:
+            ref_dims = values
+        else:
+            raise ValueError(f"Segmento de coordenadas inválido: '{part}'")
+    return rois, ref_dims
+
+def _fingerprint_rules():
+    return (SECONDS_PER_BEER, THRESHOLD_ROUNDING, MIN_POUR_SECONDS, COOLDOWN_FRAMES,
+            IDLE_SCAN_MODE, IDLE_SKIP_FRAMES, IDLE_STRIDE_SECONDS, BLUR_KERNEL,
+            CHANGE_GATE_FACTOR, PYRAMID_FACTOR, PYRAMID_MARGIN, PYRAMID_MIN_PROTOTYPES)
+
+def _calibration_files(coords_file, refs_folder):
+    paths = [coords_file]
+    if os.path.isdir(refs_folder):
+        paths += sorted(os.path.join(refs_folder, f) for f in os.listdir(refs_folder))
+    return [path for path in paths if os.path.isfile(path)]
+
+def reference_fingerprint(coords_file, refs_folder):
+    """
+    Huella de la calibración: coordenadas, ficheros de referencia y las reglas
+    que afectan al resultado. Cambia en cuanto se recalibra o se tocan las reglas.
+    """
+    h = hashlib.sha256()
+    h.update(repr(_fingerprint_rules()).encode())
+    for path in _calibration_files(coords_file, refs_folder):
+        h.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+class Calibration:
+    """
+    Calibración leída de disco UNA vez por proceso: coordenadas, plantillas
+    decodificadas, bancos calibrados y, por resolución de vídeo, los grifos con el
+    banco ya escalado. `stamp` (mtime y tamaño de cada fichero) detecta recalibraciones.
+    """
+    def __init__(self, coords_file, refs_folder, stamp):
+        self.coords_file = coords_file
+        self.refs_folder = refs_folder
+        self.stamp = stamp
+        self.error = None
+        try:
+            self.rois, self.ref_dims = load_coords(coords_file)
+        except Exception as e:
+            self.rois, self.ref_dims, self.error = [], None, e
+        self.tap_names = tap_names(len(self.rois))
+        self.references = {name: load_references(name, refs_folder) for name in self.tap_names}
+        self._fingerprint = None
+        self._fingerprint_rules = None
+        self._scaled = OrderedDict()
+        self._scaled_rules = None
+
+    @property
+    def fingerprint(self):
+        """reference_fingerprint, calculada una vez (o de nuevo si cambian las reglas)"""
+        rules = _fingerprint_rules()
+        if self._fingerprint is None or rules != self._fingerprint_rules:
+            self._fingerprint = reference_fingerprint(self.coords_file, self.refs_folder)
+            self._fingerprint_rules = rules
+        return self._fingerprint
+
+    def scaled(self, size, build):
+        """
+        (ventana, grifos, clasificador) para la resolución `size`; `build()` solo la
+        primera vez (o de nuevo si cambian las reglas, que el clasificador lleva dentro)
+        """
+        rules = _fingerprint_rules()
+        if rules != self._scaled_rules:
+            self._scaled.clear()
+            self._scaled_rules = rules
+        entry = self._scaled.get(size)
+        if entry is None:
+            entry = self._scaled[size] = build()
+            if len(self._scaled) > SCALED_CACHE_SIZE:
+                self._scaled.popitem(last=False)
+        self._scaled.move_to_end(size)
+        return entry
+
+_calibrations = {} # (coords, carpeta de referencias) -> Calibration
+
+def _calibration_stamp(coords_file, refs_folder):
+    stamp = []
+    for path in _calibration_files(coords_file, refs_folder):
+        st = os.stat(path)
+        stamp.append((os.path.basename(path), st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+def load_calibration(coords_file, refs_folder):
+    """
+    Calibración de la caché del proceso. Cada llamada solo hace un stat de los
+    ficheros: si alguno cambió (recalibración), se vuelve a cargar sin reiniciar.
+    """
+    key = (os.path.abspath(coords_file), os.path.abspath(refs_folder))
+    stamp = _calibration_stamp(coords_file, refs_folder)
+    calibration = _calibrations.get(key)
+    if calibration is None or calibration.stamp != stamp:
+        calibration = _calibrations[key] = Calibration(coords_file, refs_folder, stamp)
+    return calibration
+
+class MultiTapClassifier:
+    """
+    Clasifica TODOS los grifos de un frame en una sola operación NumPy.
+    Los píxeles de cada ROI se concatenan en un vector plano y los bancos de
+    prototipos de cada grifo en una matriz (prototipos, píxeles); las sumas por
+    grifo salen de un único `np.add.reduceat` y el mejor prototipo de cada estado
+    de un `np.minimum.reduceat`. Los grifos con banco PCA se proyectan uno a uno
+    (una multiplicación de matrices por grifo).
+    Delante va la compuerta de cambios (CHANGE_GATE_FACTOR): cada grifo cuya ROI
+    no ha cambiado lo bastante desde su última clasificación completa reutiliza
+    aquel estado (y aquellos scores) sin compararse con las referencias.
+    Los que no pasan la compuerta se clasifican en baja resolución (PYRAMID_FACTOR)
+    y solo los dudosos (margen < PYRAMID_MARGIN) se comparan a resolución completa.
+    """
+    def __init__(self, taps, window_shape, gate_factor=None, pyramid_margin=None):
+        self.taps = taps
+        # None = el valor actual del módulo (se lee aquí, no al definir la clase)
+        self.gate_factor = CHANGE_GATE_FACTOR if gate_factor is None else gate_factor
+        self.pyramid_margin = PYRAMID_MARGIN if pyramid_margin is None else pyramid_margin
+        self.last_checks = 0 # Grifos que pasaron por la compuerta en la última llamada
+        self.last_hits = 0   # ...y cuántos reutilizaron su estado
+        self.last_low = 0        # Grifos clasificados en baja resolución
+        self.last_escalated = 0  # ...y cuántos hubo que repetir a resolución completa
+        h_img, w_img = window_shape
+
+        # Grifos con ROI válida dentro de la ventana (el resto queda siempre 'closed')
+        self.valid = np.zeros(len(taps), dtype=bool)
+        indices, sizes = [], []
+        for i, tap in enumerate(taps):
+            x, y, w, h = tap.roi
+            if tap.bank is None or x < 0 or y < 0 or x+w > w_img or y+h > h_img:
+                continue
+            self.valid[i] = True
+            rows, cols = np.mgrid[y:y+h, x:x+w]
+            indices.append(np.ravel_multi_index((rows.ravel(), cols.ravel()), (h_img, w_img)))
+            sizes.append(w * h)
+
+        self.n_valid = len(sizes)
+        if self.n_valid:
+            self.valid_taps = [tap for tap, ok in zip(taps, self.valid) if ok]
+            self.pixel_index = np.concatenate(indices)
+            self.sizes = np.array(sizes, dtype=np.int64)
+            self.offsets = np.concatenate(([0], np.cumsum(self.sizes)[:-1]))
+            self.norms = np.array([tap.score_norm for tap in self.valid_taps], dtype=np.float64)
+
+            # Operación conjunta solo si ningún grifo compara en el subespacio PCA
+            self.batched = all(tap.components is None for tap in self.valid_taps)
+            rows = self._joint_rows()
+            if self.batched:
+                self.bank = self._joint_bank([tap.bank for tap in self.valid_taps], rows)
+
+            # Pirámide: todos los grifos en baja resolución con una operación conjunta
+            # (siempre L1, también los de banco PCA, que solo usan PCA al escalar)
+            self.pyramid = (
+                PYRAMID_FACTOR > 1 and len(rows[0]) >= PYRAMID_MIN_PROTOTYPES * len(STATES)
+                and all(tap.low_bank is not None for tap in self.valid_taps)
+            )
+            if self.pyramid:
+                self.low_bank = self._joint_bank([tap.low_bank for tap in self.valid_taps], rows)
+                low_sizes = [tap.low_shape[0] * tap.low_shape[1] for tap in self.valid_taps]
+                self.low_norms = np.array(low_sizes, dtype=np.float64)
+                self.low_offsets = np.concatenate(([0], np.cumsum(low_sizes)[:-1]))
+                self.low_segments = [slice(o, o + n) for o, n in zip(self.low_offsets, low_sizes)]
+            self._init_buffers()
+
+    def _init_buffers(self):
+        """Buffers de trabajo y estado de la compuerta (propios de cada instancia)"""
+        self._pixels = np.empty(len(self.pixel_index), dtype=np.uint8)
+        self._diff = np.empty_like(self.bank) if self.batched else None
+        if self.pyramid:
+            self._low_pixels = np.empty(int(self.low_norms.sum()), dtype=np.uint8)
+            self._low_diff = np.empty_like(self.low_bank)
+
+        # Estado de la compuerta: ROI, distancias y margen de la última clasificación completa
+        self._ref_pixels = None
+        self._ref_sums = np.zeros((len(STATES), self.n_valid), dtype=np.float64)
+        self._ref_margin = np.zeros(self.n_valid, dtype=np.float64)
+        self._delta = np.empty(len(self.pixel_index), dtype=np.int16)
+
+    def clone(self, taps):
+        """Clasificador para `taps` (clones de los originales) que comparte índices y banco conjunto"""
+        classifier = copy.copy(self)
+        classifier.taps = taps
+        classifier.last_checks = classifier.last_hits = classifier.last_low = classifier.last_escalated = 0
+        if self.n_valid:
+            classifier.valid_taps = [tap for tap, ok in zip(taps, self.valid) if ok]
+            classifier._init_buffers()
+        return classifier
+
+    def _joint_rows(self):
+        """
+        Filas de cada grifo en los bancos conjuntos. Cada estado ocupa las mismas
+        filas en todos: los grifos con menos prototipos repiten su último prototipo
+        de ese estado (un duplicado no cambia el mínimo).
+        """
+        counts = [np.diff(np.append(tap.state_offsets, len(tap.bank))) for tap in self.valid_taps]
+        rows_per_state = np.max(counts, axis=0)
+        self.state_offsets = np.concatenate(([0], np.cumsum(rows_per_state)[:-1]))
+        return [
+            np.concatenate([
+                start + np.minimum(np.arange(n_rows), n - 1)
+                for start, n, n_rows in zip(tap.state_offsets, tap_counts, rows_per_state)
+            ])
+            for tap, tap_counts in zip(self.valid_taps, counts)
+        ]
+
+    def _joint_bank(self, banks, rows):
+        """Matriz (prototipos, píxeles) con los bancos de todos los grifos uno al lado del otro"""
+        return np.ascontiguousarray(np.concatenate(
+            [bank.reshape(len(bank), -1)[tap_rows] for bank, tap_rows in zip(banks, rows)], axis=1
+        ))
+
+    def classify(self, frame_gray):
+        """
+        Devuelve (codes, scores): `codes[i]` es el índice en STATES del grifo i y
+        `scores` una matriz (estados, grifos) con la distancia por píxel al mejor
+        prototipo de cada estado (NaN para grifos con ROI inválida).
+        """
+        codes = np.full(len(self.taps), CLOSED_CODE, dtype=np.intp)
+        scores = np.full((len(STATES), len(self.taps)), np.nan)
+        if not self.n_valid:
+            return codes, scores
+
+        np.take(frame_gray.reshape(-1), self.pixel_index, out=self._pixels)
+        stale = self._gate()
+
+        if self.pyramid and (stale is None or len(stale)):
+            stale = self._classify_low(frame_gray, stale)
+
+        if stale is None and self.batched:
+            # Todos los grifos: una sola operación
+            np.subtract(self.bank, self._pixels, out=self._diff)
+            np.abs(self._diff, out=self._diff)
+            sums = np.add.reduceat(self._diff, self.offsets, axis=1, dtype=np.int64)
+            self._remember(np.arange(self.n_valid), np.minimum.reduceat(sums, self.state_offsets, axis=0))
+        elif stale is None or len(stale):
+            # Solo los grifos cuya ROI ha cambiado (o todos, uno a uno, si hay bancos PCA)
+            if stale is None:
+                stale = np.arange(self.n_valid)
+            sums = np.empty((len(STATES), len(stale)), dtype=np.float64)
+            for j, t in enumerate(stale):
+                segment = slice(self.offsets[t], self.offsets[t] + self.sizes[t])
+                sums[:, j] = self.valid_taps[t].score_pixels(self._pixels[segment])
+            self._remember(stale, sums)
+
+        valid_scores = self._ref_sums / self.norms
+        scores[:, self.valid] = valid_scores
+        codes[self.valid] = np.argmin(valid_scores, axis=0)
+        return codes, scores
+
+    def _gate(self):
+        """
+        Grifos que hay que volver a clasificar (None = todos). Para cada grifo,
+        Δ = suma |ROI actual - ROI de su última clasificación completa|. Ningún
+        score puede moverse más de Δ, así que si el margen entre el mejor estado
+        y el segundo supera 2Δ el ganador no cambia. Con PCA también: la distancia
+        proyectada se mueve como mucho la norma L2 del cambio, que es <= Δ.
+        """
+        self.last_checks = self.last_hits = self.last_low = self.last_escalated = 0
+        if not self.gate_factor or self._ref_pixels is None:
+            return None
+
+        np.subtract(self._pixels, self._ref_pixels, out=self._delta, dtype=np.int16)
+        np.abs(self._delta, out=self._delta)
+        deltas = np.add.reduceat(self._delta, self.offsets, dtype=np.int64)
+        stale = np.flatnonzero(self._ref_margin <= self.gate_factor * deltas)
+
+        self.last_checks = self.n_valid
+        self.last_hits = self.n_valid - len(stale)
+        # Si casi todos cambiaron, sale más barata la operación conjunta
+        return None if len(stale) == self.n_valid else stale
+
+    def _classify_low(self, frame_gray, stale):
+        """
+        Primera pasada en baja resolución de los grifos `stale` (None = todos).
+        Los resueltos quedan en la compuerta con sus scores por píxel llevados a
+        la escala de la ROI completa. Devuelve los grifos a escalar (None = todos).
+        """
+        candidates = np.arange(self.n_valid) if stale is None else stale
+        for t in candidates:
+            x, y, w, h = self.valid_taps[t].roi
+            low_h, low_w = self.valid_taps[t].low_shape
+            cv2.resize(frame_gray[y:y+h, x:x+w], (low_w, low_h),
+                       dst=self._low_pixels[self.low_segments[t]].reshape(low_h, low_w),
+                       interpolation=cv2.INTER_AREA)
+
+        # Todos los grifos a la vez (en baja resolución sale más barato que seleccionar)
+        np.subtract(self.low_bank, self._low_pixels, out=self._low_diff)
+        np.abs(self._low_diff, out=self._low_diff)
+        sums = np.add.reduceat(self._low_diff, self.low_offsets, axis=1, dtype=np.int64)
+        low_scores = np.minimum.reduceat(sums, self.state_offsets, axis=0)[:, candidates] / self.low_norms[candidates]
+
+        ordered = np.sort(low_scores, axis=0)
+        clear = ordered[1] - ordered[0] >= self.pyramid_margin
+        escalate = candidates[~clear]
+        self.last_low = len(candidates)
+        self.last_escalated = len(escalate)
+        resolved = candidates[clear]
+        self._remember(resolved, low_scores[:, clear] * self.norms[resolved])
+        if stale is None and len(escalate) == self.n_valid:
+            return None # Todos dudosos: operación conjunta a resolución completa
+        return escalate
+
+    def gate_state(self):
+        """Estado de la compuerta (para los puntos de control), o None si aún no hay"""
+        if not self.n_valid or self._ref_pixels is None:
+            return None
+        return {"pixels": self._ref_pixels, "sums": self._ref_sums, "margin": self._ref_margin}
+
+    def load_gate_state(self, state):
+        """Restaura `gate_state()`: tras reanudar, cada grifo se reutiliza o no como sin cortes"""
+        self._ref_pixels = np.array(state["pixels"], dtype=np.uint8)
+        self._ref_sums[:] = state["sums"]
+        self._ref_margin[:] = state["margin"]
+
+    def _remember(self, taps, sums):
+        """Guarda la ROI, las sumas y el margen de los grifos recién clasificados"""
+        if self._ref_pixels is None:
+            self._ref_pixels = self._pixels.copy()
+        for t in taps:
+            segment = slice(self.offsets[t], self.offsets[t] + self.sizes[t])
+            self._ref_pixels[segment] = self._pixels[segment]
+        self._ref_sums[:, taps] = sums
+        ordered = np.sort(sums, axis=0)
+        self._ref_margin[taps] = ordered[1] - ordered[0]
+
+class StageProfiler:
+    """
+    Tiempo y nº de llamadas acumulados por etapa del bucle caliente. En modo
+    paralelo se suman los de todos los procesos (tiempo de CPU, no de reloj).
+    """
+    STAGES = ("seek", "grab", "decode", "wait", "sink", "cvt", "blur", "classify", "update")
+    COUNTERS = ("gate_checks", "gate_hits", "pyramid_low", "pyramid_escalated")
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.calls = dict.fromkeys(self.STAGES, 0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def add(self, stage, seconds, calls=1):
+        self.seconds[stage] += seconds
+        self.calls[stage] += calls
+
+    def count(self, counter, n):
+        self.counters[counter] += n
+
+    def merge(self, other):
+        for stage in self.STAGES:
+            self.add(stage, other.seconds[stage], other.calls[stage])
+        for counter in self.COUNTERS:
+            self.count(counter, other.counters[counter])
+
+    def gate_summary(self):
+        """Aciertos de la compuerta de cambios (grifo-frame que reutilizaron su estado)"""
+        checks, hits = self.counters["gate_checks"], self.counters["gate_hits"]
+        return {"checks": checks, "hits": hits, "hit_rate": round(hits / checks, 4) if checks else None}
+
+    def pyramid_summary(self):
+        """Grifo-frame clasificados en baja resolución y cuántos se escalaron a resolución completa"""
+        low, escalated = self.counters["pyramid_low"], self.counters["pyramid_escalated"]
+        return {"low_res": low, "escalated": escalated, "escalation_rate": round(escalated / low, 4) if low else None}
+
+    def as_dict(self):
+        return {stage: {"seconds": round(self.seconds[stage], 4), "calls": self.calls[stage]} for stage in self.STAGES}
+
+class VideoFrameReader:
+    """
+    Lectura por índice absoluto de frame sobre un cv2.VideoCapture.
+    Avanza con grab() como el bucle clásico y solo hace seek para volver atrás o
+    para saltos hacia delante de al menos `seek_min` frames (None = nunca).
+    `read_codes(idx)` devuelve los códigos de estado de todos los grifos en ese
+    frame, o None si el vídeo se ha terminado.
+    """
+    def __init__(self, cap, engine, window, total_frames, seek_min=None):
+        self.cap = cap
+        self.engine = engine
+        self.window = window
+        self.total_frames = total_frames
+        self.seek_min = seek_min
+        self.pos = 0 # Próximo frame que devolverá el decodificador
+        self.seeks = 0
+        self._last_progress = -1
+
+    def _seek(self, idx):
+        t0 = time.perf_counter()
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        self.engine.profiler.add("seek", time.perf_counter() - t0)
+        self.pos = idx
+        self.seeks += 1
+
+    def read_codes(self, idx):
+        if idx < self.pos or (self.seek_min is not None and idx - self.pos >= self.seek_min):
+            self._seek(idx)
+
+        profiler = self.engine.profiler
+        t0 = time.perf_counter()
+        skipped = idx - self.pos
+        while self.pos < idx:
+            self.cap.grab()
+            self.pos += 1
+        t1 = time.perf_counter()
+        if skipped > 0: profiler.add("grab", t1 - t0, skipped)
+        ret, frame = self.cap.read()
+        profiler.add("decode", time.perf_counter() - t1)
+        if not ret: return None
+        self.pos += 1
+        self._progress(idx)
+
+        # Todos los grifos en una sola pasada
+        return self.engine._classify(frame, self.window, idx)
+
+    def _progress(self, idx):
+        # Barra de progreso simple para consola
+        if idx // 60 != self._last_progress:
+            self._last_progress = idx // 60
+            percent = int(idx / self.total_frames * 100) if self.total_frames > 0 else 0
+            sys.stdout.write(f'\rProgress: {percent}% ')
+            sys.stdout.flush()
+        self.engine._report_progress(idx + 1, self.total_frames)
+
 class BeerCounterEngine:
     def __init__(self, coords_file, refs_folder):
         self.refs_folder = refs_folder
+        # Coordenadas y referencias de la caché del proceso (solo se leen de disco si cambiaron)
+        self.calibration = load_calibration(coords_file, refs_folder)
         
-        # Variables para guardar las coordenadas RAW (sin escalar)
-        self.raw_roi_a = (0,0,0,0)
-        self.raw_roi_b = (0,0,0,0)
+        # Coordenadas RAW (sin escalar) de cada grifo, en orden A, B, C...
+        self.raw_rois = list(self.calibration.rois)
         self.ref_w = 1920 
         self.ref_h = 1080
 
-        try:
-            with open(coords_file, 'r') as f:
-                line = f.read().strip()
-                parts = line.split('|')
-                
-                self.raw_roi_a = tuple(map(int, parts[0].split(',')))
-                self.raw_roi_b = tuple(map(int, parts[1].split(',')))
-                
-                # Si existe la 3ª parte (resolución), la cargamos
-                if len(parts) > 2:
-                    ref_dims = tuple(map(int, parts[2].split(',')))
-                    self.ref_w, self.ref_h = ref_dims
-                    print(f"📏 Referencia original cargada: {self.ref_w}x{self.ref_h}")
-                else:
-                    print("⚠️ No se encontró resolución en coords. Asumiendo 1920x1080.")
-        except Exception as e:
-            print(f"❌ Error leyendo coordenadas: {e}")
+        if self.calibration.error is None:
+            print(f"🚰 Grifos configurados: {len(self.raw_rois)}")
+
+            if self.calibration.ref_dims:
+                self.ref_w, self.ref_h = self.calibration.ref_dims
+                print(f"📏 Referencia original cargada: {self.ref_w}x{self.ref_h}")
+            else:
+                print("⚠️ No se encontró resolución en coords. Asumiendo 1920x1080.")
+        else:
+            print(f"❌ Error leyendo coordenadas: {self.calibration.error}")
+
+        self.tap_names = self.calibration.tap_names
+        self.taps = []
+        self.security_cooldown = 0
+        self.progress_callback = None
+        self.profiler = StageProfiler()
+        self.trace = None # TraceRecorder mientras se graba la traza de scores
+
+    def __getstate__(self):
+        # El motor viaja a los procesos del modo paralelo: el callback no (puede no ser serializable)
+        state = self.__dict__.copy()
+        state["progress_callback"] = None
+        state["calibration"] = None # Los procesos hijos ya reciben los grifos construidos
+        return state
 
     def _apply_scale(self, roi, sx, sy):
         return (int(roi[0] * sx), int(roi[1] * sy), int(roi[2] * sx), int(roi[3] * sy))
 
-    def process_video(self, video_path):
+    def _compute_window(self, rois, vid_w, vid_h):
+        """
+        Ventana (x0, y0, x1, y1) que cubre todas las ROIs más el margen del blur.
+        Los píxeles de las ROIs quedan a >= BLUR_MARGIN del borde del recorte (o en
+        el borde real del frame), así que gris + blur dan exactamente lo mismo que
+        sobre el frame completo.
+        """
+        if not ROI_ONLY_PREPROCESSING or not rois:
+            return (0, 0, vid_w, vid_h)
+
+        x0 = max(0, min(r[0] for r in rois) - BLUR_MARGIN)
+        y0 = max(0, min(r[1] for r in rois) - BLUR_MARGIN)
+        x1 = min(vid_w, max(r[0] + r[2] for r in rois) + BLUR_MARGIN)
+        y1 = min(vid_h, max(r[1] + r[3] for r in rois) + BLUR_MARGIN)
+
+        # ROIs fuera de imagen: procesamos el frame completo (get_state devolverá 'closed')
+        if x1 <= x0 or y1 <= y0:
+            return (0, 0, vid_w, vid_h)
+        return (x0, y0, x1, y1)
+
+    def _preprocess(self, frame, window, out=None):
+        """Gris + blur sobre la ventana de trabajo. `out`: buffers (gris, blur) ya reservados."""
+        x0, y0, x1, y1 = window
+        gray_buf, blur_buf = out or (None, None)
+        t0 = time.perf_counter()
+        gray = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY, dst=gray_buf)
+        t1 = time.perf_counter()
+        blurred = cv2.GaussianBlur(gray, BLUR_KERNEL, 0, dst=blur_buf)
+        self.profiler.add("cvt", t1 - t0)
+        self.profiler.add("blur", time.perf_counter() - t1)
+        return blurred
+
+    def _classify(self, frame, window, idx=None):
+        """Preprocesa un frame y devuelve el código de estado de cada grifo"""
+        return self._classify_gray(self._preprocess(frame, window), idx)
+
+    def _classify_gray(self, gray, idx=None):
+        """
+        Código de estado de cada grifo sobre una ventana ya preprocesada. Los scores
+        quedan en `last_scores` y, si se graba la traza, asociados al frame `idx`.
+        """
+        t0 = time.perf_counter()
+        codes, self.last_scores = self.classifier.classify(gray)
+        self.profiler.add("classify", time.perf_counter() - t0)
+        if self.trace is not None and idx is not None:
+            self.trace.remember(idx, self.last_scores)
+        self.profiler.count("gate_checks", self.classifier.last_checks)
+        self.profiler.count("gate_hits", self.classifier.last_hits)
+        self.profiler.count("pyramid_low", self.classifier.last_low)
+        self.profiler.count("pyramid_escalated", self.classifier.last_escalated)
+        return codes
+
+    def _build_taps(self, vid_w, vid_h):
+        """
+        Grifos y clasificador para esta resolución. Los bancos escalados se construyen
+        una vez por proceso (caché de calibración); cada análisis usa clones con los
+        contadores a cero y sus propios buffers.
+        """
+        print(f"🎬 Video: {vid_w}x{vid_h} | Escala: X={vid_w / self.ref_w:.2f}, Y={vid_h / self.ref_h:.2f}")
+        window, taps, classifier = self.calibration.scaled((vid_w, vid_h), lambda: self._scale_taps(vid_w, vid_h))
+        self.taps = [tap.clone() for tap in taps]
+        self.classifier = classifier.clone(self.taps)
+        return window
+
+    def _scale_taps(self, vid_w, vid_h):
+        """Escala las ROIs al vídeo, crea los SingleTap y el clasificador conjunto"""
+        scale_x = vid_w / self.ref_w
+        scale_y = vid_h / self.ref_h
+
+        rois_scaled = [self._apply_scale(roi, scale_x, scale_y) for roi in self.raw_rois]
+
+        # Ventana de preprocesado: las ROIs pasan a coordenadas relativas a ella
+        window = self._compute_window(rois_scaled, vid_w, vid_h)
+        x0, y0, x1, y1 = window
+        print(f"✂️ Ventana de preprocesado: {x1-x0}x{y1-y0} (de {vid_w}x{vid_h})")
+
+        taps = [
+            SingleTap(name, (roi[0] - x0, roi[1] - y0, roi[2], roi[3]), self.refs_folder,
+                      self.calibration.references[name])
+            for name, roi in zip(self.tap_names, rois_scaled)
+        ]
+        return window, taps, MultiTapClassifier(taps, (y1 - y0, x1 - x0))
+
+    def _build_results(self, fps, total_frames):
+        """Unifica eventos y contadores de todos los grifos"""
+        return build_results(self.taps, fps, total_frames)
+
+    def _build_profile(self, mode, elapsed, frames_total):
+        """Desglose por etapas, frames analizados frente al total y ratio de salto efectivo"""
+        calls = self.profiler.calls
+        return {
+            "mode": mode,
+            "wall_seconds": round(elapsed, 3),
+            "frames_total": frames_total,
+            "frames_analyzed": calls["classify"],
+            "frames_sampled": calls["update"],
+            "skip_ratio": round(1 - calls["update"] / frames_total, 4) if frames_total > 0 else None,
+            "seeks": calls["seek"],
+            "change_gate": self.profiler.gate_summary(),
+            "pyramid": self.profiler.pyramid_summary(),
+            "stages": self.profiler.as_dict(),
+        }
+
+    def _frames_to_skip(self):
+        """Frames a saltar antes del siguiente muestreo (solo en reposo)"""
+        return IDLE_SKIP_FRAMES if self.security_cooldown == 0 else 0
+
+    def _on_sample(self, codes, frame_idx, fps):
+        """Aplica un frame muestreado: cooldown de seguridad + máquina de estados de cada grifo"""
+        t0 = time.perf_counter()
+        any_active = bool(np.any(codes != CLOSED_CODE))
+        if any_active:
+            self.security_cooldown = COOLDOWN_FRAMES
+        else:
+            if self.security_cooldown > 0: self.security_cooldown -= 1
+
+        for tap, code in zip(self.taps, codes):
+            tap.update_logic(STATES[code], frame_idx, fps)
+        if self.trace is not None:
+            self.trace.add(frame_idx - 1, codes)
+        self.profiler.add("update", time.perf_counter() - t0)
+
+        if self.progress_callback is not None:
+            self._report_new_events()
+
+    def _report_progress(self, frames_done, total_frames, force=False):
+        """Avisa al callback de progreso (como mucho cada PROGRESS_INTERVAL_SECONDS)"""
+        if self.progress_callback is None: return
+        now = time.time()
+        if not force and now - self._last_report < PROGRESS_INTERVAL_SECONDS: return
+        self._last_report = now
+
+        elapsed = now - self._start_time
+        rate = frames_done / elapsed if elapsed > 0 else 0.0
+        percent = None
+        eta = None
+        if total_frames > 0:
+            percent = round(min(100.0, frames_done / total_frames * 100), 1)
+            if rate > 0:
+                eta = round(max(0, total_frames - frames_done) / rate, 1)
+
+        self.progress_callback({
+            "type": "progress",
+            "frame": frames_done,
+            "total_frames": total_frames,
+            "percent": percent,
+            "fps": round(rate, 1),
+            "eta_seconds": eta,
+        })
+
+    def _report_new_events(self):
+        """Envía al callback cada tirada en cuanto se cierra"""
+        for tap in self.taps:
+            reported = self._events_reported.get(tap.name, 0)
+            for event in tap.timeline_events[reported:]:
+                self.progress_callback({"type": "event", "event": event})
+            self._events_reported[tap.name] = len(tap.timeline_events)
+
+    def _scan_chunk(self, video_path, window, start, end):
+        """
+        (Proceso hijo) Decodifica y clasifica TODOS los frames de [start, end).
+        Con end=None lee hasta el final del vídeo. Devuelve una matriz
+        (frames, grifos) con el código de estado de cada grifo en cada frame,
+        sus scores (ver _scan_dense) y el StageProfiler del tramo.
+        """
+        self.profiler = StageProfiler()
+        cap = cv2.VideoCapture(video_path)
+        if start > 0:
+            t0 = time.perf_counter()
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            self.profiler.add("seek", time.perf_counter() - t0)
+
+        trace, scores = self._scan_dense(cap, window, start, end)
+        cap.release()
+        return trace, scores, self.profiler
+
+    def _scan_dense(self, cap, window, start=0, end=None, frame_sink=None, total_frames=0):
+        """
+        Clasifica todos los frames de [start, end) desde la posición actual de `cap`.
+        Con DECODE_AHEAD_SLOTS (y varios núcleos) la decodificación y el gris + blur
+        van en un hilo aparte (DecodeAheadReader) y se solapan con la clasificación
+        y el sink. Devuelve la traza (frames, grifos) de códigos de estado y, si se
+        graba la traza de scores, los de cada frame (frames, estados, grifos) en
+        float16 (None si no).
+        """
+        if DECODE_AHEAD_SLOTS and (os.cpu_count() or 1) >= DECODE_AHEAD_MIN_CPUS:
+            frames = DecodeAheadReader(cap, self, window, start, end)
+        else:
+            frames = self._read_frames(cap, window, start, end)
+
+        codes, scores = [], [] if self.trace is not None else None
+        for idx, frame, gray in frames:
+            if frame_sink is not None:
+                t0 = time.perf_counter()
+                frame_sink(frame)
+                self.profiler.add("sink", time.perf_counter() - t0)
+            codes.append(self._classify_gray(gray).astype(np.uint8))
+            if scores is not None:
+                scores.append(self.last_scores.astype(np.float16))
+            self._report_progress(idx + 1, total_frames)
+
+        if not codes:
+            empty_scores = np.empty((0, len(STATES), len(self.taps)), dtype=np.float16)
+            return np.empty((0, len(self.taps)), dtype=np.uint8), empty_scores if scores is not None else None
+        return np.stack(codes), np.stack(scores) if scores is not None else None
+
+    def _dense_reader(self, trace, scores):
+        """`read_codes` sobre una traza densa ya calculada (modo paralelo y tubería)"""
+        def read_codes(idx):
+            if idx >= len(trace): return None
+            if scores is not None and self.trace is not None:
+                self.trace.remember(idx, scores[idx])
+            return trace[idx]
+        return read_codes
+
+    def _read_frames(self, cap, window, start, end):
+        """Lo mismo que DecodeAheadReader, en el mismo hilo"""
+        idx = start
+        while end is None or idx < end:
+            t0 = time.perf_counter()
+            ret, frame = cap.read()
+            self.profiler.add("decode", time.perf_counter() - t0)
+            if not ret: break
+            yield idx, frame, self._preprocess(frame, window)
+            idx += 1
+
+    def _run_skip_schedule(self, read_codes, fps, last=-1):
+        """Muestreo clásico: en reposo salta IDLE_SKIP_FRAMES frames entre muestras"""
+        while True:
+            idx = last + 1 + self._frames_to_skip()
+            codes = read_codes(idx)
+            if codes is None: break
+            self._on_sample(codes, idx + 1, fps)
+            last = idx
+            self._save_schedule_checkpoint(last)
+
+    def _run_bisect_schedule(self, read_codes, fps, total_frames, keyframes=None, last=-1):
+        """
+        Muestreo grueso-a-fino: zancadas largas en reposo y, cuando aparece
+        actividad, bisección entre la última muestra en reposo y la actual para
+        arrancar la máquina de estados en el frame exacto del cambio.
+        Con `keyframes` (índices ordenados) cada zancada acaba en el keyframe más
+        lejano que cabe en ella; si no cabe ninguno, en la zancada completa.
+        """
+        stride = max(1, int(IDLE_STRIDE_SECONDS * fps))
+        # `last`: último frame muestreado (-1 al empezar, o el del punto de control)
+        while True:
+            idle = self.security_cooldown == 0
+            idx = last + (stride if idle and last >= 0 else 1)
+            if keyframes and idle and last >= 0:
+                j = bisect_right(keyframes, idx) - 1
+                if keyframes[j] > last:
+                    idx = keyframes[j]
+
+            # No dejar sin mirar el final del vídeo
+            if idle and idx >= total_frames and last < total_frames - 1:
+                idx = total_frames - 1
+
+            codes = read_codes(idx)
+            if codes is None: break
+
+            if idle and idx - last > 1 and np.any(codes != CLOSED_CODE):
+                idx, codes = self._bisect_start(read_codes, last, idx, codes)
+                self.bisections += 1
+
+            self._on_sample(codes, idx + 1, fps)
+            last = idx
+            self._save_schedule_checkpoint(last)
+
+    def _bisect_start(self, read_codes, lo, hi, hi_codes):
+        """Primer frame con algún grifo activo en (lo, hi]. `lo` está en reposo y `hi` activo."""
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            codes = read_codes(mid)
+            if codes is not None and np.any(codes != CLOSED_CODE):
+                hi, hi_codes = mid, codes
+            else:
+                lo = mid
+        return hi, hi_codes
+
+    def _run_schedule(self, read_codes, fps, total_frames, keyframes=None, resume=None):
+        """
+        Recorre el vídeo con el modo de escaneo configurado. `read_codes` puede
+        leer del decodificador o de una traza densa ya calculada (modo paralelo):
+        el muestreo es el mismo, así que el resultado también.
+        Con `resume` (punto de control) sigue tras su último frame muestreado: el
+        siguiente muestreo solo depende de él, del cooldown y de los grifos.
+        """
+        resume = resume or {}
+        last = resume.get("last", -1)
+        self.security_cooldown = resume.get("security_cooldown", 0)
+        self.bisections = resume.get("bisections", 0)
+        # Sin nº de frames fiable no nos fiamos del seek: modo clásico
+        if IDLE_SCAN_MODE in ("bisect", "keyframe") and total_frames > 0:
+            self._run_bisect_schedule(read_codes, fps, total_frames, keyframes, last)
+            print(f"\n🔎 Inicios refinados por bisección: {self.bisections}")
+        else:
+            self._run_skip_schedule(read_codes, fps, last)
+
+    # --- PUNTOS DE CONTROL ---
+
+    def _checkpoint_header_for(self, video_path, mode):
+        """Lo que identifica un análisis: un punto de control solo sirve si coincide todo"""
+        st = os.stat(video_path)
+        return {
+            "video": os.path.abspath(video_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+            "fingerprint": self.calibration.fingerprint, "mode": mode, "trace": self.trace is not None,
+        }
+
+    def _load_checkpoint(self, video_path, mode):
+        """Punto de control de este mismo análisis, o None (no hay, está dañado o es de otro)"""
+        self._last_checkpoint = time.time()
+        if self.checkpoint_path is None:
+            return None
+        header = self._checkpoint_header = self._checkpoint_header_for(video_path, mode)
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if any(state.get(key) != value for key, value in header.items()):
+            print("⚠️ Punto de control de otro vídeo, calibración o modo: empezando desde el principio")
+            self._discard_checkpoint()
+            return None
+        return state
+
+    def _save_checkpoint(self, state):
+        """Escritura atómica: un corte a mitad nunca deja un punto de control a medias"""
+        self._last_checkpoint = time.time()
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({**self._checkpoint_header, **state}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _save_schedule_checkpoint(self, last):
+        """Posición del muestreo + cooldown + grifos, como mucho cada CHECKPOINT_INTERVAL_SECONDS"""
+        if self.checkpoint_path is None or self._checkpoint_header["mode"] not in ("keyframe", "sequential"):
+            return
+        if time.time() - self._last_checkpoint < CHECKPOINT_INTERVAL_SECONDS:
+            return
+        if self.trace is not None:
+            # Muestras ya tomadas: la traza reanudada sale igual que sin cortes
+            np.save(f"{self.checkpoint_path}.tmp.npy", self.trace.to_array())
+            os.replace(f"{self.checkpoint_path}.tmp.npy", f"{self.checkpoint_path}.trace.npy")
+        gate = self.classifier.gate_state()
+        if gate is not None:
+            # Compuerta de cambios: sin ella los scores tras reanudar serían los de una
+            # clasificación completa y no los reutilizados (mismo estado, otros scores)
+            np.savez(f"{self.checkpoint_path}.tmp.npz", last=last, **gate)
+            os.replace(f"{self.checkpoint_path}.tmp.npz", f"{self.checkpoint_path}.gate.npz")
+        self._save_checkpoint({
+            "last": last,
+            "security_cooldown": self.security_cooldown,
+            "bisections": getattr(self, "bisections", 0),
+            "taps": {tap.name: tap.state_dict() for tap in self.taps},
+        })
+
+    def _chunk_path(self, start, end):
+        return os.path.join(f"{self.checkpoint_path}.chunks", f"{start}_{end}.npz")
+
+    def _discard_checkpoint(self):
+        if self.checkpoint_path is None: return
+        for path in (self.checkpoint_path, f"{self.checkpoint_path}.tmp", f"{self.checkpoint_path}.trace.npy",
+                     f"{self.checkpoint_path}.gate.npz"):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(f"{self.checkpoint_path}.chunks", ignore_errors=True)
+
+    def _open_keyframe_reader(self, video_path, window):
+        """Lector por keyframes, o None si no hay PyAV o el vídeo no se puede indexar"""
+        try:
+            return KeyframeVideoReader(video_path, self, window)
+        except Exception as e:
+            print(f"⚠️ Escaneo por keyframes no disponible ({e}). Usando bisección.")
+            return None
+
+    def _plan_chunks(self, total_frames, workers):
+        """Divide el vídeo en tramos contiguos [start, end); el último llega hasta el final"""
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        n_chunks = min(workers, total_frames // MIN_CHUNK_FRAMES)
+        if n_chunks <= 1:
+            return []
+
+        bounds = np.linspace(0, total_frames, n_chunks + 1).astype(int)
+        chunks = [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+        chunks[-1] = (chunks[-1][0], None)
+        return chunks
+
+    def _process_parallel(self, video_path, window, chunks, total_frames, resume=None):
+        """
+        Analiza los tramos en un pool de procesos y cose el resultado: las trazas
+        se concatenan en orden y las máquinas de estado se ejecutan una sola vez
+        sobre la traza completa (con el mismo muestreo que el modo secuencial),
+        así que una tirada que cruza un corte se cuenta una única vez y con su
+        duración real. Con punto de control, los tramos terminados se guardan en
+        disco y `resume` indica los que ya no hay que repetir.
+        Devuelve (traza completa, scores o None), o None si algún tramo no encaja.
+        """
+        print(f"⚡ Modo paralelo: {len(chunks)} tramos")
+        done = {}
+        for start, end in (resume or {}).get("chunks", []):
+            if [start, end] in [list(c) for c in chunks] and os.path.exists(self._chunk_path(start, end)):
+                with np.load(self._chunk_path(start, end)) as data:
+                    done[(start, end)] = (data["codes"], data["scores"] if "scores" in data.files else None)
+        if done:
+            print(f"♻️ Tramos recuperados del punto de control: {len(done)}/{len(chunks)}")
+
+        ctx = multiprocessing.get_context("spawn")
+        pending = [chunk for chunk in chunks if chunk not in done]
+        with ProcessPoolExecutor(max_workers=max(1, len(pending)), mp_context=ctx) as pool:
+            futures = {chunk: pool.submit(self._scan_chunk, video_path, window, *chunk) for chunk in pending}
+            traces, scores = [], []
+            for i, chunk in enumerate(chunks):
+                if chunk in done:
+                    trace, trace_scores = done[chunk]
+                else:
+                    trace, trace_scores, chunk_profiler = futures[chunk].result()
+                    self.profiler.merge(chunk_profiler)
+                    if self.checkpoint_path is not None:
+                        self._save_chunk(chunk, trace, trace_scores, list(done))
+                    done[chunk] = (trace, trace_scores)
+                traces.append(trace)
+                scores.append(trace_scores)
+                sys.stdout.write(f'\rTramos completados: {i + 1}/{len(chunks)} ')
+                sys.stdout.flush()
+                self._report_progress(sum(len(t) for t in traces), total_frames)
+
+        # Un tramo intermedio incompleto significa que el nº de frames del contenedor no es fiable
+        for (start, end), trace in zip(chunks[:-1], traces[:-1]):
+            if len(trace) != end - start:
+                print(f"\n⚠️ Tramo {start}-{end} incompleto ({len(trace)} frames). Volviendo a modo secuencial.")
+                return None
+        if any(trace_scores is None for trace_scores in scores):
+            return np.concatenate(traces), None
+        return np.concatenate(traces), np.concatenate(scores)
+
+    def _save_chunk(self, chunk, trace, scores, saved):
+        """Traza de un tramo terminado (.npz) y punto de control con la lista de tramos guardados"""
+        path = self._chunk_path(*chunk)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, codes=trace, **({"scores": scores} if scores is not None else {}))
+        os.replace(tmp_path, path)
+        self._save_checkpoint({"chunks": [list(c) for c in saved + [chunk]]})
+
+    def process_video(self, video_path, workers=PARALLEL_WORKERS, progress_callback=None, frame_sink=None,
+                      checkpoint_path=None, trace_path=None):
+        """
+        Analiza un vídeo completo. `progress_callback(msg)` (opcional) recibe
+        mensajes {"type": "progress", percent, fps, eta_seconds, ...} y
+        {"type": "event", "event": {...}} con cada tirada en cuanto se detecta.
+        `frame_sink(frame)` (opcional) recibe todos los frames a resolución original,
+        una sola vez y en orden (análisis en tubería, ver _scan_dense).
+        `checkpoint_path` (opcional): fichero de punto de control. Si existe y es de
+        este mismo análisis se reanuda desde él (mismo resultado que sin cortes); al
+        terminar se borra. En tubería no se usa: el sink necesita todos los frames.
+        `trace_path` (opcional): guarda ahí la traza de scores de los frames muestreados
+        (`trace_path`.npy + .json, ver score_trace) para recalcular con otras reglas.
+        """
+        self.progress_callback = progress_callback
+        self.checkpoint_path = checkpoint_path if frame_sink is None else None
+        self._events_reported = {}
+        self._last_report = 0.0
+        self.profiler = StageProfiler()
+
         if not os.path.exists(video_path):
             print("❌ Video no encontrado")
             return {"error": "Video no encontrado"}
@@ -148,89 +1290,105 @@ class BeerCounterEngine:
         # --- DETECTAR ESCALA Y CREAR GRIFOS ---
         vid_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         vid_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        # Calcular factor de escala
-        scale_x = vid_w / self.ref_w
-        scale_y = vid_h / self.ref_h
-        
-        print(f"🎬 Video: {vid_w}x{vid_h} | Escala: X={scale_x:.2f}, Y={scale_y:.2f}")
-
-        # Aplicar escala y crear los objetos SingleTap AHORA
-        roi_a_scaled = self._apply_scale(self.raw_roi_a, scale_x, scale_y)
-        roi_b_scaled = self._apply_scale(self.raw_roi_b, scale_x, scale_y)
-        
-        self.tap_a = SingleTap("A", roi_a_scaled, self.refs_folder)
-        self.tap_b = SingleTap("B", roi_b_scaled, self.refs_folder)
+        window = self._build_taps(vid_w, vid_h)
+        self.trace = TraceRecorder(len(self.taps), len(STATES)) if trace_path else None
         # ----------------------------------------------------
 
         fps = cap.get(cv2.CAP_PROP_FPS)
         if fps == 0: fps = 30
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
-        frame_idx = 0
-        security_cooldown = 0 
-        
         print(f"🎬 Procesando: {os.path.basename(video_path)}")
         start_time = time.time()
+        self._start_time = start_time
 
-        while True:
-            # Barra de progreso simple para consola
-            if frame_idx % 60 == 0: 
-                percent = int(frame_idx / total_frames * 100) if total_frames > 0 else 0
-                sys.stdout.write(f'\rProgress: {percent}% ')
-                sys.stdout.flush()
+        # --- ESCANEO POR KEYFRAMES (decodifica una fracción del vídeo: mejor que repartirlo entero) ---
+        keyframe_reader = None
+        if IDLE_SCAN_MODE == "keyframe" and frame_sink is None:
+            keyframe_reader = self._open_keyframe_reader(video_path, window)
 
-            frames_to_skip = 0
-            if security_cooldown == 0:
-                frames_to_skip = IDLE_SKIP_FRAMES
-            
-            for _ in range(frames_to_skip):
-                cap.grab()
-                frame_idx += 1
-            
-            ret, frame = cap.read()
-            if not ret: break
-            frame_idx += 1
+        # --- MODO PARALELO (solo con nº de frames fiable) ---
+        dense = None
+        chunks = []
+        if workers != 1 and frame_sink is None and keyframe_reader is None:
+            chunks = self._plan_chunks(total_frames, workers)
+        mode = "keyframe" if keyframe_reader is not None else "parallel" if chunks else "sequential"
+        resume = self._load_checkpoint(video_path, mode)
+        if resume is not None and "last" in resume:
+            for tap in self.taps:
+                if tap.name in resume["taps"]:
+                    tap.load_state(resume["taps"][tap.name])
+            if self.trace is not None:
+                self.trace.restore(np.load(f"{self.checkpoint_path}.trace.npy"))
+            if os.path.exists(f"{self.checkpoint_path}.gate.npz"):
+                with np.load(f"{self.checkpoint_path}.gate.npz") as gate:
+                    if int(gate["last"]) == resume["last"]: # Un corte entre ficheros los desfasa
+                        self.classifier.load_gate_state(gate)
+            print(f"♻️ Reanudando desde el punto de control (frame {resume['last'] + 1})")
 
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            gray = cv2.GaussianBlur(gray, (5, 5), 0)
-            
-            state_a = self.tap_a.get_state(gray)
-            state_b = self.tap_b.get_state(gray)
-            
-            any_active = (state_a != 'closed') or (state_b != 'closed')
-            if any_active:
-                security_cooldown = COOLDOWN_FRAMES
-            else:
-                if security_cooldown > 0: security_cooldown -= 1
+        if chunks:
+            cap.release()
+            dense = self._process_parallel(video_path, window, chunks, total_frames, resume)
 
-            self.tap_a.update_logic(state_a, frame_idx, fps)
-            self.tap_b.update_logic(state_b, frame_idx, fps)
+        if keyframe_reader is not None:
+            self._run_schedule(keyframe_reader.read_codes, fps, keyframe_reader.total_frames,
+                               keyframe_reader.keyframes, resume)
+            frames_seen = keyframe_reader.total_frames
+            print(f"\n🔑 Keyframes decodificados en reposo: {keyframe_reader.keyframe_reads} de {len(keyframe_reader.keyframes)}")
+            keyframe_reader.close()
+        elif dense is not None:
+            trace, trace_scores = dense
+            self._run_schedule(self._dense_reader(trace, trace_scores), fps, len(trace))
+            frames_seen = len(trace)
+        elif frame_sink is not None:
+            # Reparar exige decodificar el vídeo entero: se clasifican todos los frames
+            # en tubería (decodificación en otro hilo) y se recorre la traza como en paralelo
+            mode = "pipelined"
+            trace, trace_scores = self._scan_dense(cap, window, frame_sink=frame_sink, total_frames=total_frames)
+            self._run_schedule(self._dense_reader(trace, trace_scores), fps, len(trace))
+            # Vídeos sin índice: la duración real sale de la pasada completa
+            if total_frames <= 0: total_frames = len(trace)
+            frames_seen = len(trace)
+        else:
+            if chunks:
+                cap = cv2.VideoCapture(video_path)
+                resume = None # El punto de control era de los tramos, no del muestreo
+            mode = "sequential"
+            seek_min = SEEK_MIN_FRAMES if IDLE_SCAN_MODE in ("bisect", "keyframe") else None
+            reader = VideoFrameReader(cap, self, window, total_frames, seek_min)
+            self._run_schedule(reader.read_codes, fps, total_frames, resume=resume)
+            frames_seen = reader.pos
 
         cap.release()
         elapsed = time.time() - start_time
         sys.stdout.write('\n') 
+        self._report_progress(total_frames, total_frames, force=True)
 
-        # --- UNIFICAR EVENTOS ---
-        all_events = self.tap_a.timeline_events + self.tap_b.timeline_events
-        all_events.sort(key=lambda x: x['start'])
-
-        final_duration = 0.0
-        if fps > 0 and total_frames > 0:
-            final_duration = total_frames / fps
+        results = self._build_results(fps, total_frames)
+        results["profile"] = self._build_profile(mode, elapsed, total_frames if total_frames > 0 else frames_seen)
+        results["profile"]["resumed"] = resume is not None
+        if self.trace is not None:
+            self.trace.save(trace_path, {
+                "video": os.path.basename(video_path), "fps": fps, "total_frames": total_frames,
+                "taps": [tap.name for tap in self.taps], "states": STATES, "mode": mode,
+                "fingerprint": self.calibration.fingerprint, "total": results["total"],
+                "rules": {"seconds_per_beer": SECONDS_PER_BEER, "threshold_rounding": THRESHOLD_ROUNDING,
+                          "min_pour_seconds": MIN_POUR_SECONDS},
+            })
+            print(f"💾 Traza de scores: {len(self.trace.rows)} muestras en {trace_path}.npy")
+            self.trace = None
+        self._discard_checkpoint() # Terminado: el siguiente análisis de este vídeo empieza de cero
         
         print("-" * 40)
         print(f"✅ Completado en {elapsed:.2f}s")
-        print(f"Duración calculada del vídeo: {final_duration:.2f}s")
-        print(f"TOTAL: {self.tap_a.count + self.tap_b.count} Cervezas")
-        print(f"Eventos registrados: {len(all_events)}")
+        print(f"Duración calculada del vídeo: {results['video_duration']:.2f}s")
+        print(f"TOTAL: {results['total']} Cervezas")
+        print(f"Eventos registrados: {len(results['events'])}")
+        print("⏱️ Etapas: " + " | ".join(
+            f"{stage} {info['seconds']:.2f}s" for stage, info in results["profile"]["stages"].items() if info["calls"]
+        ))
+        gate = results["profile"]["change_gate"]
+        if gate["checks"]:
+            print(f"🚦 Compuerta de cambios: {gate['hit_rate']:.0%} de {gate['checks']} clasificaciones reutilizadas")
 
-        return {
-        "grifo_a": self.tap_a.count,
-        "grifo_b": self.tap_b.count,
-        "total": self.tap_a.count + self.tap_b.count,
-        "seconds_a": round(self.tap_a.total_beer_seconds, 2),
-        "seconds_b": round(self.tap_b.total_beer_seconds, 2),
-        "events": all_events,
-        "video_duration": round(final_duration, 2)
-        }
\ No newline at end of file
+        return results
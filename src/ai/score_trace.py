@@ -0,0 +1,167 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+# --- TRAZAS DE SCORES POR SESIÓN ---
+# Cada análisis puede guardar, por cada frame muestreado, su índice, el estado
+# detectado en cada grifo y los scores de todos los estados. Es un array estructurado
+# .npy (se abre con np.load(mmap_mode="r") sin leerlo entero) más un .json con fps,
+# grifos y reglas. Las reglas de negocio (SECONDS_PER_BEER, THRESHOLD_ROUNDING,
+# MIN_POUR_SECONDS) solo actúan sobre la secuencia de estados muestreada, así que
+# recalcular conteos y tiradas con otras reglas no exige volver a decodificar:
+# basta con codificar por tramos (RLE) la secuencia de 'beer' de cada grifo.
+
+RECENT_SCORES = 256  # Scores de los últimos frames clasificados (la bisección vuelve sobre ellos)
+
+TapTotals = namedtuple("TapTotals", "name count total_beer_seconds timeline_events")
+
+def trace_dtype(n_taps, n_states):
+    """Registro por muestra: frame (índice absoluto), estado por grifo y scores (grifo, estado)"""
+    return np.dtype([("frame", "<i4"), ("codes", "u1", (n_taps,)), ("scores", "<f2", (n_taps, n_states))])
+
+class TraceRecorder:
+    """
+    Acumula la traza de un análisis. El motor llama a `remember(idx, scores)` al
+    clasificar un frame y a `add(idx, codes)` al muestrearlo: así una muestra que
+    sale de una bisección lleva los scores de su propio frame y no los del último
+    frame leído. Con la compuerta de cambios, un grifo reutilizado lleva los scores
+    de su última clasificación completa (los que decidieron su estado).
+    """
+    def __init__(self, n_taps, n_states):
+        self.dtype = trace_dtype(n_taps, n_states)
+        self.rows = []
+        self._recent = OrderedDict()
+        self._missing = np.full((n_taps, n_states), np.nan, dtype=np.float16)
+
+    def remember(self, idx, scores):
+        """`scores`: (estados, grifos), como los devuelve MultiTapClassifier.classify"""
+        self._recent[idx] = np.asarray(scores, dtype=np.float16).T
+        self._recent.move_to_end(idx)
+        if len(self._recent) > RECENT_SCORES:
+            self._recent.popitem(last=False)
+
+    def add(self, idx, codes):
+        self.rows.append((idx, codes, self._recent.get(idx, self._missing)))
+
+    def to_array(self):
+        return np.array(self.rows, dtype=self.dtype)
+
+    def restore(self, array):
+        """Muestras ya tomadas antes de un corte (punto de control)"""
+        self.rows = [tuple(row) for row in array.tolist()]
+
+    def save(self, path, meta):
+        """`path`.npy (traza) y `path`.json (metadatos), cada uno con escritura atómica"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.save(f"{path}.tmp.npy", self.to_array())
+        os.replace(f"{path}.tmp.npy", f"{path}.npy")
+        with open(f"{path}.tmp.json", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.tmp.json", f"{path}.json")
+
+def load_trace(path):
+    """(traza en memoria mapeada, metadatos) de `path` (sin extensión)"""
+    with open(f"{path}.json") as f:
+        meta = json.load(f)
+    return np.load(f"{path}.npy", mmap_mode="r"), meta
+
+def beer_runs(codes, beer_code):
+    """
+    Tramos de 'beer' en una secuencia de estados: (primera muestra del tramo,
+    primera muestra posterior que ya no es 'beer'). Un tramo que sigue abierto al
+    final no se cierra, igual que en la máquina de estados.
+    """
+    beer = np.concatenate(([False], codes == beer_code))
+    edges = np.diff(beer.astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts[:len(ends)], ends
+
+def beers_for_durations(durations, seconds_per_beer, threshold, min_pour):
+    """beers_for_duration aplicada a un array de duraciones (mismas operaciones en float64)"""
+    raw = durations / seconds_per_beer
+    int_part = np.floor(raw)
+    beers = int_part + (raw - int_part > threshold)
+    beers = np.maximum(beers, 1).astype(np.int64)
+    beers[durations <= min_pour] = 0
+    return beers
+
+def rescore(trace, meta, seconds_per_beer=None, threshold=None, min_pour=None):
+    """
+    Conteos y tiradas de una traza con otras reglas (por defecto, las del análisis).
+    Devuelve lo mismo que process_video (sin el perfil).
+    """
+    from src.ai.production_counter import build_results, STATES
+
+    rules = meta["rules"]
+    seconds_per_beer = rules["seconds_per_beer"] if seconds_per_beer is None else seconds_per_beer
+    threshold = rules["threshold_rounding"] if threshold is None else threshold
+    min_pour = rules["min_pour_seconds"] if min_pour is None else min_pour
+
+    fps = meta["fps"]
+    # El motor fecha cada muestra en su frame + 1 (ver BeerCounterEngine._on_sample)
+    times = (np.asarray(trace["frame"], dtype=np.int64) + 1) / fps
+    codes = np.asarray(trace["codes"])
+    beer_code = STATES.index("beer")
+
+    taps = []
+    for t, name in enumerate(meta["taps"]):
+        starts, ends = beer_runs(codes[:, t], beer_code)
+        start_times, end_times = times[starts], times[ends]
+        durations = end_times - start_times
+        beers = beers_for_durations(durations, seconds_per_beer, threshold, min_pour)
+
+        # Solo las tiradas que cuentan (pocas): los redondeos de Python, como el motor
+        events = [
+            {"tap": name, "start": round(start, 2), "end": round(end, 2), "duration": round(duration, 2), "beers": n}
+            for start, end, duration, n in zip(start_times.tolist(), end_times.tolist(), durations.tolist(), beers.tolist())
+            if n
+        ]
+        taps.append(TapTotals(name, int(beers.sum()), sum(durations.tolist()), events))
+
+    return build_results(taps, fps, meta["total_frames"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalcula conteos a partir de trazas guardadas (sin decodificar vídeo)")
+    parser.add_argument("traces", nargs="+", help="Trazas (ruta sin extensión o .npy) o carpetas con trazas")
+    parser.add_argument("--seconds-per-beer", type=float, help="Segundos de tirada por cerveza")
+    parser.add_argument("--threshold", type=float, help="Umbral de redondeo (parte decimal)")
+    parser.add_argument("--min-pour", type=float, help="Filtro de ruido: duración mínima de una tirada (s)")
+    parser.add_argument("--events", action="store_true", help="Mostrar cada tirada")
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.traces:
+        found = glob.glob(os.path.join(item, "**", "*.npy"), recursive=True) if os.path.isdir(item) else [item]
+        paths += [p[:-4] if p.endswith(".npy") else p for p in found]
+    paths = sorted(p for p in set(paths) if os.path.exists(f"{p}.json"))
+    if not paths:
+        print("❌ No se encontraron trazas")
+        sys.exit(1)
+
+    import src.ai.production_counter # noqa: F401 (importa OpenCV: fuera de la medida)
+    start = time.perf_counter()
+    total = before = samples = 0
+    for path in paths:
+        trace, meta = load_trace(path)
+        results = rescore(trace, meta, args.seconds_per_beer, args.threshold, args.min_pour)
+        samples += len(trace)
+        before += meta["total"]
+        total += results["total"]
+        print(f"🍺 {os.path.basename(path)}: {meta['total']} -> {results['total']} cervezas")
+        if args.events:
+            for evt in results["events"]:
+                print(f"   {evt['tap']} {evt['start']:.2f}-{evt['end']:.2f}s ({evt['duration']:.2f}s) -> {evt['beers']}")
+    elapsed = time.perf_counter() - start
+
+    print("-" * 60)
+    print(f"📊 {len(paths)} trazas ({samples} muestras) recalculadas en {elapsed * 1000:.1f} ms")
+    print(f"   TOTAL: {before} -> {total} cervezas")
+
+if __name__ == "__main__":
+    main()
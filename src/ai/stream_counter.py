@@ -0,0 +1,194 @@
+import cv2
+import numpy as np
+import os
+import sys
+import time
+import json
+import argparse
+from collections import deque
+
+from src.ai.production_counter import BeerCounterEngine, STATES
+
+# --- CONFIGURACIÓN ---
+STREAM_POLL_SECONDS = 1.0     # Espera entre reintentos cuando la fuente no da frames
+STREAM_IDLE_TIMEOUT = 30.0    # Sin frames nuevos durante este tiempo = fin del stream
+LATENCY_WINDOW = 1000         # Nº de latencias recientes para percentiles (memoria acotada)
+
+class LiveCapture:
+    """
+    Fuente en vivo con reconexión: cámaras (RTSP/HTTP) o ficheros que el NVR
+    sigue escribiendo. Si la lectura falla, espera, reabre y (en ficheros)
+    continúa desde el último frame leído. Se rinde tras `idle_timeout`
+    segundos sin frames nuevos.
+    """
+    def __init__(self, source, poll_seconds=STREAM_POLL_SECONDS, idle_timeout=STREAM_IDLE_TIMEOUT):
+        self.source = source
+        self.is_file = os.path.exists(str(source))
+        self.poll_seconds = poll_seconds
+        self.idle_timeout = idle_timeout
+        self.pos = 0
+        self.cap = cv2.VideoCapture(source)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def read(self):
+        waited = 0.0
+        while True:
+            ret, frame = self.cap.read()
+            if ret:
+                self.pos += 1
+                return ret, frame
+
+            if waited >= self.idle_timeout:
+                return False, None
+            time.sleep(self.poll_seconds)
+            waited += self.poll_seconds
+
+            # Reabrir: en un fichero que crece, el decodificador no ve los frames nuevos
+            self.cap.release()
+            self.cap = cv2.VideoCapture(self.source)
+            if self.is_file and self.pos > 0:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.pos)
+
+    def release(self):
+        self.cap.release()
+
+class FileBackedStream:
+    """
+    Cámara falsa para pruebas locales: entrega los frames de un fichero al ritmo
+    de sus fps (o `speed` veces más rápido), como llegarían de un stream real.
+    """
+    def __init__(self, path, speed=1.0):
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = (1.0 / fps) / speed if fps > 0 and speed > 0 else 0.0
+        self._next_time = None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        # Un stream en vivo no conoce su longitud
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return 0
+        return self.cap.get(prop)
+
+    def read(self):
+        now = time.perf_counter()
+        if self._next_time is None:
+            self._next_time = now
+        elif now < self._next_time:
+            time.sleep(self._next_time - now)
+        self._next_time += self.frame_interval
+        return self.cap.read()
+
+    def release(self):
+        self.cap.release()
+
+class StreamCounter:
+    """
+    Conteo en vivo sobre SingleTap.update_logic.
+    - Consume frames sin fin y analiza TODOS (no se puede volver atrás en un stream),
+      así que el inicio de cada tirada es exacto.
+    - Memoria constante: los eventos salen en cuanto se cierran y no se acumulan.
+    - Cada evento lleva la latencia desde que entró el frame que cerró la tirada.
+    """
+    def __init__(self, coords_file, refs_folder):
+        self.engine = BeerCounterEngine(coords_file, refs_folder)
+        self.frames = 0
+        self.events_emitted = 0
+        self.latencies_ms = deque(maxlen=LATENCY_WINDOW)
+
+    def run(self, source):
+        """
+        Generador de eventos. `source` es una ruta/URL (se abre con LiveCapture) o
+        cualquier objeto con la interfaz de cv2.VideoCapture (read/get/release).
+        """
+        cap = LiveCapture(source) if isinstance(source, str) else source
+        if not cap.isOpened():
+            raise IOError(f"No se pudo abrir la fuente: {source}")
+
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not fps or fps <= 0: fps = 30
+
+        window = None
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret: break
+                ingest_ts = time.time()
+
+                # Los grifos se crean con el primer frame (resolución real del stream)
+                if window is None:
+                    window = self.engine._build_taps(frame.shape[1], frame.shape[0])
+
+                codes = self.engine._classify(frame, window)
+                self.frames += 1
+
+                for tap, code in zip(self.engine.taps, codes):
+                    tap.update_logic(STATES[code], self.frames, fps)
+                    while tap.timeline_events:
+                        yield self._emit(tap.timeline_events.pop(0), ingest_ts)
+        finally:
+            cap.release()
+
+    def _emit(self, event, ingest_ts):
+        emitted_ts = time.time()
+        latency_ms = (emitted_ts - ingest_ts) * 1000
+        self.latencies_ms.append(latency_ms)
+        self.events_emitted += 1
+
+        event = dict(event)
+        event["ingest_ts"] = round(ingest_ts, 3)
+        event["emitted_ts"] = round(emitted_ts, 3)
+        event["latency_ms"] = round(latency_ms, 2)
+        return event
+
+    def summary(self):
+        """Contadores acumulados y latencia ingesta->evento (ventana reciente)"""
+        taps = {tap.name: {"count": tap.count, "seconds": round(tap.total_beer_seconds, 2)} for tap in self.engine.taps}
+        latency = {}
+        if self.latencies_ms:
+            values = np.array(self.latencies_ms)
+            latency = {
+                "mean_ms": round(float(values.mean()), 2),
+                "p95_ms": round(float(np.percentile(values, 95)), 2),
+                "max_ms": round(float(values.max()), 2),
+            }
+        return {
+            "frames": self.frames,
+            "events": self.events_emitted,
+            "total": sum(info["count"] for info in taps.values()),
+            "taps": taps,
+            "latency": latency,
+            "change_gate": self.engine.profiler.gate_summary(),
+            "pyramid": self.engine.profiler.pyramid_summary(),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Conteo en vivo de tiradas (una línea JSON por evento)")
+    parser.add_argument("source", help="URL de cámara (rtsp://...) o fichero de vídeo")
+    parser.add_argument("--coords", default=os.path.join("src", "ai", "referencias", "coords_dual.txt"))
+    parser.add_argument("--refs", default=os.path.join("src", "ai", "referencias"))
+    parser.add_argument("--fake-stream", action="store_true", help="Reproducir el fichero a ritmo real (cámara simulada)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Velocidad de la cámara simulada")
+    args = parser.parse_args()
+
+    counter = StreamCounter(args.coords, args.refs)
+    source = FileBackedStream(args.source, args.speed) if args.fake_stream else args.source
+
+    try:
+        for event in counter.run(source):
+            sys.stdout.write(json.dumps(event) + "\n")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+    print(json.dumps(counter.summary()), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+from datetime import timedelta, timezone
+from sqlalchemy import func, insert, delete, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from . import models
+from .config import VENUE_UTC_OFFSET_HOURS, DEFAULT_VENUE
+
+# --- EVENTOS NORMALIZADOS Y AGREGADOS DE CONSUMO ---
+# Al completar una sesión sus tiradas se insertan en bloque en `pour_events` y se
+# suman a `consumption_daily` (día x local x grifo). Ninguna consulta de consumo
+# necesita cargar ni parsear el JSON de cada sesión.
+
+VENUE_TZ = timezone(timedelta(hours=VENUE_UTC_OFFSET_HOURS))
+
+def _session_origin(session):
+    """Hora real del frame 0 del vídeo (sin recorded_at, la hora de subida)"""
+    origin = session.recorded_at or session.upload_time or models.utcnow()
+    if origin.tzinfo is None:
+        origin = origin.replace(tzinfo=timezone.utc) # SQLite devuelve fechas sin zona (guardadas en UTC)
+    return origin
+
+def _apply_rollup(db: Session, rows, sign):
+    """Suma (sign=1) o resta (sign=-1) las tiradas `rows` al agregado diario"""
+    totals = {}
+    for row in rows:
+        key = (row["day"], row["venue"], row["tap"])
+        beers, pours, seconds = totals.get(key, (0, 0, 0.0))
+        totals[key] = (beers + row["beers"], pours + 1, seconds + row["duration"])
+    if not totals:
+        return
+
+    table = models.DailyConsumption.__table__
+    values = [
+        {"day": day, "venue": venue, "tap": tap, "beers": sign * b, "pours": sign * p, "pour_seconds": sign * s}
+        for (day, venue, tap), (b, p, s) in totals.items()
+    ]
+    stmt = sqlite_insert(table).values(values)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["day", "venue", "tap"],
+        set_={
+            "beers": table.c.beers + stmt.excluded.beers,
+            "pours": table.c.pours + stmt.excluded.pours,
+            "pour_seconds": table.c.pour_seconds + stmt.excluded.pour_seconds,
+        },
+    ))
+
+def record_session_events(db: Session, session, events):
+    """
+    Guarda las tiradas de una sesión (inserción en bloque) y actualiza los agregados.
+    Idempotente: si la sesión ya tenía tiradas (reproceso), primero se descuentan.
+    No hace commit: va en la misma transacción que el resultado de la sesión.
+    """
+    previous = db.query(
+        models.PourEvent.day, models.PourEvent.venue, models.PourEvent.tap,
+        models.PourEvent.beers, models.PourEvent.duration,
+    ).filter(models.PourEvent.session_id == session.id).all()
+    if previous:
+        _apply_rollup(db, [row._asdict() for row in previous], -1)
+        db.execute(delete(models.PourEvent).where(models.PourEvent.session_id == session.id))
+
+    origin = _session_origin(session)
+    venue = session.venue or DEFAULT_VENUE
+    rows = []
+    for idx, evt in enumerate(events):
+        started_at = origin + timedelta(seconds=evt["start"])
+        rows.append({
+            "session_id": session.id,
+            "venue": venue,
+            "tap": evt["tap"],
+            "event_index": idx,
+            "start_seconds": evt["start"],
+            "end_seconds": evt["end"],
+            "duration": evt["duration"],
+            "beers": evt["beers"],
+            "started_at": started_at,
+            "day": started_at.astimezone(VENUE_TZ).date().isoformat(),
+        })
+
+    if rows:
+        db.execute(insert(models.PourEvent), rows)
+        _apply_rollup(db, rows, 1)
+
+def backfill_events(db: Session):
+    """
+    Migra las sesiones completadas que solo tienen el JSON antiguo de eventos
+    (o cuyas tiradas se guardaron antes de existir `event_index`)
+    """
+    stale = db.query(models.PourEvent.session_id).filter(models.PourEvent.event_index.is_(None))
+    done = db.query(models.PourEvent.session_id).filter(models.PourEvent.session_id.notin_(stale)).distinct()
+    pending = (
+        db.query(models.AnalysisSession)
+        .filter(models.AnalysisSession.status == "COMPLETED", models.AnalysisSession.id.notin_(done))
+        .all()
+    )
+    migrated = 0
+    for session in pending:
+        if session.events_data:
+            record_session_events(db, session, session.events_data)
+            migrated += 1
+    db.commit()
+    if migrated:
+        print(f"🗃️ BD: eventos de {migrated} sesiones migrados a pour_events")
+
+# --- CONSULTAS ---
+
+def _filtered(query, venue=None, tap=None, start=None, end=None):
+    table = models.DailyConsumption
+    if venue: query = query.filter(table.venue == venue)
+    if tap: query = query.filter(table.tap == tap)
+    if start: query = query.filter(table.day >= start)
+    if end: query = query.filter(table.day <= end)
+    return query
+
+def _totals(*group_by):
+    table = models.DailyConsumption
+    return [
+        *group_by,
+        func.sum(table.beers).label("beers"),
+        func.sum(table.pours).label("pours"),
+        func.round(func.sum(table.pour_seconds), 2).label("pour_seconds"),
+    ]
+
+def daily_consumption(db: Session, venue=None, tap=None, start=None, end=None):
+    """Cervezas por día (sumando grifos y locales que pasen los filtros)"""
+    table = models.DailyConsumption
+    query = _filtered(db.query(*_totals(table.day)), venue, tap, start, end)
+    return [row._asdict() for row in query.group_by(table.day).order_by(table.day)]
+
+def tap_consumption(db: Session, venue=None, start=None, end=None):
+    """Cervezas por local y grifo en el rango de días"""
+    table = models.DailyConsumption
+    query = _filtered(db.query(*_totals(table.venue, table.tap)), venue, None, start, end)
+    return [row._asdict() for row in query.group_by(table.venue, table.tap).order_by(table.venue, table.tap)]
+
+def venue_consumption(db: Session, start=None, end=None):
+    """Cervezas por local en el rango de días"""
+    table = models.DailyConsumption
+    query = _filtered(db.query(*_totals(table.venue)), None, None, start, end)
+    return [row._asdict() for row in query.group_by(table.venue).order_by(table.venue)]
+
+# --- TIRADAS DE UNA SESIÓN (línea de tiempo) ---
+# Consultas sobre el índice (session_id, start_seconds): su coste depende de la
+# ventana pedida, no de la duración de la sesión.
+
+def _in_window(query, session_id, start=None, end=None, tap=None):
+    table = models.PourEvent
+    query = query.filter(table.session_id == session_id)
+    if end is not None: query = query.filter(table.start_seconds < end)
+    if start is not None: query = query.filter(table.end_seconds > start) # También las que empezaron antes
+    if tap: query = query.filter(table.tap == tap)
+    return query
+
+def session_events(db: Session, session_id, start=None, end=None, tap=None, offset=0, limit=100):
+    """Una página de las tiradas que se solapan con [start, end), ordenadas por inicio, y su total"""
+    table = models.PourEvent
+    total = _in_window(db.query(func.count(table.id)), session_id, start, end, tap).scalar()
+    query = _in_window(db.query(
+        table.event_index.label("index"), table.tap, table.start_seconds.label("start"),
+        table.end_seconds.label("end"), table.duration, table.beers,
+    ), session_id, start, end, tap)
+    rows = query.order_by(table.start_seconds, table.event_index).offset(offset).limit(limit)
+    return total, [row._asdict() for row in rows]
+
+def event_density(db: Session, session_id, start, end, buckets):
+    """
+    Tiradas y cervezas por tramo de tiempo y grifo en [start, end), agrupadas en SQL.
+    Cada tirada cuenta en el tramo en que empieza.
+    """
+    table = models.PourEvent
+    width = (end - start) / buckets
+    bucket = func.cast((table.start_seconds - start) / width, Integer)
+    query = (
+        db.query(table.tap, bucket.label("bucket"), func.count(table.id).label("pours"), func.sum(table.beers).label("beers"))
+        .filter(table.session_id == session_id, table.start_seconds >= start, table.start_seconds < end)
+        .group_by(table.tap, bucket)
+    )
+    taps = {}
+    for row in query:
+        counts = taps.setdefault(row.tap, {"pours": [0] * buckets, "beers": [0] * buckets})
+        idx = min(row.bucket, buckets - 1) # Redondeo en el borde derecho
+        counts["pours"][idx] += row.pours
+        counts["beers"][idx] += row.beers or 0
+    return {"start": start, "end": end, "bucket_seconds": width, "buckets": buckets, "taps": taps}
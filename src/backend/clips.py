@@ -0,0 +1,175 @@
+import glob
+import hashlib
+import os
+import subprocess
+import uuid
+import cv2
+import numpy as np
+from .config import UPLOAD_DIR, CLIP_CACHE_DIR, CLIP_CACHE_MAX_BYTES, CLIP_PADDING_SECONDS, THUMBNAIL_COUNT, THUMBNAIL_HEIGHT
+from .video_fixer import FFMPEG_BIN, REMUX_TIMEOUT_SECONDS
+
+# PyAV es opcional: sin él se corta con ffmpeg (si está) y, si no, recodificando con OpenCV
+try:
+    import av
+except ImportError:
+    av = None
+
+# --- CLIPS Y MINIATURAS POR TIRADA ---
+# Para revisar una tirada no hace falta descargar la grabación entera: se hace seek al
+# keyframe anterior al inicio y se copian los paquetes hasta el final (sin decodificar
+# ni recodificar). Clips y tiras de miniaturas se guardan en CLIP_CACHE_DIR, que se
+# mantiene por debajo de CLIP_CACHE_MAX_BYTES expulsando los menos usados (LRU por mtime).
+
+def _cache_prefix(video_path, kind, start, end):
+    """Prefijo del fichero de caché: cambia si cambia el vídeo (ruta, tamaño, mtime) o el tramo"""
+    st = os.stat(video_path)
+    key = f"{os.path.abspath(video_path)}|{st.st_size}|{st.st_mtime_ns}|{kind}|{start:.3f}|{end:.3f}"
+    digest = hashlib.sha256(key.encode()).hexdigest()[:24]
+    return os.path.join(CLIP_CACHE_DIR, f"{kind}_{digest}")
+
+def _touch(path):
+    os.utime(path) # Marca de uso reciente para la expulsión LRU
+
+def evict(max_bytes=CLIP_CACHE_MAX_BYTES):
+    """Borra los ficheros usados hace más tiempo hasta quedar por debajo de `max_bytes`"""
+    entries = []
+    for entry in os.scandir(CLIP_CACHE_DIR):
+        if entry.is_file() and not entry.name.startswith("."):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes: break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue # Otro proceso ya lo expulsó
+        total -= size
+        removed += 1
+    if removed:
+        print(f"🧹 CLIPS: {removed} ficheros expulsados (caché en {total / 1e6:.1f} MB)")
+
+def _publish(tmp_path, path):
+    os.replace(tmp_path, path) # Atómico: dos peticiones a la vez no ven un fichero a medias
+    evict()
+    return path
+
+def _cut_pyav(video_path, tmp_path, start, end):
+    """Copia de paquetes desde el keyframe anterior a `start` hasta `end`. Devuelve el inicio real."""
+    with av.open(video_path) as inp:
+        in_stream = inp.streams.video[0]
+        tb = in_stream.time_base
+        inp.seek(int(start / tb), stream=in_stream, backward=True, any_frame=False)
+        with av.open(tmp_path, "w", format="mp4") as out:
+            out_stream = out.add_stream_from_template(in_stream)
+            offset = clip_start = None
+            for packet in inp.demux(in_stream):
+                if packet.size == 0 or packet.dts is None: continue # Vaciado del demuxer
+                # dts <= pts: todo frame que se muestra antes de `end` (y sus referencias) ya entró
+                if packet.dts * tb > end: break
+                if offset is None:
+                    offset = packet.dts
+                    clip_start = float(packet.pts * tb) if packet.pts is not None else float(packet.dts * tb)
+                packet.dts -= offset
+                if packet.pts is not None:
+                    packet.pts -= offset
+                packet.stream = out_stream
+                out.mux(packet)
+    if offset is None:
+        raise ValueError("tramo fuera del vídeo")
+    return clip_start
+
+def _cut_ffmpeg(video_path, tmp_path, start, end):
+    # -ss antes de -i: seek al keyframe anterior; con copia, el clip empieza en él
+    cmd = [FFMPEG_BIN, "-y", "-v", "error", "-ss", f"{start:.3f}", "-i", video_path,
+           "-t", f"{end - start:.3f}", "-map", "0:v:0", "-c", "copy", "-f", "mp4", tmp_path]
+    subprocess.run(cmd, check=True, timeout=REMUX_TIMEOUT_SECONDS, capture_output=True)
+    return start
+
+def _cut_opencv(video_path, tmp_path, start, end):
+    """Último recurso: decodifica el tramo y lo recodifica (exacto, pero más lento)"""
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    cap.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+    out = None
+    for _ in range(max(1, int((end - start) * fps))):
+        ret, frame = cap.read()
+        if not ret: break
+        if out is None:
+            out = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (frame.shape[1], frame.shape[0]))
+        out.write(frame)
+    cap.release()
+    if out is None:
+        raise ValueError("tramo fuera del vídeo")
+    out.release()
+    return start
+
+def event_window(event, duration=None):
+    """Tramo [inicio, fin] del clip de una tirada, con margen a ambos lados"""
+    start = max(0.0, event["start"] - CLIP_PADDING_SECONDS)
+    end = event["end"] + CLIP_PADDING_SECONDS
+    if duration:
+        end = min(end, duration)
+    return start, max(end, start)
+
+def get_clip(video_path, start, end):
+    """
+    Ruta del clip (de la caché o recién cortado) y segundo del vídeo original en
+    que empieza: con copia de paquetes arranca en el keyframe anterior a `start`.
+    """
+    os.makedirs(CLIP_CACHE_DIR, exist_ok=True)
+    # El inicio real va en el nombre (clip_<hash>_<ms>.mp4): un solo fichero por entrada
+    prefix = _cache_prefix(video_path, "clip", start, end)
+    for path in glob.glob(f"{glob.escape(prefix)}_*.mp4"):
+        _touch(path)
+        return path, int(os.path.basename(path)[:-4].rsplit("_", 1)[1]) / 1000
+
+    tmp_path = os.path.join(CLIP_CACHE_DIR, f".{uuid.uuid4().hex}.mp4")
+    cutters = [c for c, ok in ((_cut_pyav, av), (_cut_ffmpeg, FFMPEG_BIN), (_cut_opencv, True)) if ok]
+    try:
+        for cut in cutters:
+            try:
+                clip_start = cut(video_path, tmp_path, start, end)
+                break
+            except Exception as e:
+                print(f"⚠️ CLIPS: {cut.__name__} falló ({e})")
+        else:
+            raise RuntimeError("No se pudo cortar el clip")
+
+        path = f"{prefix}_{int(round(clip_start * 1000))}.mp4"
+        return _publish(tmp_path, path), round(clip_start, 3)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_thumbnails(video_path, start, end, count=THUMBNAIL_COUNT, height=THUMBNAIL_HEIGHT):
+    """Tira JPEG de `count` miniaturas repartidas por [start, end] (de la caché o recién generada)"""
+    os.makedirs(CLIP_CACHE_DIR, exist_ok=True)
+    path = _cache_prefix(video_path, f"thumbs{count}x{height}", start, end) + ".jpg"
+    if os.path.exists(path):
+        _touch(path)
+        return path
+
+    cap = cv2.VideoCapture(video_path)
+    thumbs = []
+    for t in np.linspace(start, end, count):
+        cap.set(cv2.CAP_PROP_POS_MSEC, float(t) * 1000)
+        ret, frame = cap.read()
+        if not ret: continue
+        width = max(1, int(frame.shape[1] * height / frame.shape[0]))
+        thumbs.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+    cap.release()
+    if not thumbs:
+        raise ValueError("tramo fuera del vídeo")
+
+    ok, buffer = cv2.imencode(".jpg", cv2.hconcat(thumbs), [cv2.IMWRITE_JPEG_QUALITY, 80])
+    tmp_path = os.path.join(CLIP_CACHE_DIR, f".{uuid.uuid4().hex}.jpg")
+    with open(tmp_path, "wb") as f:
+        f.write(buffer.tobytes())
+    return _publish(tmp_path, path)
+
+def session_video_path(session):
+    """Vídeo de la sesión en disco (el reparado si existe, que es el que ve el navegador)"""
+    return os.path.join(UPLOAD_DIR, session.filename)
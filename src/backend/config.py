@@ -0,0 +1,46 @@
+import os
+
+# Rutas del proyecto (se arranca siempre desde la raíz)
+BASE_DIR = os.getcwd() # Directorio raíz del proyecto
+REFS_FOLDER = os.path.join(BASE_DIR, "src", "ai", "referencias")
+COORDS_FILE = os.path.join(REFS_FOLDER, "coords_dual.txt")
+UPLOAD_DIR = "uploads"
+
+# --- COLA DE TRABAJOS ---
+# Nº de procesos worker que analizan vídeos a la vez (el resto espera en cola)
+NUM_WORKERS = int(os.environ.get("GAMBOOZA_WORKERS", "2"))
+# Intentos máximos por trabajo si el worker muere a mitad (segfault, OOM...)
+MAX_JOB_ATTEMPTS = int(os.environ.get("GAMBOOZA_MAX_ATTEMPTS", "3"))
+# Segundos entre consultas a la cola cuando un worker está libre
+QUEUE_POLL_SECONDS = 1.0
+# Núcleos para el análisis paralelo de cada vídeo: se reparten entre los workers
+ENGINE_WORKERS = max(1, (os.cpu_count() or 1) // max(1, NUM_WORKERS))
+# Puntos de control de los análisis en curso: un trabajo reintentado sigue donde se quedó
+CHECKPOINT_DIR = os.path.join(UPLOAD_DIR, ".checkpoints")
+# Trazas de scores por sesión: permiten recalcular conteos con otras reglas sin decodificar
+TRACE_DIR = os.path.join(UPLOAD_DIR, ".traces")
+
+# --- CACHÉ DE RESULTADOS ---
+# Nº máximo de vídeos cacheados (se expulsan los menos usados recientemente)
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("GAMBOOZA_CACHE_ENTRIES", "500"))
+
+# --- AGREGADOS DE CONSUMO ---
+# Desfase horario (horas) de los locales respecto a UTC para asignar cada tirada a su día
+VENUE_UTC_OFFSET_HOURS = float(os.environ.get("GAMBOOZA_UTC_OFFSET", "0"))
+DEFAULT_VENUE = "default"
+
+# --- CLIPS POR TIRADA ---
+# Clips y miniaturas de cada tirada, cortados bajo demanda (caché LRU en disco)
+CLIP_CACHE_DIR = os.path.join(UPLOAD_DIR, ".clips")
+CLIP_CACHE_MAX_BYTES = int(float(os.environ.get("GAMBOOZA_CLIP_CACHE_MB", "2048")) * 1024 * 1024)
+CLIP_PADDING_SECONDS = 2.0 # Margen antes y después de la tirada
+THUMBNAIL_COUNT = 6
+THUMBNAIL_HEIGHT = 120
+
+# --- LÍNEA DE TIEMPO ---
+# Las tiradas de una sesión se sirven por páginas y por ventana de tiempo, y la vista
+# general como densidad por tramo y grifo: el navegador nunca recibe la lista entera
+EVENTS_PAGE_SIZE = 100
+EVENTS_PAGE_MAX = 1000
+DENSITY_BUCKETS = 200 # Tramos por defecto (el frontend pide uno por píxel del canvas)
+DENSITY_MAX_BUCKETS = 2000
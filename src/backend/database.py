@@ -1,19 +1,57 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # El archivo de base de datos se creará en la raíz del proyecto
 SQLALCHEMY_DATABASE_URL = "sqlite:///./gambooza.db"
 
-# connect_args={"check_same_thread": False} es necesario solo para SQLite
+# Segundos que una conexión espera al bloqueo de escritura antes de fallar
+SQLITE_BUSY_TIMEOUT = 30
+
+# connect_args={"check_same_thread": False} es necesario solo para SQLite.
+# Pool pequeño por proceso: la API y cada worker tienen el suyo, y SQLite solo
+# admite un escritor a la vez (los lectores no se bloquean gracias a WAL).
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT},
+    pool_size=5,
+    max_overflow=10,
+    pool_pre_ping=True,
 )
 
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """
+    WAL: las lecturas de la API no esperan a las escrituras de los workers y
+    viceversa. synchronous=NORMAL es seguro con WAL y evita un fsync por commit.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def ensure_schema():
+    """
+    Crea las tablas y añade las columnas nuevas a una BD ya existente
+    (create_all no altera tablas de SQLite que ya existen).
+    """
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+                    print(f"🛠️ BD: añadida columna {table.name}.{column.name}")
+
 # Dependencia para obtener la DB en cada petición
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,96 @@
+from sqlalchemy.orm import Session
+from . import models, metrics
+from .config import MAX_JOB_ATTEMPTS
+
+# --- COLA PERSISTENTE DE TRABAJOS (SQLite) ---
+# Todas las operaciones reciben una sesión de BD y hacen commit ellas mismas.
+# La reclamación es optimista: el UPDATE solo gana si el trabajo sigue PENDING,
+# y SQLite serializa las escrituras, así que dos workers nunca cogen el mismo.
+
+def enqueue_job(db: Session, session_id: int, video_path: str, priority: int = 0):
+    job = models.Job(session_id=session_id, video_path=video_path, priority=priority, status="PENDING")
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def claim_next_job(db: Session, worker_pid: int):
+    """Reserva el trabajo PENDING de mayor prioridad (y más antiguo). None si la cola está vacía."""
+    while True:
+        candidate = (
+            db.query(models.Job.id, models.Job.created_at)
+            .filter(models.Job.status == "PENDING")
+            .order_by(models.Job.priority.desc(), models.Job.id.asc())
+            .first()
+        )
+        if candidate is None:
+            db.rollback()
+            return None
+
+        started_at = models.utcnow()
+        claimed = (
+            db.query(models.Job)
+            .filter(models.Job.id == candidate.id, models.Job.status == "PENDING")
+            .update({
+                models.Job.status: "RUNNING",
+                models.Job.worker_pid: worker_pid,
+                models.Job.started_at: started_at,
+                models.Job.attempts: models.Job.attempts + 1,
+            }, synchronize_session=False)
+        )
+        if claimed:
+            metrics.record_job_started(db, _seconds(candidate.created_at, started_at))
+        db.commit()
+        if claimed:
+            return db.query(models.Job).filter(models.Job.id == candidate.id).first()
+        # Otro worker se adelantó: probamos con el siguiente
+
+def _seconds(start, end):
+    if start is None or end is None: return None
+    if start.tzinfo is None: # SQLite devuelve fechas sin zona (guardadas en UTC)
+        start = start.replace(tzinfo=end.tzinfo)
+    return (end - start).total_seconds()
+
+def finish_job(db: Session, job_id: int, error: str = None):
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if job is None: return
+    job.status = "FAILED" if error else "DONE"
+    job.error = error
+    job.finished_at = models.utcnow()
+    metrics.record_job_finished(db, job.status, _seconds(job.started_at, job.finished_at))
+    db.commit()
+
+def requeue_running_jobs(db: Session, worker_pid: int = None, count_attempt: bool = True):
+    """
+    Devuelve a la cola los trabajos RUNNING de un worker muerto (o todos, al arrancar).
+    Si un trabajo ya agotó sus intentos se marca FAILED y su sesión como ERROR.
+    Con count_attempt=False (parada ordenada) el intento interrumpido no cuenta.
+    """
+    query = db.query(models.Job).filter(models.Job.status == "RUNNING")
+    if worker_pid is not None:
+        query = query.filter(models.Job.worker_pid == worker_pid)
+
+    requeued = 0
+    for job in query.all():
+        session = db.query(models.AnalysisSession).filter(models.AnalysisSession.id == job.session_id).first()
+        if not count_attempt:
+            job.attempts = max(0, job.attempts - 1)
+
+        if job.attempts >= MAX_JOB_ATTEMPTS:
+            job.status = "FAILED"
+            job.error = f"Worker caído {job.attempts} veces"
+            job.finished_at = models.utcnow()
+            metrics.record_job_finished(db, job.status)
+            if session: session.status = "ERROR"
+            print(f"❌ COLA: trabajo {job.id} descartado tras {job.attempts} intentos")
+        else:
+            job.status = "PENDING"
+            job.worker_pid = None
+            if session: session.status = "PENDING"
+            requeued += 1
+            print(f"🔁 COLA: trabajo {job.id} (sesión {job.session_id}) devuelto a la cola")
+    db.commit()
+    return requeued
+
+def queue_depth(db: Session):
+    return db.query(models.Job).filter(models.Job.status == "PENDING").count()
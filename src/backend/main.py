@@ -1,79 +1,50 @@
-from src.backend.video_fixer import fix_video_for_web, check_video_is_healthy
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from fastapi import FastAPI, Depends, UploadFile, File, BackgroundTasks
-from sqlalchemy.orm import Session
-from . import models, database
-import shutil
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, FileResponse
+from fastapi import FastAPI, Depends, UploadFile, File, HTTPException
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import Optional
+from sqlalchemy.orm import Session, defer
+from sqlalchemy import func
+from . import models, database, jobs, result_cache, metrics, analytics, clips
+from .config import UPLOAD_DIR, DEFAULT_VENUE, TRACE_DIR, EVENTS_PAGE_SIZE, EVENTS_PAGE_MAX, DENSITY_BUCKETS, DENSITY_MAX_BUCKETS
+from .worker import WorkerPool
+from src.ai.score_trace import load_trace, rescore
+from .progress import ProgressHub, FINAL_STATUSES
+import asyncio
+import uuid
+import json
 import os
 
-# --- IMPORTAMOS EL MOTOR DE IA ---
-from src.ai.production_counter import BeerCounterEngine
+# Inicializamos la DB (y añadimos columnas nuevas si la BD es de una versión anterior)
+database.ensure_schema()
+_db = database.SessionLocal()
+try:
+    analytics.backfill_events(_db)
+    metrics.backfill_counters(_db)
+finally:
+    _db.close()
 
-# Configuramos las rutas a las referencias
-BASE_DIR = os.getcwd() # Directorio raíz del proyecto
-REFS_FOLDER = os.path.join(BASE_DIR, "src", "ai", "referencias")
-COORDS_FILE = os.path.join(REFS_FOLDER, "coords_dual.txt")
+if not os.path.exists(UPLOAD_DIR):
+    os.makedirs(UPLOAD_DIR)
 
-# Inicializamos la DB
-models.Base.metadata.create_all(bind=database.engine)
+# Pool de workers: el análisis (CPU) corre en procesos aparte, nunca en el servidor de la API
+worker_pool = WorkerPool()
+# Reparte el progreso de los workers a los dashboards conectados (SSE)
+progress_hub = ProgressHub()
 
-app = FastAPI(title="Gambooza Beer Counter")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    progress_hub.start(worker_pool.progress_queue)
+    worker_pool.start()
+    yield
+    worker_pool.stop()
+    progress_hub.stop()
 
-# Permitir que el frontend acceda a los vídeos subidos y reparados
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app = FastAPI(title="Gambooza Beer Counter", lifespan=lifespan)
 
-UPLOAD_DIR = "uploads"
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
-
-def process_video_background(session_id: int, video_path: str, db: Session):
-    print(f"👷 WORKER: Iniciando procesamiento para ID {session_id}...")
-    
-    session = db.query(models.AnalysisSession).filter(models.AnalysisSession.id == session_id).first()
-    session.status = "PROCESSING"
-    db.commit()
-    
-    try:
-        # --- PASO 1: DIAGNÓSTICO Y REPARACIÓN CONDICIONAL ---
-        final_video_path = video_path
-        final_filename = os.path.basename(video_path)
-
-        # Chequeamos si está sano
-        if check_video_is_healthy(video_path):
-            print("✨ Video SANO. Omitiendo reparación para máxima velocidad.")
-        else:
-            print("🩹 Video CORRUPTO/RAW detectado. Ejecutando reparación rápida...")
-            fixed_filename = fix_video_for_web(video_path)
-            # Actualizamos rutas para usar el arreglado
-            final_filename = fixed_filename
-            final_video_path = os.path.join(UPLOAD_DIR, fixed_filename)
-            
-            # Actualizamos BD para que el frontend cargue el bueno
-            session.filename = fixed_filename
-            db.commit()
-        
-        # --- PASO 2: USO DE LA IA ---
-        engine = BeerCounterEngine(COORDS_FILE, REFS_FOLDER)
-        results = engine.process_video(final_video_path)
-        
-        session.count_a = results["grifo_a"]
-        session.count_b = results["grifo_b"]
-        session.seconds_a = results["seconds_a"]
-        session.seconds_b = results["seconds_b"]
-        session.video_duration = results["video_duration"]
-        session.events_data = results["events"]
-        
-        session.status = "COMPLETED"
-        print(f"✅ WORKER: ID {session_id} Terminado.")
-
-    except Exception as e:
-        print(f"❌ WORKER ERROR: {e}")
-        session.status = "ERROR"
-    
-    finally:
-        db.commit()
-        db.close()
+# Permitir que el frontend acceda a los vídeos subidos y reparados
+app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 app.mount("/static", StaticFiles(directory="src/frontend"), name="static")
 @app.get("/", response_class=HTMLResponse)
@@ -83,38 +54,248 @@ async def read_root():
 
 @app.post("/upload/")
 def upload_video(
-    background_tasks: BackgroundTasks, 
     file: UploadFile = File(...), 
+    priority: int = 0,
+    venue: str = DEFAULT_VENUE,
+    recorded_at: Optional[datetime] = None,
     db: Session = Depends(database.get_db)
 ):
-    # 1. Guardar archivo
+    # 1. Guardar archivo (calculando su hash en la misma pasada)
+    # Primero a un temporal: si es un duplicado no pisamos el vídeo de la sesión original
     file_location = f"{UPLOAD_DIR}/{file.filename}"
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # 2. Crear registro DB (PENDING)
-    db_session = models.AnalysisSession(filename=file.filename, status="PENDING")
+    part_location = f"{UPLOAD_DIR}/.{uuid.uuid4().hex}.part"
+    content_hash = result_cache.save_and_hash(file.file, part_location)
+
+    # 2. ¿Ya analizado con la calibración actual? -> resultado instantáneo
+    cache_key = result_cache.make_key(content_hash, result_cache.current_fingerprint())
+    cached = result_cache.lookup(db, cache_key)
+    if cached is not None:
+        os.remove(part_location)
+        print(f"⚡ CACHÉ: {file.filename} ya analizado (sesión {cached.id})")
+        return {
+            "id": cached.id,
+            "status": "COMPLETED",
+            "cached": True,
+            "message": "Video ya analizado con la calibración actual. Resultado desde caché."
+        }
+    os.replace(part_location, file_location)
+
+    # 3. Crear registro DB (PENDING)
+    db_session = models.AnalysisSession(
+        filename=file.filename, status="PENDING", content_hash=content_hash,
+        venue=venue, recorded_at=recorded_at,
+    )
     db.add(db_session)
     db.commit()
     db.refresh(db_session)
     
-    # 3. ENCOLAR TAREA EN SEGUNDO PLANO
-    # Pasamos una nueva sesión de DB porque la principal se cierra al retornar
-    db_for_worker = database.SessionLocal() 
-    background_tasks.add_task(process_video_background, db_session.id, file_location, db_for_worker)
+    # 4. ENCOLAR TRABAJO (cola persistente: sobrevive a reinicios del servidor)
+    job = jobs.enqueue_job(db, db_session.id, file_location, priority)
     
-    # 4. Responder INMEDIATAMENTE al usuario
+    # 5. Responder INMEDIATAMENTE al usuario
     return {
         "id": db_session.id,
+        "job_id": job.id,
         "status": "PENDING",
-        "message": "Video recibido. Procesamiento iniciado en segundo plano."
+        "cached": False,
+        "queue_position": jobs.queue_depth(db),
+        "message": "Video recibido. En cola para procesamiento."
     }
 
 @app.get("/results/{session_id}")
-def get_result(session_id: int, db: Session = Depends(database.get_db)):
-    """Consultar estado del análisis"""
-    session = db.query(models.AnalysisSession).filter(models.AnalysisSession.id == session_id).first()
+def get_result(session_id: int, events: bool = True, db: Session = Depends(database.get_db)):
+    """
+    Consultar estado del análisis. Con events=false no se incluye la lista de
+    tiradas (solo `event_count`): el detalle se pide por ventanas a /events/{id}.
+    """
+    query = db.query(models.AnalysisSession)
+    if not events:
+        query = query.options(defer(models.AnalysisSession.events_data))
+    session = query.filter(models.AnalysisSession.id == session_id).first()
     if not session:
         return {"error": "Session not found"}
-    
-    return session
\ No newline at end of file
+    if events:
+        return session
+
+    result = {col.name: getattr(session, col.name) for col in models.AnalysisSession.__table__.columns if col.name != "events_data"}
+    result["event_count"] = db.query(func.count(models.PourEvent.id)).filter(models.PourEvent.session_id == session_id).scalar()
+    return result
+
+# --- TIRADAS POR VENTANA DE TIEMPO (línea de tiempo de sesiones largas) ---
+
+def _session_or_404(db, session_id):
+    session = (
+        db.query(models.AnalysisSession)
+        .options(defer(models.AnalysisSession.events_data))
+        .filter(models.AnalysisSession.id == session_id).first()
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@app.get("/events/{session_id}")
+def get_session_events(
+    session_id: int,
+    start: Optional[float] = None, end: Optional[float] = None, tap: Optional[str] = None,
+    offset: int = 0, limit: int = EVENTS_PAGE_SIZE,
+    db: Session = Depends(database.get_db)
+):
+    """Página de las tiradas que se solapan con [start, end) (segundos del vídeo), ordenadas por inicio"""
+    _session_or_404(db, session_id)
+    offset, limit = max(0, offset), min(max(1, limit), EVENTS_PAGE_MAX)
+    total, events = analytics.session_events(db, session_id, start, end, tap, offset, limit)
+    return {"total": total, "offset": offset, "limit": limit, "events": events}
+
+@app.get("/events/{session_id}/density")
+def get_event_density(
+    session_id: int,
+    start: float = 0.0, end: Optional[float] = None, buckets: int = DENSITY_BUCKETS,
+    db: Session = Depends(database.get_db)
+):
+    """Tiradas y cervezas por tramo de tiempo y grifo (vista general de la línea de tiempo)"""
+    session = _session_or_404(db, session_id)
+    if end is None:
+        # Sesiones sin duración guardada: hasta el final de la última tirada
+        end = session.video_duration or db.query(func.max(models.PourEvent.end_seconds)).filter(
+            models.PourEvent.session_id == session_id).scalar()
+    if not end or end <= start:
+        raise HTTPException(status_code=400, detail="Empty time window")
+    buckets = min(max(1, buckets), DENSITY_MAX_BUCKETS)
+    return analytics.event_density(db, session_id, start, end, buckets)
+
+# --- CLIPS POR TIRADA (cortados bajo demanda, con caché en disco) ---
+
+def _event_video(db, session_id, event_index):
+    """Vídeo de la sesión y tramo [inicio, fin] del clip de la tirada `event_index`"""
+    session = db.query(models.AnalysisSession).filter(models.AnalysisSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    events = session.events_data or []
+    if not 0 <= event_index < len(events):
+        raise HTTPException(status_code=404, detail="Event not found")
+    video_path = clips.session_video_path(session)
+    if not os.path.exists(video_path):
+        raise HTTPException(status_code=404, detail="Video not found")
+    return video_path, clips.event_window(events[event_index], session.video_duration)
+
+@app.get("/events/{session_id}/{event_index}/clip")
+def get_event_clip(session_id: int, event_index: int, db: Session = Depends(database.get_db)):
+    """Clip MP4 de una tirada. X-Clip-Start: segundo del vídeo original en que empieza."""
+    video_path, (start, end) = _event_video(db, session_id, event_index)
+    path, clip_start = clips.get_clip(video_path, start, end)
+    # FileResponse atiende peticiones Range: el navegador puede hacer seek dentro del clip
+    return FileResponse(path, media_type="video/mp4", headers={
+        "X-Clip-Start": f"{clip_start:.3f}", "Access-Control-Expose-Headers": "X-Clip-Start"
+    })
+
+@app.get("/events/{session_id}/{event_index}/thumbnails")
+def get_event_thumbnails(session_id: int, event_index: int, db: Session = Depends(database.get_db)):
+    """Tira JPEG de miniaturas de una tirada"""
+    video_path, (start, end) = _event_video(db, session_id, event_index)
+    return FileResponse(clips.get_thumbnails(video_path, start, end), media_type="image/jpeg")
+
+# --- RECÁLCULO CON OTRAS REGLAS (sobre la traza guardada, sin decodificar) ---
+
+@app.get("/rescore/{session_id}")
+def rescore_session(
+    session_id: int,
+    seconds_per_beer: Optional[float] = None,
+    threshold: Optional[float] = None,
+    min_pour_seconds: Optional[float] = None,
+):
+    """¿Qué habría salido con otras reglas? No modifica la sesión."""
+    path = os.path.join(TRACE_DIR, f"session_{session_id}")
+    if not os.path.exists(f"{path}.json"):
+        raise HTTPException(status_code=404, detail="Trace not found")
+    if seconds_per_beer is not None and seconds_per_beer <= 0:
+        raise HTTPException(status_code=400, detail="seconds_per_beer must be positive")
+    trace, meta = load_trace(path)
+    results = rescore(trace, meta, seconds_per_beer, threshold, min_pour_seconds)
+    results["rules"] = {
+        "seconds_per_beer": meta["rules"]["seconds_per_beer"] if seconds_per_beer is None else seconds_per_beer,
+        "threshold_rounding": meta["rules"]["threshold_rounding"] if threshold is None else threshold,
+        "min_pour_seconds": meta["rules"]["min_pour_seconds"] if min_pour_seconds is None else min_pour_seconds,
+    }
+    results["original_total"] = meta["total"]
+    return results
+
+@app.get("/progress/{session_id}/stream")
+async def stream_progress(session_id: int):
+    """
+    Canal push (Server-Sent Events) de una sesión: progreso (%, fps, ETA), cada
+    tirada en cuanto se detecta y el estado final. Sustituye al polling de /results.
+    """
+    async def event_source():
+        # Primero nos suscribimos y después miramos la BD: así no se pierde el estado final
+        subscriber = progress_hub.subscribe(session_id)
+        try:
+            db = database.SessionLocal()
+            try:
+                session = db.query(models.AnalysisSession).filter(models.AnalysisSession.id == session_id).first()
+                status = session.status if session else "ERROR"
+            finally:
+                db.close()
+
+            yield _sse({"session_id": session_id, "type": "status", "status": status})
+            if status in FINAL_STATUSES:
+                return
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber[1].get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(message)
+                if message["type"] == "status" and message["status"] in FINAL_STATUSES:
+                    return
+        finally:
+            progress_hub.unsubscribe(session_id, subscriber)
+
+    return StreamingResponse(event_source(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def _sse(message):
+    return f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+@app.get("/queue")
+def get_queue(db: Session = Depends(database.get_db)):
+    """Estado de la cola de trabajos"""
+    counts = {status: 0 for status in ["PENDING", "RUNNING", "DONE", "FAILED"]}
+    for status, n in db.query(models.Job.status, func.count(models.Job.id)).group_by(models.Job.status):
+        counts[status] = n
+    return {"workers": worker_pool.num_workers, "jobs": counts}
+
+@app.get("/metrics")
+def get_metrics(db: Session = Depends(database.get_db)):
+    """Métricas para Prometheus: cola, latencia de trabajos, rendimiento y tiempo por etapa"""
+    return Response(metrics.render_metrics(db, worker_pool.num_workers), media_type=metrics.CONTENT_TYPE)
+
+# --- CONSUMO (agregados mantenidos al completar cada sesión) ---
+
+def _day(value: Optional[date]):
+    return value.isoformat() if value else None
+
+@app.get("/stats/daily")
+def get_daily_stats(
+    venue: Optional[str] = None, tap: Optional[str] = None,
+    start: Optional[date] = None, end: Optional[date] = None,
+    db: Session = Depends(database.get_db)
+):
+    """Cervezas por día (filtrable por local, grifo y rango de días)"""
+    return analytics.daily_consumption(db, venue, tap, _day(start), _day(end))
+
+@app.get("/stats/taps")
+def get_tap_stats(
+    venue: Optional[str] = None, start: Optional[date] = None, end: Optional[date] = None,
+    db: Session = Depends(database.get_db)
+):
+    """Cervezas por local y grifo"""
+    return analytics.tap_consumption(db, venue, _day(start), _day(end))
+
+@app.get("/stats/venues")
+def get_venue_stats(
+    start: Optional[date] = None, end: Optional[date] = None,
+    db: Session = Depends(database.get_db)
+):
+    """Cervezas por local"""
+    return analytics.venue_consumption(db, _day(start), _day(end))
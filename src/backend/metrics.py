@@ -0,0 +1,184 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import models
+from src.ai.production_counter import StageProfiler
+
+# --- MÉTRICAS (formato de texto de Prometheus) ---
+# Los acumulados viven en la tabla `metric_counters` (persisten entre reinicios) y se
+# suman en la misma transacción que el hecho que cuentan: claim y fin de cada trabajo,
+# sesión completada, acierto de la caché. Un scrape solo lee esas filas y cuenta la
+# cola pendiente; nunca recorre el historial de trabajos ni parsea `profile_data`.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = [1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600]
+SEEDED = "seeded" # Marca: los contadores ya incluyen el historial anterior a la tabla
+
+def _seconds_between(start_col, end_col):
+    # SQLite: diferencia de fechas en segundos
+    return (func.julianday(end_col) - func.julianday(start_col)) * 86400.0
+
+def _add(db: Session, increments):
+    """Suma `increments` {(nombre, etiquetas): delta} a los contadores. No hace commit."""
+    if not increments:
+        return
+    table = models.MetricCounter.__table__
+    stmt = sqlite_insert(table).values([
+        {"name": name, "labels": labels, "value": delta} for (name, labels), delta in increments.items()
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["name", "labels"],
+        set_={"value": table.c.value + stmt.excluded.value},
+    ))
+
+def _observe(increments, name, values):
+    """Añade a `increments` los buckets, la suma y el nº de observaciones de un histograma"""
+    for value in values:
+        if value is None: continue
+        for b in LATENCY_BUCKETS:
+            if value <= b:
+                key = (f"{name}_bucket", f'le="{b}"')
+                increments[key] = increments.get(key, 0) + 1
+        for key, delta in [((f"{name}_bucket", 'le="+Inf"'), 1), ((f"{name}_sum", ""), value), ((f"{name}_count", ""), 1)]:
+            increments[key] = increments.get(key, 0) + delta
+
+def _profile_increments(increments, video_duration, profile):
+    def add(key, delta):
+        increments[key] = increments.get(key, 0) + (delta or 0)
+    add(("gambooza_video_seconds_processed_total", ""), video_duration)
+    if not profile:
+        return
+    add(("gambooza_frames_total", ""), profile.get("frames_total"))
+    add(("gambooza_frames_analyzed_total", ""), profile.get("frames_analyzed"))
+    add(("gambooza_analysis_seconds_total", ""), profile.get("wall_seconds"))
+    for stage, info in profile.get("stages", {}).items():
+        if stage in StageProfiler.STAGES:
+            add(("gambooza_stage_seconds_total", f'stage="{stage}"'), info["seconds"])
+
+# --- REGISTRO (lo llaman la cola, el worker y la caché antes de su commit) ---
+
+def record_job_started(db: Session, wait_seconds):
+    increments = {}
+    _observe(increments, "gambooza_job_wait_seconds", [wait_seconds])
+    _add(db, increments)
+
+def record_job_finished(db: Session, status, run_seconds=None):
+    increments = {}
+    if status == "DONE":
+        increments[("gambooza_jobs_completed_total", "")] = 1
+        _observe(increments, "gambooza_job_run_seconds", [run_seconds])
+    else:
+        increments[("gambooza_jobs_failed_total", "")] = 1
+    _add(db, increments)
+
+def record_analysis(db: Session, video_duration, profile):
+    increments = {}
+    _profile_increments(increments, video_duration, profile)
+    _add(db, increments)
+
+def record_cache_hit(db: Session):
+    _add(db, {("gambooza_result_cache_hits_total", ""): 1})
+
+def backfill_counters(db: Session):
+    """
+    Primera vez con la tabla de contadores: parte del historial ya guardado (una
+    sola pasada completa, al arrancar), para que los totales no vuelvan a cero.
+    """
+    if db.query(models.MetricCounter).filter(models.MetricCounter.name == SEEDED).first():
+        return
+    increments = {(SEEDED, ""): 1}
+    for status, n in db.query(models.Job.status, func.count(models.Job.id)).filter(
+        models.Job.status.in_(["DONE", "FAILED"])
+    ).group_by(models.Job.status):
+        name = "gambooza_jobs_completed_total" if status == "DONE" else "gambooza_jobs_failed_total"
+        increments[(name, "")] = n
+    waits = db.query(_seconds_between(models.Job.created_at, models.Job.started_at)).filter(models.Job.started_at.isnot(None))
+    runs = db.query(_seconds_between(models.Job.started_at, models.Job.finished_at)).filter(models.Job.status == "DONE")
+    _observe(increments, "gambooza_job_wait_seconds", [w for (w,) in waits])
+    _observe(increments, "gambooza_job_run_seconds", [r for (r,) in runs])
+    sessions = db.query(models.AnalysisSession.video_duration, models.AnalysisSession.profile_data).filter(
+        models.AnalysisSession.status == "COMPLETED"
+    )
+    for video_duration, profile in sessions:
+        _profile_increments(increments, video_duration, profile)
+    # Los aciertos anteriores solo se conocen por las entradas que siguen en la caché
+    hits = db.query(func.sum(models.ResultCache.hits)).scalar() or 0
+    increments[("gambooza_result_cache_hits_total", "")] = hits
+    _add(db, increments)
+    db.commit()
+    print("📈 BD: contadores de métricas inicializados desde el historial")
+
+# --- EXPOSICIÓN ---
+
+def _format(value):
+    return int(value) if float(value).is_integer() else round(value, 3)
+
+class _Writer:
+    def __init__(self, counters):
+        self.lines = []
+        self.counters = counters # {(nombre, etiquetas): valor}
+
+    def metric(self, name, kind, help_text, samples):
+        """`samples`: lista de (etiquetas, valor)"""
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            self.lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+
+    def counter(self, name, help_text, labels=None):
+        """Contador de la tabla; `labels` = {etiqueta: valores} para una serie por valor"""
+        if labels is None:
+            samples = [({}, _format(self.counters.get((name, ""), 0)))]
+        else:
+            (label, values), = labels.items()
+            samples = [({label: v}, _format(self.counters.get((name, f'{label}="{v}"'), 0))) for v in values]
+        self.metric(name, "counter", help_text, samples)
+
+    def histogram(self, name, help_text):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for le in [str(b) for b in LATENCY_BUCKETS] + ["+Inf"]:
+            label = f'le="{le}"'
+            self.lines.append(f"{name}_bucket{{{label}}} {_format(self.counters.get((name + '_bucket', label), 0))}")
+        self.lines.append(f"{name}_sum {_format(self.counters.get((name + '_sum', ''), 0))}")
+        self.lines.append(f"{name}_count {_format(self.counters.get((name + '_count', ''), 0))}")
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
+
+def render_metrics(db: Session, num_workers: int):
+    counters = {(name, labels): value for name, labels, value in db.query(
+        models.MetricCounter.name, models.MetricCounter.labels, models.MetricCounter.value
+    )}
+    out = _Writer(counters)
+
+    # --- Cola (solo los trabajos vivos: el índice de la cola empieza por el estado) ---
+    counts = {status: 0 for status in ["PENDING", "RUNNING"]}
+    for status, n in db.query(models.Job.status, func.count(models.Job.id)).filter(
+        models.Job.status.in_(list(counts))
+    ).group_by(models.Job.status):
+        counts[status] = n
+    counts["DONE"] = _format(counters.get(("gambooza_jobs_completed_total", ""), 0))
+    counts["FAILED"] = _format(counters.get(("gambooza_jobs_failed_total", ""), 0))
+    out.metric("gambooza_queue_depth", "gauge", "Trabajos esperando en cola", [({}, counts["PENDING"])])
+    out.metric("gambooza_workers", "gauge", "Procesos worker configurados", [({}, num_workers)])
+    out.metric("gambooza_jobs", "gauge", "Trabajos por estado", [({"status": s}, n) for s, n in counts.items()])
+
+    # --- Latencia: espera en cola y duración del trabajo ---
+    out.histogram("gambooza_job_wait_seconds", "Espera en cola hasta que un worker coge el trabajo")
+    out.histogram("gambooza_job_run_seconds", "Duración de los trabajos completados (reparación + análisis)")
+
+    # --- Rendimiento del análisis (acumulado de las sesiones completadas) ---
+    out.counter("gambooza_jobs_completed_total", "Trabajos completados")
+    out.counter("gambooza_jobs_failed_total", "Trabajos fallidos")
+    out.counter("gambooza_video_seconds_processed_total", "Segundos de vídeo analizados")
+    out.counter("gambooza_frames_total", "Frames de los vídeos analizados")
+    out.counter("gambooza_frames_analyzed_total", "Frames realmente decodificados y clasificados")
+    out.counter("gambooza_analysis_seconds_total", "Tiempo de reloj del análisis")
+    out.counter("gambooza_stage_seconds_total", "Tiempo acumulado por etapa del análisis",
+                labels={"stage": StageProfiler.STAGES})
+
+    out.counter("gambooza_result_cache_hits_total", "Subidas resueltas desde la caché de resultados")
+
+    return out.render()
@@ -1,6 +1,11 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Float, JSON, Index, ForeignKey, PrimaryKeyConstraint
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from .database import Base
+from .config import DEFAULT_VENUE
+
+def utcnow():
+    return datetime.now(timezone.utc)
 
 class AnalysisSession(Base):
     __tablename__ = "sessions"
@@ -14,7 +19,106 @@ class AnalysisSession(Base):
     count_b = Column(Integer, default=0)
     seconds_a = Column(Float, default=0.0)
     seconds_b = Column(Float, default=0.0)
+
+    # Contadores por grifo para cualquier número de grifos: {"A": {"count": 3, "seconds": 41.2}, ...}
+    tap_data = Column(JSON, default={})
     
     video_duration = Column(Float, default=0.0) 
 
-    events_data = Column(JSON, default=[])
\ No newline at end of file
+    events_data = Column(JSON, default=[])
+
+    # SHA-256 del vídeo subido (para la caché de resultados)
+    content_hash = Column(String, index=True, nullable=True)
+
+    # Telemetría del análisis: tiempo y llamadas por etapa, frames analizados/total, ratio de salto
+    profile_data = Column(JSON, nullable=True)
+
+    # Local y hora real de inicio de la grabación (para los agregados por día/local).
+    # Sin recorded_at se usa la hora de subida.
+    venue = Column(String, index=True, default=DEFAULT_VENUE)
+    recorded_at = Column(DateTime(timezone=True), nullable=True)
+
+class Job(Base):
+    """Trabajo de análisis en la cola persistente (SQLite)"""
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_queue", "status", "priority", "id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, index=True)
+    video_path = Column(String)
+
+    priority = Column(Integer, default=0) # Mayor = antes
+    status = Column(String, default="PENDING") # PENDING / RUNNING / DONE / FAILED
+    attempts = Column(Integer, default=0)
+    worker_pid = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class ResultCache(Base):
+    """
+    Caché de resultados por contenido: clave = hash del vídeo + huella de la calibración.
+    Apunta a la sesión COMPLETED que ya tiene el resultado.
+    """
+    __tablename__ = "result_cache"
+
+    key = Column(String, primary_key=True)
+    session_id = Column(Integer, index=True)
+    fingerprint = Column(String, index=True)
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    last_hit_at = Column(DateTime(timezone=True), default=utcnow, index=True)
+    hits = Column(Integer, default=0)
+
+class PourEvent(Base):
+    """Una tirada detectada. Tabla normalizada e indexada (las consultas no parsean JSON)."""
+    __tablename__ = "pour_events"
+    __table_args__ = (
+        Index("ix_pour_events_session_start", "session_id", "start_seconds"),
+        Index("ix_pour_events_venue_day", "venue", "day"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), nullable=False)
+    venue = Column(String, nullable=False)
+    tap = Column(String, nullable=False)
+    event_index = Column(Integer) # Posición en events_data de la sesión (la de /events/{id}/{índice}/clip)
+
+    start_seconds = Column(Float) # Segundos desde el inicio del vídeo
+    end_seconds = Column(Float)
+    duration = Column(Float)
+    beers = Column(Integer)
+
+    started_at = Column(DateTime(timezone=True)) # Hora real de inicio
+    day = Column(String(10)) # Día de consumo (AAAA-MM-DD, hora local del local)
+
+class DailyConsumption(Base):
+    """
+    Agregado diario por local y grifo, mantenido incrementalmente al completar
+    cada sesión. Los totales por grifo y por local salen de aquí con un GROUP BY
+    sobre pocas filas (días x locales x grifos), sin tocar los eventos.
+    """
+    __tablename__ = "consumption_daily"
+    __table_args__ = (PrimaryKeyConstraint("day", "venue", "tap"),)
+
+    day = Column(String(10), nullable=False)
+    venue = Column(String, nullable=False)
+    tap = Column(String, nullable=False)
+    beers = Column(Integer, default=0)
+    pours = Column(Integer, default=0)
+    pour_seconds = Column(Float, default=0.0)
+
+class MetricCounter(Base):
+    """
+    Contador acumulado de /metrics (también los buckets de los histogramas). Se suma
+    en la misma transacción que el hecho que cuenta (trabajo terminado, sesión
+    completada, acierto de caché): un scrape lee pocas filas y nada retrocede al
+    purgar trabajos o entradas de la caché.
+    """
+    __tablename__ = "metric_counters"
+    __table_args__ = (PrimaryKeyConstraint("name", "labels"),)
+
+    name = Column(String, nullable=False)
+    labels = Column(String, nullable=False, default="") # Ya en formato Prometheus: stage="decode"
+    value = Column(Float, default=0.0)
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import queue
+from collections import defaultdict
+
+# --- CANAL DE PROGRESO (workers -> API -> dashboards) ---
+# Los workers son procesos aparte: publican sus mensajes en una multiprocessing.Queue.
+# Un hilo del servidor la vacía y reparte cada mensaje a las colas asyncio de los
+# clientes suscritos a esa sesión (Server-Sent Events).
+
+FINAL_STATUSES = ("COMPLETED", "ERROR")
+
+class ProgressHub:
+    def __init__(self):
+        self._subscribers = defaultdict(set) # session_id -> {(loop, asyncio.Queue)}
+        self._last_progress = {} # session_id -> último mensaje de progreso
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, session_id):
+        """Registra un cliente (desde el event loop). Devuelve su cola de mensajes."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[session_id].add(subscriber)
+            last = self._last_progress.get(session_id)
+        if last is not None:
+            subscriber[1].put_nowait(last)
+        return subscriber
+
+    def unsubscribe(self, session_id, subscriber):
+        with self._lock:
+            self._subscribers[session_id].discard(subscriber)
+            if not self._subscribers[session_id]:
+                del self._subscribers[session_id]
+
+    def publish(self, message):
+        """Thread-safe: entrega el mensaje a todos los suscriptores de su sesión"""
+        session_id = message["session_id"]
+        with self._lock:
+            if message["type"] == "progress":
+                self._last_progress[session_id] = message
+            elif message["type"] == "status" and message["status"] in FINAL_STATUSES:
+                self._last_progress.pop(session_id, None)
+            subscribers = list(self._subscribers.get(session_id, ()))
+
+        for loop, subscriber_queue in subscribers:
+            loop.call_soon_threadsafe(subscriber_queue.put_nowait, message)
+
+    def start(self, mp_queue):
+        """Arranca el hilo que reparte los mensajes que llegan de los workers"""
+        self._thread = threading.Thread(target=self._dispatch, args=(mp_queue,), daemon=True)
+        self._thread.start()
+
+    def _dispatch(self, mp_queue):
+        while not self._stop.is_set():
+            try:
+                message = mp_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            self.publish(message)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
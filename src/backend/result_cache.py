@@ -0,0 +1,92 @@
+import hashlib
+from sqlalchemy.orm import Session
+from . import models, metrics
+from .config import COORDS_FILE, REFS_FOLDER, RESULT_CACHE_MAX_ENTRIES
+from src.ai.production_counter import load_calibration
+
+# --- CACHÉ DE RESULTADOS POR CONTENIDO ---
+# Clave = SHA-256(hash del vídeo + huella de la calibración). Un vídeo ya analizado
+# con la misma calibración devuelve su sesión al instante (sin reparar ni analizar).
+# Al recalibrar cambia la huella: las entradas viejas dejan de coincidir y se purgan.
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+def save_and_hash(src, dest_path):
+    """Copia el fichero subido a disco calculando su SHA-256 en la misma pasada"""
+    h = hashlib.sha256()
+    with open(dest_path, "wb") as out:
+        while True:
+            chunk = src.read(HASH_CHUNK_BYTES)
+            if not chunk: break
+            h.update(chunk)
+            out.write(chunk)
+    return h.hexdigest()
+
+def current_fingerprint():
+    # La huella se calcula una vez por calibración (caché del proceso), no en cada subida
+    return load_calibration(COORDS_FILE, REFS_FOLDER).fingerprint
+
+def make_key(content_hash: str, fingerprint: str):
+    return hashlib.sha256(f"{content_hash}:{fingerprint}".encode()).hexdigest()
+
+def lookup(db: Session, key: str):
+    """Sesión COMPLETED cacheada para esta clave (o None). Cuenta el acierto."""
+    entry = db.query(models.ResultCache).filter(models.ResultCache.key == key).first()
+    if entry is None:
+        return None
+
+    session = db.query(models.AnalysisSession).filter(models.AnalysisSession.id == entry.session_id).first()
+    if session is None or session.status != "COMPLETED":
+        # La sesión se borró o se reprocesó con error: la entrada ya no vale
+        db.delete(entry)
+        db.commit()
+        return None
+
+    entry.hits += 1
+    entry.last_hit_at = models.utcnow()
+    metrics.record_cache_hit(db) # entry.hits desaparece con la entrada; el contador no
+    db.commit()
+    return session
+
+def store(db: Session, content_hash: str, fingerprint: str, session_id: int):
+    """Registra el resultado de una sesión completada y aplica la política de expulsión"""
+    key = make_key(content_hash, fingerprint)
+    entry = db.query(models.ResultCache).filter(models.ResultCache.key == key).first()
+    if entry is None:
+        entry = models.ResultCache(key=key, hits=0)
+        db.add(entry)
+    entry.session_id = session_id
+    entry.fingerprint = fingerprint
+    entry.last_hit_at = models.utcnow()
+    db.commit()
+    evict(db, fingerprint)
+
+def evict(db: Session, fingerprint: str, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+    """
+    Purga las entradas de calibraciones anteriores y, si sobran, las menos usadas
+    recientemente (LRU). Solo borra la entrada: la sesión sigue en el historial.
+    """
+    stale = (
+        db.query(models.ResultCache)
+        .filter(models.ResultCache.fingerprint != fingerprint)
+        .delete(synchronize_session=False)
+    )
+
+    overflow = 0
+    total = db.query(models.ResultCache).count()
+    if total > max_entries:
+        oldest = (
+            db.query(models.ResultCache.key)
+            .order_by(models.ResultCache.last_hit_at.asc())
+            .limit(total - max_entries)
+            .all()
+        )
+        overflow = (
+            db.query(models.ResultCache)
+            .filter(models.ResultCache.key.in_([k for (k,) in oldest]))
+            .delete(synchronize_session=False)
+        )
+    db.commit()
+
+    if stale or overflow:
+        print(f"🧹 CACHÉ: {stale} entradas de otra calibración y {overflow} por LRU eliminadas")
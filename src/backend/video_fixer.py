@@ -1,5 +1,18 @@
 import cv2
 import os
+import shutil
+import subprocess
+from fractions import Fraction
+
+# PyAV es opcional: sin él se usa el binario de ffmpeg (si está) y, si no, la transcodificación
+try:
+    import av
+except ImportError:
+    av = None
+
+FFMPEG_BIN = shutil.which("ffmpeg")
+REMUX_TIMEOUT_SECONDS = 600
+REMUX_SIZE_TOLERANCE = 0.05 # Un remux copia los paquetes: solo cambia el contenedor
 
 def check_video_is_healthy(input_path):
     """
@@ -28,73 +41,196 @@ def check_video_is_healthy(input_path):
     except:
         return False
 
+def web_output_path(input_path):
+    """Nombre y ruta del vídeo reparado para web que corresponde a `input_path`"""
+    name, _ = os.path.splitext(os.path.basename(input_path))
+    output_filename = f"{name}_fixed.mp4"
+    return output_filename, os.path.join(os.path.dirname(input_path), output_filename)
+
+class WebVideoWriter:
+    """
+    Escritor del vídeo reparado para web, alimentado frame a frame.
+    Reduce la resolución para ir MUCHO más rápido. Escribe en un temporal y solo
+    lo publica en `close()`: un fallo a mitad no deja un "_fixed" incompleto.
+    """
+    def __init__(self, input_path):
+        self.output_filename, self.output_path = web_output_path(input_path)
+        name, ext = os.path.splitext(self.output_filename)
+        self.tmp_path = os.path.join(os.path.dirname(self.output_path), f".{name}.tmp{ext}")
+
+        cap = cv2.VideoCapture(input_path)
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+        if self.fps <= 0: self.fps = 25.0 # Fallback estándar
+
+        self.out = None
+        self.scale = 1.0
+        self.frames_count = 0
+
+    def _open(self, orig_w, orig_h):
+        # Si el video es muy grande (> 720p), lo reducimos para la web.
+        # Esto acelera la escritura exponencialmente.
+        if orig_w > 1280:
+            self.scale = 0.5 
+        elif orig_w > 800:
+            self.scale = 0.7
+            
+        self.size = (int(orig_w * self.scale), int(orig_h * self.scale))
+        print(f"   ℹ Redimensionando: {orig_w}x{orig_h} -> {self.size[0]}x{self.size[1]} (Escala: {self.scale})")
+
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v') 
+        self.out = cv2.VideoWriter(self.tmp_path, fourcc, self.fps, self.size)
+
+    def write(self, frame):
+        if self.out is None:
+            self._open(frame.shape[1], frame.shape[0])
+
+        # Solo redimensionamos si es necesario
+        if self.scale != 1.0:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_LINEAR)
+        
+        self.out.write(frame)
+        self.frames_count += 1
+        
+        # Log menos frecuente para no saturar consola
+        if self.frames_count % 300 == 0:
+            print(f"   ...procesando frame {self.frames_count}")
+
+    def close(self, keep=True):
+        """Cierra el fichero. Con keep=False (error) descarta lo escrito."""
+        if self.out is not None:
+            self.out.release()
+            self.out = None
+        if keep and self.frames_count > 0:
+            os.replace(self.tmp_path, self.output_path)
+            print(f"✅ REPARADOR: Finalizado en {self.output_filename}")
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def _is_playable(path):
+    """Verificación del remux: índice válido y primer y último frame decodificables"""
+    cap = cv2.VideoCapture(path)
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if not cap.isOpened() or frame_count <= 0 or cap.get(cv2.CAP_PROP_FPS) <= 0:
+            return False
+        if not cap.read()[0]:
+            return False
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count - 1)
+        return cap.read()[0]
+    finally:
+        cap.release()
+
+def _remux_pyav(input_path, output_path):
+    with av.open(input_path) as src, av.open(output_path, "w", format="mp4", options={"movflags": "+faststart"}) as dst:
+        in_stream = src.streams.video[0]
+        out_stream = dst.add_stream_from_template(in_stream)
+        # Streams crudos (h264 sin contenedor) no traen marcas de tiempo: las generamos a ritmo constante
+        time_base = 1 / Fraction(in_stream.average_rate or in_stream.guessed_rate or 25)
+        out_stream.time_base = time_base
+
+        n = 0
+        for packet in src.demux(in_stream):
+            if packet.size == 0: continue # Paquete de vaciado del demuxer
+            missing_ts = packet.dts is None
+            packet.stream = out_stream
+            if missing_ts:
+                packet.time_base = time_base
+                packet.pts = packet.dts = n
+                packet.duration = 1
+            dst.mux(packet)
+            n += 1
+
+def _remux_ffmpeg(input_path, output_path):
+    subprocess.run(
+        [FFMPEG_BIN, "-y", "-v", "error", "-fflags", "+genpts", "-i", input_path,
+         "-map", "0:v:0", "-c", "copy", "-movflags", "+faststart", output_path],
+        check=True, timeout=REMUX_TIMEOUT_SECONDS,
+    )
+
+def remux_for_web(input_path):
+    """
+    Reparación rápida: reempaqueta el vídeo en un MP4 nuevo (índice + moov) copiando
+    los paquetes, sin decodificar ni codificar. Tarda lo que una copia del fichero.
+    Solo copia la pista de vídeo y conserva la resolución original.
+    Devuelve el nombre del fichero reparado, o None si no se pudo (-> transcodificar).
+    """
+    if av is None and FFMPEG_BIN is None:
+        return None
+
+    output_filename, output_path = web_output_path(input_path)
+    name, ext = os.path.splitext(output_filename)
+    tmp_path = os.path.join(os.path.dirname(output_path), f".{name}.remux{ext}")
+
+    print(f"📦 REPARADOR: Reempaquetando {os.path.basename(input_path)} (sin recodificar)...")
+    try:
+        if av is not None:
+            _remux_pyav(input_path, tmp_path)
+        else:
+            _remux_ffmpeg(input_path, tmp_path)
+
+        if not _is_playable(tmp_path):
+            raise ValueError("el resultado no tiene un índice válido")
+    except Exception as e:
+        print(f"⚠ Reempaquetado fallido ({e}). Se hará transcodificación.")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    os.replace(tmp_path, output_path)
+    print(f"✅ REPARADOR: Reempaquetado en {output_filename}")
+    return output_filename
+
+def _stream_signature(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        return (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                int(cap.get(cv2.CAP_PROP_FOURCC)))
+    finally:
+        cap.release()
+
+def is_remux_of(output_path, input_path):
+    """
+    True si `output_path` es un reempaquetado válido de `input_path` (de un intento
+    anterior): mismo códec y resolución, casi el mismo tamaño e índice válido. La
+    transcodificación (WebVideoWriter) cambia el códec y, en vídeos grandes, la resolución.
+    """
+    if not os.path.exists(output_path) or not os.path.exists(input_path):
+        return False
+    input_size = os.path.getsize(input_path)
+    if abs(os.path.getsize(output_path) - input_size) > REMUX_SIZE_TOLERANCE * input_size:
+        return False
+    return _stream_signature(output_path) == _stream_signature(input_path) and _is_playable(output_path)
+
 def fix_video_for_web(input_path):
     """
-    Repara el vídeo reescribiéndolo.
+    Repara el vídeo reescribiéndolo (pasada independiente, sin análisis).
     Reduce la resolución para ir MUCHO más rápido.
     """
     if not os.path.exists(input_path):
         raise FileNotFoundError(f"Video no encontrado: {input_path}")
 
-    dir_name = os.path.dirname(input_path)
-    base_name = os.path.basename(input_path)
-    name, ext = os.path.splitext(base_name)
-    output_filename = f"{name}_fixed.mp4"
-    output_path = os.path.join(dir_name, output_filename)
+    output_filename, output_path = web_output_path(input_path)
 
     # Si ya existe el arreglado de una vez anterior, no lo repetimos
     if os.path.exists(output_path):
         print("✅ Video reparado ya existente. Saltando proceso.")
         return output_filename
 
-    print(f"🔧 REPARADOR: Iniciando optimización rápida de {base_name}...")
+    print(f"🔧 REPARADOR: Iniciando optimización rápida de {os.path.basename(input_path)}...")
 
     cap = cv2.VideoCapture(input_path)
-    
-    # Datos originales
-    orig_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    orig_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps == 0: fps = 25.0 # Fallback estándar
-
-    # Si el video es muy grande (> 720p), lo reducimos para la web.
-    # Esto acelera la escritura exponencialmente.
-    scale = 1.0
-    if orig_w > 1280:
-        scale = 0.5 
-    elif orig_w > 800:
-        scale = 0.7
-        
-    new_w = int(orig_w * scale)
-    new_h = int(orig_h * scale)
-    
-    print(f"   ℹ Redimensionando: {orig_w}x{orig_h} -> {new_w}x{new_h} (Escala: {scale})")
-
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v') 
-    out = cv2.VideoWriter(output_path, fourcc, fps, (new_w, new_h))
-
-    frames_count = 0
+    writer = WebVideoWriter(input_path)
     try:
         while True:
             ret, frame = cap.read()
             if not ret: break
-            
-            # Solo redimensionamos si es necesario
-            if scale != 1.0:
-                frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
-            
-            out.write(frame)
-            frames_count += 1
-            
-            # Log menos frecuente para no saturar consola
-            if frames_count % 300 == 0:
-                print(f"   ...procesando frame {frames_count}")
+            writer.write(frame)
                 
     except Exception as e:
         print(f"⚠ Error durante reparación: {e}")
     finally:
         cap.release()
-        out.release()
-        print(f"✅ REPARADOR: Finalizado en {output_filename}")
+        writer.close()
 
-    return output_filename
\ No newline at end of file
+    return output_filename
@@ -0,0 +1,209 @@
+from src.backend.video_fixer import WebVideoWriter, web_output_path, remux_for_web, is_remux_of, check_video_is_healthy
+from sqlalchemy.orm import Session
+from . import models, database, jobs, result_cache, analytics, metrics
+from .config import COORDS_FILE, REFS_FOLDER, NUM_WORKERS, QUEUE_POLL_SECONDS, ENGINE_WORKERS, CHECKPOINT_DIR, TRACE_DIR
+import multiprocessing
+import threading
+import traceback
+import os
+
+# --- IMPORTAMOS EL MOTOR DE IA ---
+from src.ai.production_counter import BeerCounterEngine
+
+def process_video_job(session_id: int, video_path: str, db: Session, notify=None):
+    """
+    Repara (si hace falta) y analiza un vídeo, guardando el resultado en su sesión.
+    `notify(msg)` (opcional) recibe el progreso, las tiradas y los cambios de estado.
+    """
+    print(f"👷 WORKER {os.getpid()}: Iniciando procesamiento para ID {session_id}...")
+    notify = notify or (lambda msg: None)
+
+    session = db.query(models.AnalysisSession).filter(models.AnalysisSession.id == session_id).first()
+    session.status = "PROCESSING"
+    db.commit()
+    notify({"type": "status", "status": "PROCESSING"})
+
+    # Si un intento anterior se cortó (worker caído, reinicio), el motor sigue desde aquí
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    checkpoint_path = os.path.join(CHECKPOINT_DIR, f"session_{session_id}.json")
+    trace_path = os.path.join(TRACE_DIR, f"session_{session_id}")
+
+    try:
+        # Motor sobre la calibración cacheada en este proceso (se recarga sola si se recalibra).
+        # Su huella es la clave de la caché de resultados
+        engine = BeerCounterEngine(COORDS_FILE, REFS_FOLDER)
+        fingerprint = engine.calibration.fingerprint
+
+        # --- DIAGNÓSTICO + USO DE LA IA ---
+        fixed_filename, fixed_path = web_output_path(video_path)
+        if check_video_is_healthy(video_path):
+            print("✨ Video SANO. Omitiendo reparación para máxima velocidad.")
+            results = engine.process_video(video_path, workers=ENGINE_WORKERS, progress_callback=notify,
+                                           checkpoint_path=checkpoint_path, trace_path=trace_path)
+        elif is_remux_of(fixed_path, video_path) or (not os.path.exists(fixed_path) and remux_for_web(video_path)):
+            # Solo le faltaba el índice: el reempaquetado es el mismo vídeo, ya indexado y a
+            # resolución original, así que se analiza en modo rápido (paralelo + bisección).
+            # En un reintento se reutiliza el de la vez anterior (y su punto de control)
+            session.filename = fixed_filename
+            db.commit()
+            results = engine.process_video(fixed_path, workers=ENGINE_WORKERS, progress_callback=notify,
+                                           checkpoint_path=checkpoint_path, trace_path=trace_path)
+        else:
+            # Transcodificación: reparación y análisis en UNA sola decodificación. El contador
+            # usa los frames originales (resolución completa) y el escritor la copia para web
+            writer = None
+            if os.path.exists(fixed_path):
+                print("✅ Video reparado ya existente. Solo análisis.")
+            else:
+                print("🩹 Video CORRUPTO/RAW detectado. Reparando y analizando en una sola pasada...")
+                writer = WebVideoWriter(video_path)
+
+            results = {"error": "Análisis interrumpido"}
+            try:
+                results = engine.process_video(video_path, workers=1, progress_callback=notify,
+                                               frame_sink=writer.write if writer else None,
+                                               checkpoint_path=checkpoint_path, trace_path=trace_path)
+            finally:
+                # Si el análisis falla no publicamos un vídeo reparado a medias
+                if writer: writer.close(keep="error" not in results)
+
+            if os.path.exists(fixed_path):
+                # Actualizamos BD para que el frontend cargue el bueno
+                session.filename = fixed_filename
+                db.commit()
+
+        if "error" in results:
+            raise RuntimeError(results["error"])
+
+        session.count_a = results["grifo_a"]
+        session.count_b = results["grifo_b"]
+        session.seconds_a = results["seconds_a"]
+        session.seconds_b = results["seconds_b"]
+        session.tap_data = results["taps"]
+        session.video_duration = results["video_duration"]
+        session.events_data = results["events"]
+        session.profile_data = results["profile"]
+        # Tiradas a la tabla normalizada + agregados (misma transacción que el resultado)
+        analytics.record_session_events(db, session, results["events"])
+
+        session.status = "COMPLETED"
+        metrics.record_analysis(db, session.video_duration, session.profile_data)
+        db.commit()
+
+    except Exception as e:
+        print(f"❌ WORKER ERROR: {e}")
+        # Nada de lo que quedó a medias (tiradas, agregados, contadores) se guarda con el ERROR
+        db.rollback()
+        session.status = "ERROR"
+        try:
+            db.commit()
+        finally:
+            notify({"type": "status", "status": "ERROR"})
+        raise
+
+    # El resultado ya está guardado: un fallo al cachearlo no lo convierte en ERROR
+    if session.content_hash:
+        try:
+            result_cache.store(db, session.content_hash, fingerprint, session.id)
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ CACHÉ: no se pudo registrar la sesión {session_id} ({e})")
+    print(f"✅ WORKER: ID {session_id} Terminado.")
+    notify({"type": "status", "status": "COMPLETED"})
+
+def worker_main(stop_event, progress_queue=None):
+    """Bucle de un proceso worker: reclama trabajos de la cola hasta que se pida parar"""
+    pid = os.getpid()
+    print(f"🧵 WORKER {pid}: listo")
+
+    while not stop_event.is_set():
+        db = database.SessionLocal()
+        try:
+            job = jobs.claim_next_job(db, pid)
+            if job is None:
+                db.close()
+                stop_event.wait(QUEUE_POLL_SECONDS)
+                continue
+
+            print(f"📥 WORKER {pid}: trabajo {job.id} (prioridad {job.priority}, intento {job.attempts})")
+            notify = None
+            if progress_queue is not None:
+                session_id = job.session_id
+                notify = lambda msg: progress_queue.put({"session_id": session_id, **msg})
+            try:
+                process_video_job(job.session_id, job.video_path, db, notify)
+                jobs.finish_job(db, job.id)
+            except Exception as e:
+                traceback.print_exc()
+                db.rollback()
+                jobs.finish_job(db, job.id, error=str(e))
+        finally:
+            db.close()
+
+class WorkerPool:
+    """
+    Pool acotado de procesos worker con supervisor.
+    - Al arrancar, los trabajos que quedaron RUNNING de una ejecución anterior vuelven a la cola.
+    - Si un worker muere a mitad de un trabajo, su trabajo se reintenta y el worker se relanza.
+    """
+    def __init__(self, num_workers=NUM_WORKERS, check_seconds=2.0):
+        self.num_workers = num_workers
+        self.check_seconds = check_seconds
+        # 'spawn': procesos limpios, sin heredar el estado del servidor (hilos, conexiones...)
+        self.ctx = multiprocessing.get_context("spawn")
+        self.stop_event = self.ctx.Event()
+        # Progreso de los workers hacia el servidor (lo reparte ProgressHub)
+        self.progress_queue = self.ctx.Queue()
+        self.processes = []
+        self._supervisor = None
+        self._stopping = threading.Event()
+
+    def _spawn(self):
+        # No daemon: el motor puede abrir su propio pool de procesos para el análisis paralelo
+        proc = self.ctx.Process(target=worker_main, args=(self.stop_event, self.progress_queue), name="gambooza-worker")
+        proc.start()
+        return proc
+
+    def start(self):
+        db = database.SessionLocal()
+        try:
+            recovered = jobs.requeue_running_jobs(db)
+            pending = jobs.queue_depth(db)
+        finally:
+            db.close()
+        print(f"🏭 POOL: {self.num_workers} workers | {pending} trabajos en cola ({recovered} recuperados)")
+
+        self.processes = [self._spawn() for _ in range(self.num_workers)]
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+
+    def _supervise(self):
+        while not self._stopping.wait(self.check_seconds):
+            for i, proc in enumerate(self.processes):
+                if proc.is_alive() or self._stopping.is_set():
+                    continue
+                print(f"💥 POOL: worker {proc.pid} terminó (código {proc.exitcode}). Relanzando...")
+                db = database.SessionLocal()
+                try:
+                    jobs.requeue_running_jobs(db, worker_pid=proc.pid)
+                finally:
+                    db.close()
+                self.processes[i] = self._spawn()
+
+    def stop(self, timeout=10.0):
+        """Parada ordenada: los trabajos interrumpidos vuelven a la cola sin gastar intento"""
+        self._stopping.set()
+        self.stop_event.set()
+        for proc in self.processes:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+
+        db = database.SessionLocal()
+        try:
+            for proc in self.processes:
+                jobs.requeue_running_jobs(db, worker_pid=proc.pid, count_attempt=False)
+        finally:
+            db.close()
+        print("🛑 POOL: workers detenidos")
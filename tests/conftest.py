@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Los módulos se importan como en la app (`src.ai...`, `src.backend...`) desde la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ai.benchmark import make_synthetic_video
+from src.backend import database
+
+@pytest.fixture(scope="session")
+def synthetic_video(tmp_path_factory):
+    """Vídeo sintético pequeño (con coords, referencias y verdad) compartido por los tests"""
+    out_dir = str(tmp_path_factory.mktemp("synthetic"))
+    truth = make_synthetic_video(out_dir, 320, 180, 25, 30, num_taps=2, seed=1)
+    return out_dir, truth
+
+@pytest.fixture(scope="session")
+def raw_video(synthetic_video, tmp_path_factory):
+    """El vídeo sintético como H.264 crudo (sin contenedor ni índice): el caso a reparar"""
+    av = pytest.importorskip("av")
+    video_dir, truth = synthetic_video
+    raw_path = str(tmp_path_factory.mktemp("raw") / "camara.h264")
+    with av.open(os.path.join(video_dir, "v.mp4")) as src, av.open(raw_path, "w", format="h264") as dst:
+        in_stream = src.streams.video[0]
+        stream = dst.add_stream("libx264", rate=in_stream.average_rate)
+        stream.width, stream.height, stream.pix_fmt = in_stream.width, in_stream.height, "yuv420p"
+        stream.options = {"crf": "18", "g": "50"}
+        for frame in src.decode(in_stream):
+            frame.pts = None
+            for packet in stream.encode(frame):
+                dst.mux(packet)
+        for packet in stream.encode():
+            dst.mux(packet)
+    return raw_path, truth
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """sessionmaker sobre una BD SQLite vacía en un directorio temporal"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'gambooza.db'}")
+    database.Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import sys
+
+import cv2
+import numpy as np
+
+from src.ai import frame_cache
+from src.ai.frame_cache import FrameCache
+from src.ai.production_counter import load_coords
+
+def _frames_gray(video_path, roi):
+    x, y, w, h = roi
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret: break
+        frames.append(cv2.cvtColor(frame[y:y+h, x:x+w], cv2.COLOR_BGR2GRAY))
+    cap.release()
+    return frames
+
+def _strided_cache(synthetic_video, tmp_path, monkeypatch):
+    video_dir, truth = synthetic_video
+    video_path = str(tmp_path / "v.mp4")
+    shutil.copy(os.path.join(video_dir, "v.mp4"), video_path)
+    rois, _ = load_coords(os.path.join(video_dir, "coords_dual.txt"))
+    # Recortes que no caben enteros: uno de cada 6 frames
+    frame_bytes = sum((w + 2 * frame_cache.ROI_PADDING) * (h + 2 * frame_cache.ROI_PADDING) for _, _, w, h in rois)
+    monkeypatch.setattr(frame_cache, "ROI_MAX_BYTES", int(truth["frames"] * frame_bytes / 5.5))
+    return FrameCache.open(video_path, rois), video_path, rois, truth
+
+def test_strided_cache_exports_the_exact_frame(synthetic_video, tmp_path, monkeypatch):
+    cache, video_path, rois, truth = _strided_cache(synthetic_video, tmp_path, monkeypatch)
+    assert cache.roi_stride > 1
+
+    # Primer frame de una tirada que no está en la caché: el recorte cacheado es de antes
+    pour = next(e for e in truth["events"] if round(e["start"] * cache.fps) % cache.roi_stride)
+    idx = round(pour["start"] * cache.fps)
+    tap = ["A", "B"].index(pour["tap"])
+    frames = _frames_gray(video_path, rois[tap])
+
+    assert cache.cached_frame(idx) < idx
+    np.testing.assert_array_equal(cache.roi_gray(idx, tap), frames[cache.cached_frame(idx)])
+    np.testing.assert_array_equal(cache.exact_roi_gray(idx, tap), frames[idx])
+    assert not np.array_equal(frames[idx], frames[cache.cached_frame(idx)])
+
+    cached = cache.cached_frame(idx)
+    np.testing.assert_array_equal(cache.exact_roi_gray(cached, tap), frames[cached])
+
+def test_headless_export_uses_the_exact_frame(synthetic_video, tmp_path, monkeypatch):
+    cache, video_path, rois, truth = _strided_cache(synthetic_video, tmp_path, monkeypatch)
+    video_dir, _ = synthetic_video
+    pour = next(e for e in truth["events"] if round(e["start"] * cache.fps) % cache.roi_stride)
+    idx = round(pour["start"] * cache.fps)
+    out_dir = tmp_path / "refs"
+    monkeypatch.setattr(sys, "argv", ["frame_cache", video_path, "--coords", os.path.join(video_dir, "coords_dual.txt"),
+                                      "--out", str(out_dir), "--export", f"{pour['tap']}:beer:{idx}"])
+    frame_cache.main()
+
+    expected_dir = tmp_path / "expected"
+    tap = ["A", "B"].index(pour["tap"])
+    frame_cache.save_ref(_frames_gray(video_path, rois[tap])[idx], str(expected_dir), pour["tap"], "beer")
+    exported = cv2.imread(str(out_dir / f"{pour['tap']}_beer.jpg"), cv2.IMREAD_GRAYSCALE)
+    np.testing.assert_array_equal(exported, cv2.imread(str(expected_dir / f"{pour['tap']}_beer.jpg"), cv2.IMREAD_GRAYSCALE))
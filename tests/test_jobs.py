@@ -0,0 +1,125 @@
+from src.backend import database, jobs, models, worker
+
+def _enqueue(db, n):
+    ids = []
+    for i in range(n):
+        session = models.AnalysisSession(filename=f"v{i}.mp4", status="PENDING")
+        db.add(session)
+        db.commit()
+        ids.append(jobs.enqueue_job(db, session.id, f"v{i}.mp4").id)
+    return ids
+
+def _job(db, job_id):
+    db.expire_all()
+    return db.query(models.Job).filter(models.Job.id == job_id).one()
+
+def _race(monkeypatch, other_db, other_pid):
+    """
+    El próximo claim se queda entre la consulta del candidato y su UPDATE (que llama
+    a utcnow) mientras otro worker reclama. Devuelve la lista con lo que reclamó el otro.
+    """
+    utcnow = models.utcnow
+    claimed = []
+    racing = []
+    def racing_utcnow():
+        if not racing:
+            racing.append(True)
+            claimed.append(jobs.claim_next_job(other_db, other_pid))
+        return utcnow()
+    monkeypatch.setattr(models, "utcnow", racing_utcnow)
+    return claimed
+
+def test_claim_takes_priority_then_oldest(db):
+    first, second = _enqueue(db, 2)
+    db.query(models.Job).filter(models.Job.id == second).update({models.Job.priority: 5})
+    db.commit()
+    assert jobs.claim_next_job(db, 1).id == second
+    assert jobs.claim_next_job(db, 1).id == first
+    assert jobs.claim_next_job(db, 1) is None
+
+def test_racing_claims_never_share_a_job(session_factory, monkeypatch):
+    db_a, db_b = session_factory(), session_factory()
+    first, second = _enqueue(db_a, 2)
+
+    claimed_by_b = _race(monkeypatch, db_b, 222)
+    job_a = jobs.claim_next_job(db_a, 111)
+
+    assert claimed_by_b[0].id == first
+    assert job_a.id == second # A pierde la carrera y pasa al siguiente
+    assert _job(db_a, first).worker_pid == 222 and _job(db_a, first).attempts == 1
+    assert _job(db_a, second).worker_pid == 111 and _job(db_a, second).attempts == 1
+    db_a.close()
+    db_b.close()
+
+def test_racing_claim_on_the_last_job_returns_none(session_factory, monkeypatch):
+    db_a, db_b = session_factory(), session_factory()
+    (only,) = _enqueue(db_a, 1)
+    claimed_by_b = _race(monkeypatch, db_b, 222)
+
+    assert jobs.claim_next_job(db_a, 111) is None
+    assert claimed_by_b[0].id == only
+    assert _job(db_a, only).worker_pid == 222
+    db_a.close()
+    db_b.close()
+
+def test_requeue_only_touches_the_dead_worker(db):
+    mine, other = _enqueue(db, 2)
+    jobs.claim_next_job(db, 111)
+    jobs.claim_next_job(db, 222)
+
+    assert jobs.requeue_running_jobs(db, worker_pid=111) == 1
+    assert _job(db, mine).status == "PENDING" and _job(db, mine).worker_pid is None
+    assert _job(db, other).status == "RUNNING"
+    assert db.query(models.AnalysisSession).filter(models.AnalysisSession.id == _job(db, mine).session_id).one().status == "PENDING"
+
+def test_requeue_gives_up_after_max_attempts(db, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_JOB_ATTEMPTS", 2)
+    (job_id,) = _enqueue(db, 1)
+    for _ in range(2):
+        jobs.claim_next_job(db, 111)
+        jobs.requeue_running_jobs(db, worker_pid=111)
+
+    job = _job(db, job_id)
+    assert job.status == "FAILED" and job.attempts == 2
+    assert db.query(models.AnalysisSession).filter(models.AnalysisSession.id == job.session_id).one().status == "ERROR"
+
+class _DeadProcess:
+    pid = 111
+    exitcode = -9
+    def is_alive(self):
+        return False
+
+class _LiveProcess:
+    pid = 333
+    def is_alive(self):
+        return True
+
+def test_supervisor_requeues_the_job_of_a_dead_worker(session_factory, db, monkeypatch):
+    monkeypatch.setattr(database, "SessionLocal", session_factory)
+    (job_id,) = _enqueue(db, 1)
+    jobs.claim_next_job(db, _DeadProcess.pid)
+
+    pool = worker.WorkerPool(num_workers=1, check_seconds=0)
+    pool.processes = [_DeadProcess()]
+    def respawn():
+        pool._stopping.set() # Una sola vuelta del supervisor
+        return _LiveProcess()
+    monkeypatch.setattr(pool, "_spawn", respawn)
+    pool._supervise()
+
+    assert isinstance(pool.processes[0], _LiveProcess)
+    job = _job(db, job_id)
+    assert job.status == "PENDING" and job.worker_pid is None and job.attempts == 1
+
+def test_pool_start_requeues_jobs_left_running(session_factory, db, monkeypatch):
+    monkeypatch.setattr(database, "SessionLocal", session_factory)
+    first, second = _enqueue(db, 2)
+    jobs.claim_next_job(db, 111) # Servidor anterior caído con dos trabajos a medias
+    jobs.claim_next_job(db, 222)
+
+    pool = worker.WorkerPool(num_workers=1)
+    monkeypatch.setattr(pool, "_spawn", _LiveProcess)
+    monkeypatch.setattr(pool, "_supervise", lambda: None)
+    pool.start()
+
+    assert {_job(db, first).status, _job(db, second).status} == {"PENDING"}
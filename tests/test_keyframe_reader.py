@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+import src.ai.production_counter as pc
+from src.ai.keyframe_reader import av
+
+pytestmark = pytest.mark.skipif(av is None, reason="PyAV no está instalado")
+
+def _progress_messages(video_dir, mode, monkeypatch):
+    monkeypatch.setattr(pc, "IDLE_SCAN_MODE", mode)
+    monkeypatch.setattr(pc, "PROGRESS_INTERVAL_SECONDS", 0.0)
+    messages = []
+    engine = pc.BeerCounterEngine(os.path.join(video_dir, "coords_dual.txt"), video_dir)
+    results = engine.process_video(os.path.join(video_dir, "v.mp4"), workers=1, progress_callback=messages.append)
+    return results, [m for m in messages if m["type"] == "progress"]
+
+def test_keyframe_mode_reports_progress(synthetic_video, monkeypatch):
+    video_dir, truth = synthetic_video
+    results, progress = _progress_messages(video_dir, "keyframe", monkeypatch)
+
+    assert results["profile"]["mode"] == "keyframe"
+    assert len(progress) > 1
+    frames = [m["frame"] for m in progress]
+    assert frames == sorted(frames)
+    assert frames[-1] == truth["frames"]
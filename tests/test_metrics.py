@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from src.backend import jobs, metrics, models, result_cache
+
+def _samples(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+def _completed_session(db, video_duration, profile):
+    session = models.AnalysisSession(filename="v.mp4", status="COMPLETED", video_duration=video_duration, profile_data=profile)
+    db.add(session)
+    db.commit()
+    return session
+
+def test_counters_are_incremental(db):
+    metrics.backfill_counters(db)
+    job = jobs.enqueue_job(db, 1, "v.mp4")
+    db.query(models.Job).filter(models.Job.id == job.id).update({models.Job.created_at: models.utcnow() - timedelta(seconds=10)})
+    db.commit()
+    jobs.claim_next_job(db, 123)
+    metrics.record_analysis(db, 60.0, {"frames_total": 1500, "frames_analyzed": 300, "wall_seconds": 2.5,
+                                       "stages": {"decode": {"seconds": 1.5, "calls": 300}}})
+    jobs.finish_job(db, job.id)
+
+    samples = _samples(metrics.render_metrics(db, 2))
+    assert samples["gambooza_jobs_completed_total"] == "1"
+    assert samples['gambooza_jobs{status="DONE"}'] == "1"
+    assert samples['gambooza_job_wait_seconds_bucket{le="5"}'] == "0"
+    assert samples['gambooza_job_wait_seconds_bucket{le="15"}'] == "1"
+    assert samples["gambooza_job_run_seconds_count"] == "1"
+    assert samples["gambooza_video_seconds_processed_total"] == "60"
+    assert samples["gambooza_frames_analyzed_total"] == "300"
+    assert samples['gambooza_stage_seconds_total{stage="decode"}'] == "1.5"
+
+def test_scrape_does_not_parse_session_history(db):
+    metrics.backfill_counters(db)
+    _completed_session(db, 30.0, {"frames_total": 750})
+    samples = _samples(metrics.render_metrics(db, 2))
+    assert samples["gambooza_video_seconds_processed_total"] == "0"
+
+def test_backfill_seeds_from_history_once(db):
+    _completed_session(db, 30.0, {"frames_total": 750, "stages": {"classify": {"seconds": 0.25, "calls": 10}}})
+    metrics.backfill_counters(db)
+    metrics.backfill_counters(db)
+    samples = _samples(metrics.render_metrics(db, 2))
+    assert samples["gambooza_video_seconds_processed_total"] == "30"
+    assert samples["gambooza_frames_total"] == "750"
+    assert samples['gambooza_stage_seconds_total{stage="classify"}'] == "0.25"
+
+def test_cache_hits_survive_eviction(db):
+    metrics.backfill_counters(db)
+    session = _completed_session(db, 30.0, None)
+    for i in range(3):
+        result_cache.store(db, f"hash{i}", "fp", session.id)
+        assert result_cache.lookup(db, result_cache.make_key(f"hash{i}", "fp")) is not None
+    result_cache.evict(db, "fp", max_entries=1)
+
+    samples = _samples(metrics.render_metrics(db, 2))
+    assert db.query(models.ResultCache).count() == 1
+    assert samples["gambooza_result_cache_hits_total"] == "3"
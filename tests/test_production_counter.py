@@ -0,0 +1,119 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import src.ai.production_counter as pc
+
+def _engine(video_dir):
+    return pc.BeerCounterEngine(os.path.join(video_dir, "coords_dual.txt"), video_dir)
+
+def test_gate_factor_is_read_at_call_time(synthetic_video, monkeypatch):
+    video_dir, _ = synthetic_video
+    engine = _engine(video_dir)
+    engine._build_taps(320, 180)
+    before = engine.calibration.fingerprint
+
+    monkeypatch.setattr(pc, "CHANGE_GATE_FACTOR", 0.0)
+    engine = _engine(video_dir)
+    assert engine.calibration.fingerprint != before
+    engine._build_taps(320, 180)
+    assert engine.classifier.gate_factor == 0.0
+
+def test_pyramid_settings_are_part_of_the_fingerprint(synthetic_video, monkeypatch):
+    video_dir, _ = synthetic_video
+    engine = _engine(video_dir)
+    engine._build_taps(320, 180)
+    seen = {engine.calibration.fingerprint}
+
+    for name, value in [("PYRAMID_MARGIN", 1.5), ("PYRAMID_FACTOR", 2), ("PYRAMID_MIN_PROTOTYPES", 1)]:
+        monkeypatch.setattr(pc, name, value)
+        engine = _engine(video_dir)
+        seen.add(engine.calibration.fingerprint)
+    assert len(seen) == 4
+
+    engine._build_taps(320, 180)
+    assert engine.classifier.pyramid_margin == 1.5
+    assert engine.taps[0].low_shape == (engine.taps[0].roi[3] // 2, engine.taps[0].roi[2] // 2)
+
+class _Crash(Exception):
+    pass
+
+def _run(video_dir, tmp_path, name, crash_after=None):
+    engine = _engine(video_dir)
+    if crash_after:
+        on_sample = engine._on_sample
+        samples = {"n": 0}
+        def crashing_on_sample(*args):
+            on_sample(*args)
+            samples["n"] += 1
+            if samples["n"] == crash_after:
+                raise _Crash()
+        engine._on_sample = crashing_on_sample
+    return engine.process_video(os.path.join(video_dir, "v.mp4"), workers=1,
+                                checkpoint_path=str(tmp_path / "ck.json"), trace_path=str(tmp_path / name))
+
+def test_resumed_trace_matches_uninterrupted_run(synthetic_video, tmp_path, monkeypatch):
+    video_dir, _ = synthetic_video
+    monkeypatch.setattr(pc, "IDLE_SCAN_MODE", "bisect")
+    monkeypatch.setattr(pc, "CHECKPOINT_INTERVAL_SECONDS", 0.0)
+    full = _run(video_dir, tmp_path, "full")
+
+    with pytest.raises(_Crash):
+        _run(video_dir, tmp_path, "crash", crash_after=100)
+    resumed = _run(video_dir, tmp_path, "resumed")
+
+    assert resumed["profile"]["resumed"]
+    assert resumed["taps"] == full["taps"]
+    a, b = np.load(tmp_path / "full.npy"), np.load(tmp_path / "resumed.npy")
+    assert a.dtype == b.dtype and len(a) == len(b)
+    for field in a.dtype.names:
+        np.testing.assert_array_equal(a[field], b[field])
+
+@pytest.mark.parametrize("mode", ["skip", "bisect"])
+def test_parallel_matches_sequential(synthetic_video, monkeypatch, mode):
+    video_dir, _ = synthetic_video
+    monkeypatch.setattr(pc, "IDLE_SCAN_MODE", mode)
+    monkeypatch.setattr(pc, "MIN_CHUNK_FRAMES", 150)
+    video_path = os.path.join(video_dir, "v.mp4")
+
+    sequential = _engine(video_dir).process_video(video_path, workers=1)
+    parallel = _engine(video_dir).process_video(video_path, workers=4)
+
+    assert parallel["profile"]["mode"] == "parallel"
+    assert sequential["profile"]["mode"] == "sequential"
+    # Con 4 tramos de ~190 frames las tiradas cruzan los cortes entre tramos
+    assert sequential["events"]
+    assert parallel["events"] == sequential["events"]
+    assert parallel["taps"] == sequential["taps"]
+
+@pytest.mark.parametrize("kernel", [(5, 5), (9, 9)])
+def test_roi_window_preprocessing_is_exact(synthetic_video, monkeypatch, kernel):
+    video_dir, _ = synthetic_video
+    monkeypatch.setattr(pc, "BLUR_KERNEL", kernel)
+    monkeypatch.setattr(pc, "BLUR_MARGIN", kernel[0] // 2)
+    engine = _engine(video_dir)
+    height, width = 180, 320
+    frame = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    # Una ROI pegada a la esquina superior izquierda, una interior y otra al borde derecho/inferior
+    rois = [(0, 0, 30, 20), (140, 80, 25, 25), (290, 150, 30, 30)]
+    full = cv2.GaussianBlur(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), kernel, 0)
+
+    for subset in (rois, rois[1:2], rois[2:]):
+        window = engine._compute_window(subset, width, height)
+        x0, y0 = window[:2]
+        blurred = engine._preprocess(frame, window)
+        for x, y, w, h in subset:
+            np.testing.assert_array_equal(blurred[y - y0:y - y0 + h, x - x0:x - x0 + w], full[y:y+h, x:x+w])
+
+def test_roi_window_without_blur_margin_is_not_exact(synthetic_video, monkeypatch):
+    # Comprueba que el test anterior detecta un margen insuficiente
+    video_dir, _ = synthetic_video
+    monkeypatch.setattr(pc, "BLUR_MARGIN", 0)
+    engine = _engine(video_dir)
+    frame = np.random.default_rng(0).integers(0, 256, (180, 320, 3), dtype=np.uint8)
+    x, y, w, h = 140, 80, 25, 25
+    window = engine._compute_window([(x, y, w, h)], 320, 180)
+    full = cv2.GaussianBlur(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), pc.BLUR_KERNEL, 0)
+    assert not np.array_equal(engine._preprocess(frame, window)[:h, :w], full[y:y+h, x:x+w])
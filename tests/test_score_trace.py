@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+import src.ai.production_counter as pc
+from src.ai.score_trace import load_trace, rescore
+
+def _analyze(video_dir, tmp_path, name):
+    engine = pc.BeerCounterEngine(os.path.join(video_dir, "coords_dual.txt"), video_dir)
+    results = engine.process_video(os.path.join(video_dir, "v.mp4"), workers=1, trace_path=str(tmp_path / name))
+    results.pop("profile")
+    return results
+
+@pytest.mark.parametrize("mode", ["keyframe", "bisect"])
+def test_rescore_matches_the_analysis(synthetic_video, tmp_path, monkeypatch, mode):
+    video_dir, _ = synthetic_video
+    monkeypatch.setattr(pc, "IDLE_SCAN_MODE", mode)
+    results = _analyze(video_dir, tmp_path, "trace")
+
+    trace, meta = load_trace(str(tmp_path / "trace"))
+    assert results["events"]
+    assert rescore(trace, meta) == results
+
+@pytest.mark.parametrize("mode", ["keyframe", "bisect"])
+def test_rescore_with_other_rules_matches_a_new_analysis(synthetic_video, tmp_path, monkeypatch, mode):
+    video_dir, _ = synthetic_video
+    monkeypatch.setattr(pc, "IDLE_SCAN_MODE", mode)
+    _analyze(video_dir, tmp_path, "trace")
+    trace, meta = load_trace(str(tmp_path / "trace"))
+
+    monkeypatch.setattr(pc, "SECONDS_PER_BEER", 4.0)
+    rerun = _analyze(video_dir, tmp_path, "rerun")
+    rescored = rescore(trace, meta, seconds_per_beer=4.0)
+
+    assert rescored == rerun
+    assert rescored["taps"] != rescore(trace, meta)["taps"] # Las reglas nuevas cambian el conteo
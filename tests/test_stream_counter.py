@@ -0,0 +1,34 @@
+import os
+
+import cv2
+
+import src.ai.production_counter as pc
+from src.ai.stream_counter import StreamCounter, FileBackedStream
+
+STREAM_FIELDS = ["ingest_ts", "emitted_ts", "latency_ms"]
+
+def test_stream_matches_the_analysis(synthetic_video):
+    video_dir, _ = synthetic_video
+    coords, video = os.path.join(video_dir, "coords_dual.txt"), os.path.join(video_dir, "v.mp4")
+    counter = StreamCounter(coords, video_dir)
+
+    # Cámara falsa acelerada: mismo ritmo relativo de frames, sin esperar 30 s
+    stream = FileBackedStream(video, speed=50)
+    fps = stream.get(cv2.CAP_PROP_FPS)
+    emitted = []
+    for event in counter.run(stream):
+        emitted.append((counter.frames, event))
+
+    results = pc.BeerCounterEngine(coords, video_dir).process_video(video, workers=1)
+    assert results["events"]
+    assert [{k: v for k, v in event.items() if k not in STREAM_FIELDS} for _, event in emitted] == results["events"]
+
+    # Cada tirada sale con el frame que la cierra, no al acabar el stream
+    for frames_read, event in emitted:
+        assert frames_read == round(event["end"] * fps) < counter.frames
+        assert event["latency_ms"] >= 0 and event["emitted_ts"] >= event["ingest_ts"]
+
+    summary = counter.summary()
+    assert summary["events"] == len(emitted)
+    assert summary["total"] == results["total"]
+    assert set(summary["latency"]) == {"mean_ms", "p95_ms", "max_ms"}
@@ -0,0 +1,120 @@
+import os
+import shutil
+
+import pytest
+
+import src.ai.production_counter as pc
+from src.backend import analytics, metrics, models, result_cache, worker
+from src.backend.video_fixer import web_output_path
+
+class _Crash(Exception):
+    pass
+
+def test_retry_after_remux_resumes_on_the_remuxed_video(synthetic_video, raw_video, db, tmp_path, monkeypatch):
+    video_dir, _ = synthetic_video
+    raw_path, truth = raw_video
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(worker, "COORDS_FILE", os.path.join(video_dir, "coords_dual.txt"))
+    monkeypatch.setattr(worker, "REFS_FOLDER", video_dir)
+    monkeypatch.setattr(pc, "CHECKPOINT_INTERVAL_SECONDS", 0.0)
+
+    video_path = str(tmp_path / "camara.h264")
+    shutil.copy(raw_path, video_path)
+    _, fixed_path = web_output_path(video_path)
+    session = models.AnalysisSession(filename=os.path.basename(video_path))
+    db.add(session)
+    db.commit()
+
+    # 1er intento: reempaqueta y el análisis se corta a mitad (tras varios puntos de control)
+    on_sample = pc.BeerCounterEngine._on_sample
+    samples = {"n": 0}
+    def crashing_on_sample(self, *args):
+        on_sample(self, *args)
+        samples["n"] += 1
+        if samples["n"] == 40:
+            raise _Crash()
+    monkeypatch.setattr(pc.BeerCounterEngine, "_on_sample", crashing_on_sample)
+    with pytest.raises(_Crash):
+        worker.process_video_job(session.id, video_path, db)
+    assert os.path.exists(fixed_path)
+
+    # 2º intento: el remux ya existe; se analiza él (no el original) y se reanuda
+    monkeypatch.setattr(pc.BeerCounterEngine, "_on_sample", on_sample)
+    analyzed = []
+    process_video = pc.BeerCounterEngine.process_video
+    def spy(self, path, workers=pc.PARALLEL_WORKERS, **kwargs):
+        analyzed.append((path, workers))
+        return process_video(self, path, workers=workers, **kwargs)
+    monkeypatch.setattr(pc.BeerCounterEngine, "process_video", spy)
+    worker.process_video_job(session.id, video_path, db)
+
+    assert analyzed == [(fixed_path, worker.ENGINE_WORKERS)]
+    db.refresh(session)
+    assert session.status == "COMPLETED"
+    assert session.filename == os.path.basename(fixed_path)
+    assert session.profile_data["resumed"]
+    assert session.tap_data == {
+        name: {"count": count, "seconds": session.tap_data[name]["seconds"]} for name, count in truth["taps"].items()
+    }
+
+@pytest.fixture
+def healthy_job(synthetic_video, db, tmp_path, monkeypatch):
+    """Sesión con un vídeo sano listo para process_video_job (devuelve su id, ruta y las notificaciones)"""
+    video_dir, _ = synthetic_video
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(worker, "COORDS_FILE", os.path.join(video_dir, "coords_dual.txt"))
+    monkeypatch.setattr(worker, "REFS_FOLDER", video_dir)
+    video_path = str(tmp_path / "v.mp4")
+    shutil.copy(os.path.join(video_dir, "v.mp4"), video_path)
+    session = models.AnalysisSession(filename="v.mp4", content_hash="abc")
+    db.add(session)
+    db.commit()
+    return session.id, video_path, []
+
+def _status(db, session_id):
+    db.expire_all()
+    return db.query(models.AnalysisSession).filter(models.AnalysisSession.id == session_id).one().status
+
+def test_failure_after_recording_events_rolls_them_back(healthy_job, db, monkeypatch):
+    session_id, video_path, messages = healthy_job
+    def failing_record(*args):
+        raise RuntimeError("fallo al guardar métricas")
+    monkeypatch.setattr(metrics, "record_analysis", failing_record)
+
+    with pytest.raises(RuntimeError):
+        worker.process_video_job(session_id, video_path, db, messages.append)
+
+    assert _status(db, session_id) == "ERROR"
+    assert db.query(models.PourEvent).count() == 0
+    assert db.query(models.DailyConsumption).count() == 0
+    assert messages[-1] == {"type": "status", "status": "ERROR"}
+
+def test_failed_commit_reports_the_error(healthy_job, db, monkeypatch):
+    session_id, video_path, messages = healthy_job
+    record = analytics.record_session_events
+    def conflicting_record(db, session, events):
+        record(db, session, events)
+        # Dos filas con la misma clave: el commit del resultado falla al volcarlas
+        db.add(models.MetricCounter(name="x", labels=""))
+        db.add(models.MetricCounter(name="x", labels=""))
+    monkeypatch.setattr(analytics, "record_session_events", conflicting_record)
+
+    with pytest.raises(Exception) as info:
+        worker.process_video_job(session_id, video_path, db, messages.append)
+
+    assert "PendingRollback" not in type(info.value).__name__
+    assert _status(db, session_id) == "ERROR"
+    assert db.query(models.PourEvent).count() == 0
+    assert messages[-1] == {"type": "status", "status": "ERROR"}
+
+def test_cache_failure_keeps_the_session_completed(healthy_job, db, monkeypatch):
+    session_id, video_path, messages = healthy_job
+    def failing_store(*args):
+        raise RuntimeError("caché no disponible")
+    monkeypatch.setattr(result_cache, "store", failing_store)
+
+    worker.process_video_job(session_id, video_path, db, messages.append)
+
+    assert _status(db, session_id) == "COMPLETED"
+    assert db.query(models.PourEvent).count() > 0
+    assert messages[-1] == {"type": "status", "status": "COMPLETED"}